@@ -0,0 +1,32 @@
+import os
+import socket
+import hashlib
+import tempfile
+
+
+def userDataDir(*parts):
+    """Per-user directory for detector state, created on first use."""
+    base = os.environ.get("ELP_DETECTOR_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".elp_detector")
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def pathKey(path):
+    """Short stable key for a folder path, used to name per-folder state files."""
+    normPath = os.path.normcase(os.path.abspath(path))
+    return hashlib.sha1(normPath.encode("utf-8")).hexdigest()[:16]
+
+
+def hostName():
+    """Name of this computer, used to keep per-machine state apart."""
+    return socket.gethostname() or "localhost"
+
+
+def scratchDir(prefix):
+    """New temporary folder, in memory-backed storage where the OS provides it."""
+    parent = None
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        parent = "/dev/shm"
+    return tempfile.mkdtemp(prefix=prefix, dir=parent)
@@ -0,0 +1,299 @@
+"""Timed trials that find the fastest run settings for this computer.
+
+    python autotune.py --script_dir <script folder> --sound_dir <sound folder>
+
+The fastest settings are saved as this computer's profile, which the GUI
+and detector_cli.py use for options that are not set explicitly.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+import sharding
+from app_dirs import userDataDir, hostName
+from detector_runner import DetectorRun, CANCELLED
+from process_control import defaultSlots
+from process_control import ProcessLimits
+from time_windows import writeClip
+
+
+PROFILE_VERSION = 1
+DEFAULT_CLIP_SECONDS = 120
+MAX_CLIPS = 64
+BATCH_SIZES = (2, 4, 8)
+CLIP_TAG = "__clip"
+
+
+def profilePath():
+    """Where this computer's profile is saved."""
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", hostName())
+    return os.path.join(userDataDir("tuning"), name + ".json")
+
+
+class TuningProfile:
+    """Run settings found fastest on one computer.
+
+    threads of None leaves torch to choose. A profile is only loaded on
+    the computer it was made on, and not after its number of cores
+    changed, as when a virtual machine is resized.
+    """
+
+    def __init__(self, processes=1, threads=None, streaming=False, streamBatchSize=4,
+                 throughput=0.0, trials=(), host=None, cpuCount=None, tuned=None):
+        self.processes = processes
+        self.threads = threads
+        self.streaming = streaming
+        self.streamBatchSize = streamBatchSize
+        self.throughput = throughput
+        self.trials = list(trials)
+        self.host = host or hostName()
+        self.cpuCount = cpuCount or os.cpu_count() or 1
+        self.tuned = tuned or time.time()
+
+    @classmethod
+    def load(cls, path=None):
+        """This computer's profile, or None if it has not been tuned."""
+        try:
+            with open(path or profilePath()) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != PROFILE_VERSION:
+            return None
+        del data["version"]
+        try:
+            profile = cls(**data)
+        except TypeError:
+            return None
+        if profile.host != hostName() or profile.cpuCount != (os.cpu_count() or 1):
+            return None
+        return profile
+
+    def save(self, path=None):
+        path = path or profilePath()
+        data = dict(vars(self), version=PROFILE_VERSION)
+        tmpPath = path + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmpPath, path)
+
+    def runOptions(self):
+        """DetectorRun options for these settings, apart from the thread limit."""
+        return {"shards": self.processes, "maxProcesses": self.processes,
+                "streaming": self.streaming, "streamBatchSize": self.streamBatchSize}
+
+    def describe(self):
+        text = "%d %s with %s threads each" % (
+            self.processes, "process" if self.processes == 1 else "processes",
+            self.threads or "automatic")
+        if self.streaming:
+            text += ", overlapping stages in batches of %d" % self.streamBatchSize
+        return text
+
+
+def makeClips(files, destDir, count, clipSeconds=DEFAULT_CLIP_SECONDS):
+    """Write count clips spread over the recordings in files into destDir.
+
+    Clips are cut from the middle of recordings chosen evenly through the
+    folder, moving along a recording when there are fewer recordings than
+    clips. Recordings that are not WAV files are used whole. Returns the
+    total audio seconds of the clips, 0 when lengths are unknown.
+    """
+    os.makedirs(destDir, exist_ok=True)
+    audioSeconds = 0.0
+    clipsCut = {}
+    whole = set()
+    for index in range(count):
+        path = files[index * len(files) // count]
+        if path in whole:
+            continue
+        stem, ext = os.path.splitext(os.path.basename(path))
+        duration = sharding.wavDuration(path) or 0.0
+        # Clips of the same recording follow each other from its middle
+        repeat = clipsCut.get(path, 0)
+        clipsCut[path] = repeat + 1
+        start = max(0.0, duration / 2 - clipSeconds / 2) + repeat * clipSeconds
+        if start + clipSeconds > duration:
+            start = max(0.0, duration - clipSeconds) * (repeat % 2)
+        clipPath = os.path.join(destDir, "%s%s%02d%s" % (stem, CLIP_TAG, index, ext))
+        seconds = writeClip(path, clipPath, start, clipSeconds)
+        if seconds is None:
+            sharding.stageFiles([path], destDir)
+            whole.add(path)
+        else:
+            audioSeconds += seconds
+    return audioSeconds
+
+
+class Tuner:
+    """Times runs over clips of a sound folder with different settings.
+
+    Every combination of processes and threads that fills this
+    computer's cores (within its memory) is tried, along with one
+    process with automatic threads as runs use untuned. The fastest is
+    then tried with overlapping stages in each of BATCH_SIZES. All trials
+    process the same clips, so their times compare directly. limits'
+    CPU list and priority apply to every trial.
+    """
+
+    def __init__(self, scriptDir, dataDir, output=print, clipSeconds=DEFAULT_CLIP_SECONDS,
+                 clips=None, limits=None):
+        self.scriptDir = scriptDir
+        self.dataDir = dataDir
+        self.output = output
+        self.clipSeconds = clipSeconds
+        self.limits = limits or ProcessLimits()
+        self.cores = len(self.limits.cpus) if self.limits.cpus else (os.cpu_count() or 1)
+        self.maxProcesses = max(1, min(self.cores, defaultSlots()))
+        self.clips = clips or min(MAX_CLIPS, max(4, 2 * self.maxProcesses))
+        self._lock = threading.Lock()
+        self._run = None
+        self._cancelled = False
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            run = self._run
+        if run is not None:
+            run.cancel()
+
+    def candidates(self):
+        """(processes, threads) pairs to try, untuned settings first."""
+        pairs = [(1, None)]
+        threads = 1
+        while threads <= self.cores:
+            processes = min(self.maxProcesses, max(1, self.cores // threads))
+            if (processes, threads) not in pairs:
+                pairs.append((processes, threads))
+            threads *= 2
+        return pairs
+
+    def _trial(self, clipDir, processes, threads, streaming=False, batchSize=4):
+        """Seconds a run over the clips takes, or None if it failed."""
+        outputDir = tempfile.mkdtemp(prefix="elp_tune_")
+        lines = []
+
+        def keepTail(text):
+            lines.append(text)
+            del lines[:-20]
+
+        limits = ProcessLimits(threads=threads, cpus=self.limits.cpus,
+                               lowPriority=self.limits.lowPriority)
+        run = DetectorRun(self.scriptDir, clipDir, outputDir, output=keepTail,
+                          shards=processes, maxProcesses=processes, streaming=streaming,
+                          streamBatchSize=batchSize, limits=limits, resourceLog=False,
+                          runLog=False, indexResults=False, history=False)
+        with self._lock:
+            if self._cancelled:
+                return None
+            self._run = run
+        try:
+            started = time.monotonic()
+            returncode = run.run()
+            elapsed = time.monotonic() - started
+        finally:
+            with self._lock:
+                self._run = None
+            shutil.rmtree(outputDir, ignore_errors=True)
+        if returncode != 0:
+            if returncode != CANCELLED:
+                self.output("Trial failed:\n" + "".join(lines))
+            return None
+        return elapsed
+
+    def run(self):
+        """Run the trials and save the fastest settings. Returns the TuningProfile."""
+        files = sharding.listSoundFiles(self.dataDir)
+        if not files:
+            self.output("The sound folder has no recordings to tune with\n")
+            return None
+        clipDir = tempfile.mkdtemp(prefix="elp_tune_clips_")
+        try:
+            audioSeconds = makeClips(files, clipDir, self.clips, self.clipSeconds)
+            self.output("Timing runs over %d clips (%.0f s of audio) on %d cores\n"
+                        % (self.clips, audioSeconds, self.cores))
+            # Reads the clips and scripts into the disk cache so the first
+            # timed trial is not slowed by it
+            self.output("Warming up\n")
+            if self._trial(clipDir, 1, None) is None:
+                return None
+
+            trials = []
+
+            def record(processes, threads, streaming, batchSize):
+                if self.cancelled:
+                    return
+                seconds = self._trial(clipDir, processes, threads, streaming, batchSize)
+                if seconds is None:
+                    return
+                trial = {"processes": processes, "threads": threads, "streaming": streaming,
+                         "streamBatchSize": batchSize, "seconds": seconds}
+                trials.append(trial)
+                profile = TuningProfile(processes, threads, streaming, batchSize)
+                self.output("%s: %.1f s\n" % (profile.describe(), seconds))
+
+            for processes, threads in self.candidates():
+                record(processes, threads, False, 4)
+            if not trials:
+                return None
+            best = min(trials, key=lambda trial: trial["seconds"])
+            for batchSize in BATCH_SIZES:
+                record(best["processes"], best["threads"], True, batchSize)
+            if self.cancelled:
+                self.output("Tuning cancelled\n")
+                return None
+        finally:
+            shutil.rmtree(clipDir, ignore_errors=True)
+
+        best = min(trials, key=lambda trial: trial["seconds"])
+        throughput = audioSeconds / best["seconds"] if best["seconds"] > 0 else 0.0
+        profile = TuningProfile(best["processes"], best["threads"], best["streaming"],
+                                best["streamBatchSize"], throughput, trials)
+        profile.save()
+        untuned = trials[0]["seconds"]
+        self.output("Fastest: %s, %.1fx faster than untuned settings. Saved to %s\n"
+                    % (profile.describe(), untuned / best["seconds"] if best["seconds"] else 1,
+                       profilePath()))
+        return profile
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Find the fastest run settings for this computer")
+    parser.add_argument("--script_dir", required=True,
+                        help="folder containing Inference_pipeline.py")
+    parser.add_argument("--sound_dir", required=True,
+                        help="folder of recordings to take clips from")
+    parser.add_argument("--clip_seconds", type=float, default=DEFAULT_CLIP_SECONDS,
+                        help="length of each clip (default: %(default)s)")
+    parser.add_argument("--clips", type=int,
+                        help="number of clips (default: twice the processes tried, "
+                        "at most %d)" % MAX_CLIPS)
+    args = parser.parse_args(argv)
+
+    def write(text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    tuner = Tuner(args.script_dir, args.sound_dir, output=write,
+                  clipSeconds=args.clip_seconds, clips=args.clips)
+    try:
+        return 0 if tuner.run() is not None else 1
+    except KeyboardInterrupt:
+        tuner.cancel()
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""End-to-end benchmark of the GUI driving the detector.
+
+Creates a synthetic sound folder and a script folder holding
+standin_pipeline.py as Inference_pipeline.py, then clicks Run through
+GuiController for each scenario and measures the GUI's own overhead:
+
+    spawnLatencyMs     Run clicked until the first pipeline process exists
+    firstOutputMs      Run clicked until the pipeline's first line reaches the view
+    linesPerSec        output lines delivered to outputView per second
+    maxStallMs/p99StallMs  event loop stalls while the run was in progress
+    rssGrowthMB        GUI process memory after the run minus before it
+
+Results are saved as JSON so versions can be compared:
+
+    python benchmarks/bench_e2e.py --output before.json
+    (change things)
+    python benchmarks/bench_e2e.py --output after.json
+    python benchmarks/bench_e2e.py --compare before.json after.json
+
+Set QT_QPA_PLATFORM=offscreen to run without a display.
+"""
+
+import os
+import sys
+import json
+import time
+import wave
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import psutil
+from PyQt5.QtCore import QTimer, QEventLoop
+from PyQt5.QtWidgets import QApplication
+
+import gui
+from gui import DetectorUi, GuiController
+from detector_runner import PIPELINE_SCRIPT, MODEL_0, MODEL_1
+
+
+TICK_MS = 10
+RESULT_FORMAT = 1
+
+# Metrics where a larger value is better; for the rest smaller is better
+HIGHER_IS_BETTER = {"linesPerSec"}
+
+SCENARIOS = {
+    "single": {},
+    "shards": {"shards": 4},
+    "streaming": {"streaming": True},
+}
+
+
+def makeSoundFolder(soundDir, files, secondsPerFile, sampleRate=2000):
+    """Write silent 16-bit mono WAV files so durations are known."""
+    os.makedirs(soundDir)
+    silence = b"\0\0" * sampleRate
+    for i in range(files):
+        with wave.open(os.path.join(soundDir, "rec%03d.wav" % i), "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sampleRate)
+            for _ in range(secondsPerFile):
+                wav.writeframes(silence)
+
+
+def makeScriptFolder(scriptDir):
+    os.makedirs(os.path.join(scriptDir, os.path.dirname(MODEL_0)))
+    shutil.copy(os.path.join(BENCH_DIR, "standin_pipeline.py"),
+                os.path.join(scriptDir, PIPELINE_SCRIPT))
+    for model in (MODEL_0, MODEL_1):
+        open(os.path.join(scriptDir, model), "wb").close()
+
+
+def runScenario(app, scriptDir, soundDir, outputDir, options):
+    view = DetectorUi()
+    controller = GuiController(view)
+    view.scriptFolderEdit.setText(scriptDir)
+    view.soundFolderEdit.setText(soundDir)
+    view.outputFolderEdit.setText(outputDir)
+    view.shardsSpin.setValue(options.get("shards", 1))
+    view.streamingCheck.setChecked(options.get("streaming", False))
+    app.processEvents()
+
+    rss = psutil.Process().memory_info().rss
+    stalls = []
+    marks = {}
+    lines = [0]
+    lastTick = [time.perf_counter()]
+
+    def onTick():
+        now = time.perf_counter()
+        stalls.append(now - lastTick[0] - TICK_MS / 1000)
+        lastTick[0] = now
+        if "spawn" not in marks and detectorRun.pids():
+            marks["spawn"] = now
+
+    def onOutput(text):
+        # Lines from the runner itself can arrive before the pipeline starts
+        if "firstOutput" not in marks and "window" in text:
+            marks["firstOutput"] = time.perf_counter()
+        lines[0] += text.count("\n")
+
+    ticker = QTimer(interval=TICK_MS, timeout=onTick)
+    loop = QEventLoop()
+
+    start = time.perf_counter()
+    view.runBtn.click()
+    worker = controller.worker
+    detectorRun = worker.detectorRun
+    worker.writeOutput.connect(onOutput)
+    worker.finished.connect(loop.quit)
+    ticker.start()
+    loop.exec_()
+    elapsed = time.perf_counter() - start
+    ticker.stop()
+    controller.thread.wait()
+    app.processEvents()
+
+    growth = psutil.Process().memory_info().rss - rss
+    view.close()
+    stalls.sort()
+    return {
+        "seconds": elapsed,
+        "spawnLatencyMs": (marks.get("spawn", start) - start) * 1000,
+        "firstOutputMs": (marks.get("firstOutput", start) - start) * 1000,
+        "lines": lines[0],
+        "linesPerSec": lines[0] / elapsed,
+        "maxStallMs": stalls[-1] * 1000 if stalls else 0.0,
+        "p99StallMs": stalls[int(len(stalls) * 0.99)] * 1000 if stalls else 0.0,
+        "rssGrowthMB": growth / 1024 ** 2,
+    }
+
+
+def gitRevision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def runBenchmarks(args):
+    os.environ["ELP_BENCH_LINES_PER_FILE"] = str(args.lines_per_file)
+    os.environ["ELP_BENCH_LINE_RATE"] = str(args.line_rate)
+    os.environ["ELP_BENCH_SPECT_KB"] = str(args.spect_kb)
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpDir:
+        scriptDir = os.path.join(tmpDir, "scripts")
+        soundDir = os.path.join(tmpDir, "sound")
+        makeScriptFolder(scriptDir)
+        makeSoundFolder(soundDir, args.files, args.seconds_per_file)
+
+        for name in args.scenarios:
+            runs = []
+            for i in range(args.repeat):
+                outputDir = os.path.join(tmpDir, "output_%s_%d" % (name, i))
+                os.makedirs(outputDir)
+                runs.append(runScenario(app, scriptDir, soundDir, outputDir,
+                                        SCENARIOS[name]))
+            # The median run of each metric is the least noisy figure
+            results[name] = {metric: sorted(run[metric] for run in runs)[len(runs) // 2]
+                             for metric in runs[0]}
+
+    return {
+        "format": RESULT_FORMAT,
+        "version": gui.__version__,
+        "revision": gitRevision(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                    "cpus": os.cpu_count()},
+        "config": {"files": args.files, "secondsPerFile": args.seconds_per_file,
+                   "linesPerFile": args.lines_per_file, "lineRate": args.line_rate,
+                   "spectKB": args.spect_kb, "repeat": args.repeat},
+        "results": results,
+    }
+
+
+def printResults(report):
+    for name, metrics in report["results"].items():
+        print(name)
+        for metric, value in metrics.items():
+            print("    %-16s %12.2f" % (metric, value))
+
+
+def compare(baseline, current, threshold):
+    """Print metric changes between two result files. Returns the regressions."""
+    if baseline["config"] != current["config"]:
+        print("warning: the two results were measured with different settings")
+    regressions = []
+    for name, metrics in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        print(name)
+        for metric, value in metrics.items():
+            if metric not in before:
+                continue
+            old = before[metric]
+            change = (value - old) / old * 100 if old else 0.0
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = ""
+            if worse > threshold and metric != "lines":
+                flag = "  REGRESSION"
+                regressions.append((name, metric))
+            print("    %-16s %12.2f -> %12.2f  %+7.1f%%%s" % (metric, old, value, change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the detector GUI")
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--seconds_per_file", type=int, default=60)
+    parser.add_argument("--lines_per_file", type=int, default=2000)
+    parser.add_argument("--line_rate", type=float, default=0,
+                        help="output lines per second per process, 0 for unlimited")
+    parser.add_argument("--spect_kb", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS),
+                        default=list(SCENARIOS))
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="compare two saved results instead of running")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="percent change reported as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        return 1 if compare(baseline, current, args.threshold) else 0
+
+    report = runBenchmarks(args)
+    printResults(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
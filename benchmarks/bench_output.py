@@ -0,0 +1,110 @@
+"""Output path benchmark.
+
+Runs SubprocessWorker against the stand-in pipeline (standin_pipeline.py)
+printing lines as fast as it can over one recording, and reports how many
+lines per second reach outputView and how long the GUI event loop was
+stalled while they were arriving.
+
+    python benchmarks/bench_output.py --lines 200000
+
+Set QT_QPA_PLATFORM=offscreen to run without a display.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtCore import QThread, QTimer, QEventLoop
+from PyQt5.QtWidgets import QApplication
+
+from gui import DetectorUi, SubprocessWorker
+from bench_e2e import makeScriptFolder, makeSoundFolder
+
+
+TICK_MS = 10
+
+
+def runBenchmark(lines, maxLogLines):
+    # Both stages print a line per window of the one recording
+    os.environ["ELP_BENCH_LINES_PER_FILE"] = str(lines // 2)
+    os.environ["ELP_BENCH_LINE_RATE"] = "0"
+    view = DetectorUi(maxLogLines=maxLogLines)
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        scriptDir = os.path.join(tmpDir, "scripts")
+        soundDir = os.path.join(tmpDir, "sound")
+        outputDir = os.path.join(tmpDir, "output")
+        makeScriptFolder(scriptDir)
+        makeSoundFolder(soundDir, 1, 1)
+        os.makedirs(outputDir)
+
+        received = [0]
+
+        def onOutput(text):
+            received[0] += text.count("\n")
+            view.appendDisplayText(text)
+
+        # A repeating timer whose lateness shows how long the event loop was blocked
+        stalls = []
+        lastTick = [time.perf_counter()]
+
+        def onTick():
+            now = time.perf_counter()
+            stalls.append(now - lastTick[0] - TICK_MS / 1000)
+            lastTick[0] = now
+
+        ticker = QTimer(interval=TICK_MS, timeout=onTick)
+
+        thread = QThread()
+        worker = SubprocessWorker(scriptDir, soundDir, outputDir, history=False)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.writeOutput.connect(onOutput)
+
+        loop = QEventLoop()
+        worker.finished.connect(loop.quit)
+
+        ticker.start()
+        start = time.perf_counter()
+        thread.start()
+        loop.exec_()
+        elapsed = time.perf_counter() - start
+        ticker.stop()
+
+        thread.quit()
+        thread.wait()
+
+    stalls.sort()
+    return {
+        "lines": received[0],
+        "seconds": elapsed,
+        "linesPerSec": received[0] / elapsed,
+        "maxStallMs": stalls[-1] * 1000 if stalls else 0.0,
+        "p99StallMs": stalls[int(len(stalls) * 0.99)] * 1000 if stalls else 0.0,
+        "viewLines": view.outputView.blockCount(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the detector output path")
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("--max_log_lines", type=int, default=5000)
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    result = runBenchmark(args.lines, args.max_log_lines)
+    app.quit()
+    print("lines delivered:   %d" % result["lines"])
+    print("elapsed:           %.2f s" % result["seconds"])
+    print("lines/sec:         %.0f" % result["linesPerSec"])
+    print("max loop stall:    %.1f ms" % result["maxStallMs"])
+    print("p99 loop stall:    %.1f ms" % result["p99StallMs"])
+    print("lines kept in view: %d" % result["viewLines"])
+
+
+if __name__ == '__main__':
+    main()
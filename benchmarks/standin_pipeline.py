@@ -0,0 +1,86 @@
+"""Stand-in for Inference_pipeline.py used by the benchmarks and tests.
+
+Accepts the real pipeline's arguments and does no detection work. For each
+sound file it prints ELP_BENCH_LINES_PER_FILE lines at ELP_BENCH_LINE_RATE
+lines per second (0 for as fast as possible), writes a spectrogram file of
+ELP_BENCH_SPECT_KB kilobytes, and reports progress like the real pipeline.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+
+LINES_PER_FILE = int(os.environ.get("ELP_BENCH_LINES_PER_FILE", "1000"))
+LINE_RATE = float(os.environ.get("ELP_BENCH_LINE_RATE", "0"))
+SPECT_KB = int(os.environ.get("ELP_BENCH_SPECT_KB", "256"))
+
+
+def parseArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--process_data", action="store_true")
+    parser.add_argument("--make_predictions", action="store_true")
+    parser.add_argument("--model_0")
+    parser.add_argument("--model_1")
+    parser.add_argument("--data_dir")
+    parser.add_argument("--spect_out")
+    parser.add_argument("--spect_path")
+    return parser.parse_args()
+
+
+def progressWriter():
+    fd = os.environ.get("ELP_PROGRESS_FD")
+    if fd is None:
+        return lambda **event: None
+    stream = os.fdopen(int(fd), "w", buffering=1)
+    return lambda **event: stream.write(json.dumps(event) + "\n")
+
+
+def emitLines(stage, name):
+    interval = 1.0 / LINE_RATE if LINE_RATE > 0 else 0.0
+    nextTime = time.perf_counter()
+    for i in range(LINES_PER_FILE):
+        print("%s %s: window %d score=0.123" % (stage, name, i))
+        if interval:
+            nextTime += interval
+            delay = nextTime - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+
+def main():
+    args = parseArgs()
+    report = progressWriter()
+
+    if args.process_data:
+        started = time.perf_counter()
+        for name in sorted(os.listdir(args.data_dir)):
+            emitLines("spectrogram", name)
+            stem = os.path.splitext(name)[0]
+            with open(os.path.join(args.spect_out, stem + "_spect.npy"), "wb") as spect:
+                spect.write(os.urandom(SPECT_KB * 1024))
+        report(event="stage", stage="spectrograms",
+               seconds=time.perf_counter() - started)
+
+    if args.make_predictions:
+        started = time.perf_counter()
+        spectDir = args.spect_path or args.spect_out
+        outputDir = args.spect_out or spectDir
+        with open(os.path.join(outputDir, "predictions.csv"), "w") as predictions:
+            predictions.write("file,start,end,score\n")
+            for name in sorted(os.listdir(spectDir)):
+                if not name.endswith("_spect.npy"):
+                    continue
+                wavName = name[:-len("_spect.npy")] + ".wav"
+                emitLines("predict", wavName)
+                predictions.write("%s,10.0,15.0,0.9\n" % wavName)
+                report(event="file_done", file=wavName)
+        report(event="stage", stage="predictions",
+               seconds=time.perf_counter() - started)
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
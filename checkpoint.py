@@ -0,0 +1,86 @@
+"""Durable record of a run's progress, so an interrupted run can be resumed."""
+
+import os
+import json
+import time
+
+
+CHECKPOINT_NAME = "elp_checkpoint.json"
+CHECKPOINT_VERSION = 1
+
+
+def _samePath(a, b):
+    return os.path.normcase(os.path.abspath(a)) == os.path.normcase(os.path.abspath(b))
+
+
+class Checkpoint:
+    """Checkpoint stored in an output folder while a run is in progress.
+
+    It lists the recordings the run set out to process and those whose
+    results have already been merged into the output folder. It is
+    rewritten atomically and synced to disk after every completed group of
+    recordings, so after a crash or power loss it still matches the
+    results on disk. A run that finishes removes it.
+    """
+
+    def __init__(self, outputDir):
+        self.path = os.path.join(outputDir, CHECKPOINT_NAME)
+        self.dataDir = None
+        self.files = []
+        self.done = set()
+        self.startTime = None
+
+    @classmethod
+    def begin(cls, outputDir, dataDir, files):
+        checkpoint = cls(outputDir)
+        checkpoint.dataDir = os.path.abspath(dataDir)
+        checkpoint.files = [os.path.abspath(path) for path in files]
+        checkpoint.startTime = time.time()
+        checkpoint.save()
+        return checkpoint
+
+    @classmethod
+    def load(cls, outputDir):
+        """The checkpoint of an interrupted run in outputDir, or None."""
+        checkpoint = cls(outputDir)
+        try:
+            with open(checkpoint.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != CHECKPOINT_VERSION:
+            return None
+        checkpoint.dataDir = data["dataDir"]
+        checkpoint.files = data["files"]
+        checkpoint.done = set(data["done"])
+        checkpoint.startTime = data.get("startTime")
+        return checkpoint
+
+    def matches(self, dataDir):
+        return _samePath(self.dataDir, dataDir)
+
+    def remaining(self):
+        """Recordings still to be processed that are still in the sound folder."""
+        return [path for path in self.files
+                if path not in self.done and os.path.exists(path)]
+
+    def markDone(self, files):
+        self.done.update(os.path.abspath(path) for path in files)
+        self.save()
+
+    def save(self):
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump({"version": CHECKPOINT_VERSION, "dataDir": self.dataDir,
+                       "startTime": self.startTime, "files": self.files,
+                       "done": sorted(self.done)}, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, self.path)
+
+    def finish(self):
+        """Remove the checkpoint once the run is complete."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,225 @@
+"""Speed and accuracy of the model variants against the original models.
+
+    python compare_models.py --script_dir <script folder> --sound_dir <sample folder>
+
+Every variant runs over the same sample recordings with the same settings.
+The original models' detections are the reference: a variant's detection
+matches one of them when it is in the same recording and starts within
+the tolerance. Recall is the share of reference detections a variant
+found, precision the share of its detections that are in the reference.
+"""
+
+import os
+import sys
+import time
+import bisect
+import shutil
+import argparse
+import tempfile
+import threading
+
+from detector_runner import DetectorRun, CANCELLED, MODEL_0, MODEL_1
+from model_variants import variantModels, VariantBuildError, VARIANTS, VARIANT_NAMES
+from results_store import ResultsStore
+from warm_worker import WarmWorkerClient
+
+
+DEFAULT_TOLERANCE = 1.0
+
+
+def readDetections(outputDir):
+    """{recording: [(start, score), ...]} from an output folder's result tables."""
+    store = ResultsStore(outputDir)
+    try:
+        store.ingest()
+        rows = store.query(orderBy="start", descending=False, limit=max(1, store.count()))
+    finally:
+        store.close()
+    detections = {}
+    for name, start, _, score, _ in rows:
+        detections.setdefault(name, []).append((start, score))
+    return detections
+
+
+def matchDetections(reference, detections, tolerance=DEFAULT_TOLERANCE):
+    """(matches, score differences) pairing detections with reference ones.
+
+    Both are dicts as returned by readDetections. Each reference detection
+    is paired with at most one detection, the closest unpaired one.
+    """
+    matches = 0
+    scoreDiffs = []
+    for recording, expected in reference.items():
+        found = sorted(detections.get(recording, []))
+        starts = [start for start, _ in found]
+        used = set()
+        for start, score in sorted(expected):
+            best = None
+            index = bisect.bisect_left(starts, start - tolerance)
+            while index < len(starts) and starts[index] <= start + tolerance:
+                if index not in used and (best is None or
+                                          abs(starts[index] - start) < abs(starts[best] - start)):
+                    best = index
+                index += 1
+            if best is None:
+                continue
+            used.add(best)
+            matches += 1
+            if score is not None and found[best][1] is not None:
+                scoreDiffs.append(abs(found[best][1] - score))
+    return matches, scoreDiffs
+
+
+class ModelComparison:
+    """Times runs of the original models and each variant over a sample folder."""
+
+    def __init__(self, scriptDir, dataDir, output=print, variants=VARIANTS,
+                 tolerance=DEFAULT_TOLERANCE, runOptions=None):
+        self.scriptDir = scriptDir
+        self.dataDir = dataDir
+        self.output = output
+        self.variants = list(variants)
+        self.tolerance = tolerance
+        self.runOptions = runOptions or {}
+        self._lock = threading.Lock()
+        self._run = None
+        self._cancelled = False
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            run = self._run
+        if run is not None:
+            run.cancel()
+
+    def _timedRun(self, variant, outputDir):
+        """Seconds a run with variant (None for the original models) takes, or None."""
+        lines = []
+
+        def keepTail(text):
+            lines.append(text)
+            del lines[:-20]
+
+        run = DetectorRun(self.scriptDir, self.dataDir, outputDir, output=keepTail,
+                          modelVariant=variant, resourceLog=False, runLog=False,
+                          history=False, **self.runOptions)
+        with self._lock:
+            if self._cancelled:
+                return None
+            self._run = run
+        try:
+            started = time.monotonic()
+            returncode = run.run()
+            elapsed = time.monotonic() - started
+        finally:
+            with self._lock:
+                self._run = None
+        if returncode != 0:
+            if returncode != CANCELLED:
+                self.output("Run failed:\n" + "".join(lines))
+            return None
+        return elapsed
+
+    def run(self):
+        """Run the comparison and print a table of it. Returns its rows as dicts."""
+        if WarmWorkerClient.connect(self.scriptDir) is not None:
+            self.output("A warm worker is running with the original models loaded; "
+                        "stop it for a fair comparison\n")
+        variants = []
+        for variant in self.variants:
+            try:
+                variantModels(self.scriptDir, variant, [MODEL_0, MODEL_1],
+                              output=self.output)
+            except VariantBuildError as e:
+                self.output("%s: could not be built: %s\n" % (VARIANT_NAMES[variant], e))
+                continue
+            variants.append(variant)
+
+        workDir = tempfile.mkdtemp(prefix="elp_compare_")
+        try:
+            # Reads the recordings into the disk cache so the first timed
+            # run is not slowed by it
+            self.output("Warming up\n")
+            referenceDir = os.path.join(workDir, "reference")
+            os.makedirs(referenceDir)
+            if self._timedRun(None, referenceDir) is None:
+                return None
+            reference = readDetections(referenceDir)
+
+            rows = []
+            for variant in [None] + variants:
+                outputDir = os.path.join(workDir, variant or "original")
+                os.makedirs(outputDir)
+                name = VARIANT_NAMES[variant] if variant else "Original"
+                self.output("Timing %s models\n" % name)
+                seconds = self._timedRun(variant, outputDir)
+                if seconds is None:
+                    if self._cancelled:
+                        self.output("Comparison cancelled\n")
+                        return None
+                    continue
+                detections = readDetections(outputDir)
+                matches, scoreDiffs = matchDetections(reference, detections, self.tolerance)
+                rows.append({"variant": variant or "original", "name": name,
+                             "seconds": seconds,
+                             "detections": sum(len(d) for d in detections.values()),
+                             "matches": matches,
+                             "meanScoreDiff": (sum(scoreDiffs) / len(scoreDiffs)
+                                               if scoreDiffs else None)})
+        finally:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+        self._report(rows, sum(len(d) for d in reference.values()))
+        return rows
+
+    def _report(self, rows, referenceCount):
+        original = rows[0]["seconds"] if rows and rows[0]["variant"] == "original" else None
+        self.output("\n%-16s %10s %8s %11s %8s %10s %11s\n" % (
+            "Models", "Time", "Speedup", "Detections", "Recall", "Precision", "Score diff"))
+        for row in rows:
+            recall = row["matches"] / referenceCount if referenceCount else 1.0
+            precision = row["matches"] / row["detections"] if row["detections"] else 1.0
+            row["recall"] = recall
+            row["precision"] = precision
+            self.output("%-16s %10s %8s %11d %7.1f%% %9.1f%% %11s\n" % (
+                row["name"], "%.1f s" % row["seconds"],
+                "%.2fx" % (original / row["seconds"]) if original and row["seconds"] else "-",
+                row["detections"], 100 * recall, 100 * precision,
+                "%.4f" % row["meanScoreDiff"] if row["meanScoreDiff"] is not None else "-"))
+        self.output("Detections match the original models' when they start within %g s. "
+                    "The original models run twice, so their own recall shows how much "
+                    "runs vary anyway\n" % self.tolerance)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare the speed and detections of the model variants")
+    parser.add_argument("--script_dir", required=True,
+                        help="folder containing Inference_pipeline.py")
+    parser.add_argument("--sound_dir", required=True,
+                        help="folder of sample recordings")
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS),
+                        help="variants to compare with the original models (default: all)")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="seconds apart two detections may start and still match "
+                        "(default: %(default)s)")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="parallel shards for every run (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    def write(text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    comparison = ModelComparison(args.script_dir, args.sound_dir, output=write,
+                                 variants=args.variants, tolerance=args.tolerance,
+                                 runOptions={"shards": args.shards})
+    try:
+        return 0 if comparison.run() is not None else 1
+    except KeyboardInterrupt:
+        comparison.cancel()
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
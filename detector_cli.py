@@ -0,0 +1,222 @@
+"""Command line entry point for running the detector without the GUI.
+
+    python detector_cli.py --script_dir <script folder> \
+        --sound_dir <sound file folder> --output_dir <output folder>
+
+The pipeline's output is streamed to stdout, or to --log_file, and the
+exit code is the pipeline's, or 130 if the run was cancelled. Nothing from PyQt5 is imported, so this runs
+on machines without a display and starts quickly enough to be launched
+for many small jobs from a scheduler.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+from detector_runner import DetectorRun, DEFAULT_STREAM_BATCH, CANCELLED
+from autotune import TuningProfile
+from spect_cache import GB
+from process_control import ProcessLimits, parseCpuList
+from remote_agent import parseAgentList, AGENT_TOKEN_ENV
+from time_windows import DEFAULT_OVERLAP_SECONDS
+from model_variants import VARIANTS
+
+# Exit code of a cancelled run, as a shell reports a command stopped by Ctrl+C
+EXIT_CANCELLED = 130
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the ELP detector without the GUI",
+        epilog="The exit code is the pipeline's, or %d if the run was cancelled."
+        % EXIT_CANCELLED)
+    parser.add_argument("--script_dir", required=True,
+                        help="folder containing Inference_pipeline.py")
+    parser.add_argument("--sound_dir", required=True,
+                        help="folder containing the sound files")
+    parser.add_argument("--output_dir", required=True,
+                        help="folder for spectrograms and results")
+    parser.add_argument("--log_file",
+                        help="append the pipeline output to this file instead of stdout")
+    parser.add_argument("--progress", action="store_true",
+                        help="write JSON progress snapshots to stderr")
+    parser.add_argument("--shards", type=int,
+                        help="split the sound folder into this many parallel shards "
+                        "(default: 1)")
+    parser.add_argument("--window_minutes", type=float, default=0,
+                        help="cut recordings longer than this into overlapping windows "
+                        "that are sharded like recordings")
+    parser.add_argument("--window_overlap", type=float, default=DEFAULT_OVERLAP_SECONDS,
+                        help="seconds each window overlaps the next (default: %(default)s); "
+                        "should be at least twice the longest call")
+    parser.add_argument("--model_variant", choices=("original",) + VARIANTS,
+                        default="original",
+                        help="run TorchScript or int8 quantized builds of the models, made "
+                        "on first use (compare them with compare_models.py)")
+    parser.add_argument("--max_processes", type=int,
+                        help="maximum pipeline processes at once (default: CPU count)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only process new or changed sound files")
+    parser.add_argument("--streaming", action="store_true",
+                        help="overlap spectrogram generation and prediction")
+    parser.add_argument("--spectrogram_processes", type=int,
+                        help="processes making spectrograms while others predict; "
+                        "implies --streaming (default: the number of shards)")
+    parser.add_argument("--prediction_processes", type=int,
+                        help="processes running the models on finished spectrograms; "
+                        "implies --streaming (default: the number of shards)")
+    parser.add_argument("--no_keep_spectrograms", action="store_true",
+                        help="do not write spectrograms to the output folder")
+    parser.add_argument("--cache_gb", type=float, default=0,
+                        help="spectrogram cache size in GB (0 disables the cache)")
+    parser.add_argument("--checkpoint", action="store_true",
+                        help="save results every few recordings so the run can be resumed")
+    parser.add_argument("--resume", action="store_true",
+                        help="resume an interrupted checkpointed run in the output folder")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep processing new recordings as they arrive, until Ctrl+C")
+    parser.add_argument("--no_resource_log", action="store_true",
+                        help="do not save CPU, memory and disk use to the output folder")
+    parser.add_argument("--no_run_log", action="store_true",
+                        help="do not save the output to elp_run_<date>_<time>.log in the output folder")
+    parser.add_argument("--no_index", action="store_true",
+                        help="do not index the results for the GUI's results panel")
+    parser.add_argument("--threads", type=int,
+                        help="threads per pipeline process (default: torch decides)")
+    parser.add_argument("--no_profile", action="store_true",
+                        help="ignore the settings autotune.py found fastest on this computer, "
+                        "which are otherwise used when none of --shards, --max_processes, "
+                        "--threads and --streaming are given")
+    parser.add_argument("--cpus", default="",
+                        help="run pipeline processes only on these CPUs, e.g. 0-3,6")
+    parser.add_argument("--low_priority", action="store_true",
+                        help="run pipeline processes below normal priority")
+    parser.add_argument("--agents", default="",
+                        help="remote_agent.py workers sharing the run, e.g. pc2:5890,pc3:5890")
+    parser.add_argument("--agent_token", default=os.environ.get(AGENT_TOKEN_ENV),
+                        help="token the agents were started with (default: $%s)"
+                        % AGENT_TOKEN_ENV)
+    args = parser.parse_args(argv)
+
+    try:
+        args.agents = parseAgentList(args.agents)
+    except ValueError as e:
+        parser.error("--agents: %s" % e)
+
+    if args.spectrogram_processes or args.prediction_processes:
+        args.streaming = True
+
+    try:
+        args.cpus = parseCpuList(args.cpus)
+    except ValueError:
+        parser.error("--cpus must be a list such as 0-3,6: %s" % args.cpus)
+
+    for name in ("script_dir", "sound_dir", "output_dir"):
+        if not os.path.isdir(getattr(args, name)):
+            parser.error("--%s is not a folder: %s" % (name, getattr(args, name)))
+    if os.path.samefile(args.sound_dir, args.output_dir):
+        parser.error("the output folder cannot be the same as the sound folder")
+    # The pipeline runs in the script folder, so relative paths would not resolve
+    for name in ("script_dir", "sound_dir", "output_dir"):
+        setattr(args, name, os.path.abspath(getattr(args, name)))
+    return args
+
+
+def _progressWriter(snapshot):
+    sys.stderr.write(json.dumps(snapshot) + "\n")
+    sys.stderr.flush()
+
+
+def _watch(args, write, runOptions):
+    """Process new recordings as they arrive until interrupted."""
+    from watch_folder import WatchSession
+    session = WatchSession(args.script_dir, args.sound_dir, args.output_dir, output=write,
+                           onStats=_progressWriter if args.progress else None,
+                           **_logOptions(args), **runOptions)
+    session.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        session.stop()
+    return 0
+
+
+def _logOptions(args):
+    """Options saving the resource log, the run log and the results index."""
+    return dict(resourceLog=not args.no_resource_log, runLog=not args.no_run_log,
+                indexResults=not args.no_index)
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+
+    logFile = None
+    if args.log_file:
+        logFile = open(args.log_file, "a", encoding="utf-8")
+        out = logFile
+    else:
+        out = sys.stdout
+
+    def write(text):
+        out.write(text)
+        out.flush()
+
+    streamBatchSize = DEFAULT_STREAM_BATCH
+    if not args.no_profile and args.shards is None and args.max_processes is None and \
+            args.threads is None and not args.streaming:
+        # The tuned settings were timed together, so they are used all or none
+        profile = TuningProfile.load()
+        if profile is not None:
+            write("Using the settings tuned for this computer: %s\n" % profile.describe())
+            args.shards = profile.processes
+            args.max_processes = profile.processes
+            args.threads = profile.threads
+            args.streaming = profile.streaming
+            streamBatchSize = profile.streamBatchSize
+
+    runOptions = dict(
+        shards=args.shards or 1, maxProcesses=args.max_processes, streaming=args.streaming,
+        streamBatchSize=streamBatchSize, spectrogramWorkers=args.spectrogram_processes,
+        predictionWorkers=args.prediction_processes,
+        keepSpectrograms=not args.no_keep_spectrograms,
+        cacheBudget=int(args.cache_gb * GB),
+        limits=ProcessLimits(args.threads, args.cpus, args.low_priority),
+        agents=args.agents, agentToken=args.agent_token,
+        windowSeconds=args.window_minutes * 60, windowOverlap=args.window_overlap,
+        modelVariant=None if args.model_variant == "original" else args.model_variant)
+
+    if args.watch:
+        try:
+            return _watch(args, write, runOptions)
+        finally:
+            if logFile is not None:
+                logFile.close()
+
+    detectorRun = None
+    try:
+        detectorRun = DetectorRun(
+            args.script_dir, args.sound_dir, args.output_dir, output=write,
+            incremental=args.incremental,
+            onProgress=_progressWriter if args.progress else None,
+            checkpoint=args.checkpoint, resumeInterrupted=args.resume,
+            **_logOptions(args), **runOptions)
+        returncode = detectorRun.run()
+    except KeyboardInterrupt:
+        # Ctrl+C reaches the pipeline too, but not a warm worker or grandchildren
+        if detectorRun is not None:
+            detectorRun.cancel()
+        returncode = CANCELLED
+    finally:
+        if logFile is not None:
+            logFile.close()
+
+    if returncode == CANCELLED:
+        return EXIT_CANCELLED
+    return returncode
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1020 @@
+"""Detector run logic, kept free of Qt so it can be reused outside the GUI."""
+
+import os
+import time
+import queue
+import shutil
+import sqlite3
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import sharding
+from app_dirs import scratchDir
+from manifest import Manifest, fileHash
+from checkpoint import Checkpoint
+from progress import ProgressTracker, ProgressChannel
+from process_control import ProcessLimits, defaultSlots, killTree, suspendTree, resumeTree
+from telemetry import ResourceMonitor, resourceLogName
+from results_store import ResultsStore
+from run_log import RunLog
+from run_history import RunHistory, isSlow, formatDuration
+from spect_cache import SpectrogramCache, pipelineParamsKey, attributeSpectrograms
+from warm_worker import WarmWorkerClient
+from time_windows import WindowSet, splitRecording, DEFAULT_OVERLAP_SECONDS
+from model_variants import variantModels, VariantBuildError, VARIANT_NAMES
+from remote_agent import AgentClient, AgentLost, AGENT_TOKEN_ENV
+from output_capture import pumpOutput, pumpText, LinePrefixer
+
+
+PIPELINE_SCRIPT = "Inference_pipeline.py"
+MODEL_0 = "2_Stage_Model/first_stage.pt"
+MODEL_1 = "2_Stage_Model/second_stage.pt"
+SHARD_DIR_NAME = "_shards"
+WINDOW_DIR_NAME = "windows"
+DEFAULT_STREAM_BATCH = 4
+DEFAULT_QUEUE_DEPTH = 2
+DEFAULT_CHECKPOINT_FILES = 8
+# Distributed runs cut more shards than there are slots, so fast computers
+# take more of them and a dropped agent loses little work
+SHARDS_PER_SLOT = 3
+# A run is compared with earlier ones once this much of it is done
+REGRESSION_CHECK_FRACTION = 0.25
+# Returned by DetectorRun.run when the run was cancelled
+CANCELLED = -1
+
+
+def pipelineCommand(args):
+    """Command line running the detector pipeline with args."""
+    return ["python", "-u", PIPELINE_SCRIPT] + list(args)
+
+
+def predictionArgs(dataDir, spectDir, models=(MODEL_0, MODEL_1)):
+    """Pipeline arguments for a full run over dataDir, writing to spectDir."""
+    return ["--process_data", "--make_predictions",
+            "--model_0", models[0],
+            "--model_1", models[1],
+            "--data_dir", dataDir, "--spect_out", spectDir]
+
+
+def dataGenerationArgs(dataDir, spectDir):
+    """Pipeline arguments that only turn dataDir's recordings into spectrograms."""
+    return ["--process_data", "--data_dir", dataDir, "--spect_out", spectDir]
+
+
+def modelPredictionArgs(spectDir, models=(MODEL_0, MODEL_1)):
+    """Pipeline arguments that only run the models over spectrograms in spectDir."""
+    return ["--make_predictions",
+            "--model_0", models[0],
+            "--model_1", models[1],
+            "--spect_path", spectDir]
+
+
+def indexResults(spectDir, write):
+    """Add detections new in spectDir's result tables to its ResultsStore."""
+    try:
+        store = ResultsStore(spectDir)
+        try:
+            added = store.ingest()
+        finally:
+            store.close()
+    except (sqlite3.Error, OSError) as e:
+        write("Could not index the results: %s\n" % e)
+        return
+    if added:
+        write("Indexed %d detections\n" % added)
+
+
+class DetectorRun:
+    """One detector run over a sound folder.
+
+    output is called with batches of the pipeline's text output. With
+    shards > 1 the sound folder is split into that many balanced shards
+    which run as separate pipeline processes, at most maxProcesses at once.
+    With incremental set, only recordings missing from the output folder's
+    manifest are processed and their results are merged with earlier ones.
+    With streaming set, spectrograms are generated in batches of
+    streamBatchSize recordings while earlier batches are being predicted on,
+    by spectrogramWorkers and predictionWorkers processes (both shards
+    unless given); at most queueDepth generated batches per prediction
+    worker wait for prediction at a time.
+    With keepSpectrograms cleared, runs stream through a scratch folder in
+    memory-backed storage where available, and only prediction results are
+    written to the output folder.
+    With cacheBudget (in bytes) set, spectrograms are also kept in a cache
+    shared between output folders, so recordings seen before skip the
+    spectrogram stage.
+    onProgress is called with ProgressTracker snapshots as files finish.
+    limits is a ProcessLimits applied to every pipeline process.
+    onResources is called with ResourceMonitor samples of the pipeline
+    processes about once a second; with resourceLog set the samples are
+    also saved as a CSV time series in the output folder.
+    files restricts the run to those recordings of the sound folder.
+    With runLog set, all output is also saved to a RunLog in the output
+    folder. With indexResults set, detections in the output folder's
+    result tables are added to its ResultsStore after a successful run.
+    agents lists (host, port) addresses of remote_agent workers that share
+    the work, authenticated with agentToken; this computer runs shards
+    too, as many at once as shards, maxProcesses and its free memory
+    allow. Shards of an agent that drops out are run again elsewhere. Streaming and the spectrogram cache do not apply
+    to distributed runs.
+    With windowSeconds set, WAV recordings longer than that are cut into
+    windows of windowSeconds overlapping by windowOverlap, which are
+    sharded like recordings so one long recording keeps every shard busy;
+    detections in the overlaps are de-duplicated when the shard results
+    are merged (see time_windows).
+    modelVariant names one of model_variants.VARIANTS to run instead of
+    the original checkpoints; it is built on first use. If it cannot be
+    built the run uses the original checkpoints.
+    With history set, the run is added to the RunHistory, which is used
+    to say how long the run should take before it starts and to warn when
+    it is going much slower than earlier runs like it.
+    With checkpoint set, recordings are processed in groups of
+    checkpointFiles whose results are merged into the output folder as
+    each group finishes, and a Checkpoint records the groups done. With
+    resumeInterrupted set, only the recordings an interrupted run had not
+    finished are processed.
+
+    cancel(), pause() and resume() may be called from any thread while
+    run() is in progress; they act on whole pipeline process trees.
+    """
+
+    def __init__(self, scriptDir, dataDir, spectDir, output=print,
+                 shards=1, maxProcesses=None, incremental=False, streaming=False,
+                 streamBatchSize=DEFAULT_STREAM_BATCH, queueDepth=DEFAULT_QUEUE_DEPTH,
+                 keepSpectrograms=True, cacheBudget=0, onProgress=None, limits=None,
+                 onResources=None, resourceLog=True, checkpoint=False,
+                 checkpointFiles=DEFAULT_CHECKPOINT_FILES, resumeInterrupted=False,
+                 files=None, indexResults=True, runLog=True, agents=None,
+                 agentToken=None, windowSeconds=0, windowOverlap=DEFAULT_OVERLAP_SECONDS,
+                 history=True, modelVariant=None, spectrogramWorkers=None,
+                 predictionWorkers=None):
+        self.scriptDir = scriptDir
+        self.dataDir = dataDir
+        self.spectDir = spectDir
+        self.shards = shards
+        self.incremental = incremental
+        self.keepSpectrograms = keepSpectrograms
+        self.cacheBudget = cacheBudget
+        # Spectrograms can only be handed over in memory, or taken from the
+        # cache, when the two pipeline stages run separately
+        self.streaming = streaming or not keepSpectrograms or cacheBudget > 0
+        self._cache = None
+        self.onProgress = onProgress
+        self.progress = ProgressTracker(self._progressChanged)
+        self.streamBatchSize = streamBatchSize
+        self.queueDepth = queueDepth
+        self.spectrogramWorkers = spectrogramWorkers
+        self.predictionWorkers = predictionWorkers
+        self.maxProcesses = maxProcesses or os.cpu_count() or 1
+        self.limits = limits or ProcessLimits()
+        self.onResources = onResources
+        self.resourceLog = resourceLog
+        self.checkpoint = checkpoint or resumeInterrupted
+        self.checkpointFiles = max(1, checkpointFiles)
+        self.resumeInterrupted = resumeInterrupted
+        self.files = files
+        self.indexResults = indexResults
+        self.runLog = runLog
+        self.agents = list(agents or [])
+        self.agentToken = agentToken or os.environ.get(AGENT_TOKEN_ENV, "")
+        self.windowSeconds = windowSeconds
+        self.windowOverlap = max(0, windowOverlap)
+        self._windows = None
+        self.history = history
+        self.modelVariant = modelVariant
+        # Model paths given to the pipeline, relative to scriptDir
+        self.models = [MODEL_0, MODEL_1]
+        self._models = None
+        self._usualSeconds = None
+        self._slowWarned = False
+        self._pausedSeconds = 0.0
+        self._pausedAt = None
+        self._output = output
+        self._outputLock = threading.Lock()
+        self._runLog = None
+
+        self._controlLock = threading.Lock()
+        self._processes = set()
+        self._warmClients = set()
+        self._agentClients = set()
+        self._cancelled = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    def write(self, text):
+        """Send text to the output callback; safe to call from any thread."""
+        with self._outputLock:
+            self._output(text)
+            if self._runLog is not None:
+                self._runLog.write(text)
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def paused(self):
+        return not self._resumed.is_set()
+
+    def cancel(self):
+        """Stop the run, terminating every pipeline process it started."""
+        with self._controlLock:
+            self._cancelled.set()
+            self._resumed.set()
+            processes = list(self._processes)
+            clients = list(self._warmClients)
+            agentClients = list(self._agentClients)
+        for client in clients:
+            # A paused worker could not act on the cancel
+            resumeTree(client.pid)
+            client.cancel()
+        for client in agentClients:
+            client.cancel()
+        for process in processes:
+            killTree(process.pid)
+
+    def pause(self):
+        """Suspend the run's processes. No new ones start until resume()."""
+        with self._controlLock:
+            if self._pausedAt is None:
+                self._pausedAt = time.monotonic()
+            self._resumed.clear()
+            for process in self._processes:
+                suspendTree(process.pid)
+            for client in self._warmClients:
+                suspendTree(client.pid)
+
+    def resume(self):
+        with self._controlLock:
+            for process in self._processes:
+                resumeTree(process.pid)
+            for client in self._warmClients:
+                resumeTree(client.pid)
+            if self._pausedAt is not None:
+                self._pausedSeconds += time.monotonic() - self._pausedAt
+                self._pausedAt = None
+            self._resumed.set()
+
+    def pids(self):
+        """Process ids of the pipeline processes and warm workers in use."""
+        with self._controlLock:
+            return ([process.pid for process in self._processes]
+                    + [client.pid for client in self._warmClients if client.pid])
+
+    def run(self):
+        """Run the detector. Returns the pipeline's exit status."""
+        if self.cacheBudget > 0:
+            self._cache = SpectrogramCache(self.cacheBudget)
+            self._cacheParams = pipelineParamsKey(self.scriptDir, ["--process_data"])
+        csvPath = None
+        if self.resourceLog and os.path.isdir(self.spectDir):
+            csvPath = os.path.join(self.spectDir, resourceLogName())
+        if self.runLog and os.path.isdir(self.spectDir):
+            self._openRunLog()
+        monitor = ResourceMonitor(self.pids, self.onResources, csvPath)
+        monitor.start()
+        try:
+            returncode = self._run()
+            if self.history:
+                self._recordRun(returncode)
+            if self.cancelled:
+                self.write("Run cancelled.\n")
+                return CANCELLED
+            if returncode == 0 and self.indexResults:
+                self._indexResults()
+            return returncode
+        finally:
+            monitor.stop()
+            self.write("Peak memory of detector processes: %.0f MB\n"
+                       % (monitor.peakRss / 1024 ** 2))
+            if self._cache is not None:
+                self._cache.save()
+                self.write("Spectrogram cache: %d hits, %d misses\n"
+                           % (self._cache.hits, self._cache.misses))
+            self._closeRunLog()
+
+    def _openRunLog(self):
+        try:
+            runLog = RunLog.create(self.spectDir)
+        except OSError as e:
+            self.write("Could not save the output to a log file: %s\n" % e)
+            return
+        with self._outputLock:
+            self._runLog = runLog
+        self.write("Saving output to %s\n" % runLog.path)
+
+    def _closeRunLog(self):
+        with self._outputLock:
+            runLog, self._runLog = self._runLog, None
+        if runLog is not None:
+            runLog.close()
+
+    def _run(self):
+        if self.modelVariant:
+            self._useModelVariant()
+        manifest = None
+        if self.incremental:
+            # Results of other variants count as made with other models
+            manifest = Manifest.load(self.spectDir, self._modelPaths())
+
+        wholeFolder = False
+        if self.resumeInterrupted:
+            checkpoint = Checkpoint.load(self.spectDir)
+            if checkpoint is None or not checkpoint.matches(self.dataDir):
+                self.write("The output folder has no interrupted run of this sound folder "
+                           "to resume\n")
+                return 1
+            files = checkpoint.remaining()
+            self.write("Resuming interrupted run: %d of %d recordings left\n"
+                       % (len(files), len(checkpoint.files)))
+            # Work folders of the group that was interrupted
+            shutil.rmtree(os.path.join(self.spectDir, SHARD_DIR_NAME), ignore_errors=True)
+        else:
+            if self.files is not None:
+                files = list(self.files)
+            else:
+                files = sharding.listSoundFiles(self.dataDir)
+            wholeFolder = manifest is None and self.files is None
+            if manifest is not None:
+                if manifest.modelsChanged:
+                    self.write("Model files changed; all recordings will be processed again\n")
+                pending = manifest.pendingFiles(files)
+                self.write("%d of %d recordings are new or changed\n"
+                           % (len(pending), len(files)))
+                files = pending
+            checkpoint = None
+            if self.checkpoint and files:
+                checkpoint = Checkpoint.begin(self.spectDir, self.dataDir, files)
+
+        self.progress.start(files)
+        if self.history and files:
+            self._predictRun()
+        if checkpoint is None:
+            returncode = self._runGroup(files, wholeFolder) if files else 0
+            if returncode == 0 and manifest is not None:
+                manifest.markDone(files)
+                manifest.save()
+            return returncode
+
+        groups = [files[i:i + self.checkpointFiles]
+                  for i in range(0, len(files), self.checkpointFiles)]
+        for group in groups:
+            returncode = self._runGroup(group)
+            if returncode:
+                self.write("%d recordings are left; resume the run to process them\n"
+                           % len(checkpoint.remaining()))
+                return returncode
+            checkpoint.markDone(group)
+            if manifest is not None:
+                manifest.markDone(group)
+                manifest.save()
+        checkpoint.finish()
+        if manifest is not None:
+            manifest.save()
+        return 0
+
+    def _useModelVariant(self):
+        try:
+            self.models = variantModels(self.scriptDir, self.modelVariant,
+                                        [MODEL_0, MODEL_1], output=self.write)
+        except VariantBuildError as e:
+            self.write("Could not build the %s models, using the original ones: %s\n"
+                       % (VARIANT_NAMES.get(self.modelVariant, self.modelVariant), e))
+            self.modelVariant = None
+            return
+        self.write("Using the %s models\n" % VARIANT_NAMES[self.modelVariant])
+
+    def _modelPaths(self):
+        return [os.path.join(self.scriptDir, model) for model in self.models]
+
+    def _historyOptions(self):
+        """The run's options as kept in the RunHistory."""
+        return {"shards": self.shards, "maxProcesses": self.maxProcesses,
+                "threads": self.limits.threads, "cpus": self.limits.cpus,
+                "lowPriority": self.limits.lowPriority, "streaming": self.streaming,
+                "streamBatchSize": self.streamBatchSize if self.streaming else None,
+                "spectrogramWorkers": self.spectrogramWorkers if self.streaming else None,
+                "predictionWorkers": self.predictionWorkers if self.streaming else None,
+                "keepSpectrograms": self.keepSpectrograms, "cacheBudget": self.cacheBudget,
+                "windowSeconds": self.windowSeconds, "agents": self.agents,
+                "incremental": self.incremental, "checkpoint": self.checkpoint,
+                "modelVariant": self.modelVariant}
+
+    def _modelHashes(self):
+        hashes = {}
+        for model, path in zip((MODEL_0, MODEL_1), self._modelPaths()):
+            try:
+                hashes[model] = fileHash(path)
+            except OSError:
+                hashes[model] = None
+        return hashes
+
+    def _predictRun(self):
+        """Say how long the run should take, going by earlier runs like it."""
+        audioSeconds = self.progress.snapshot()["audioHoursTotal"] * 3600
+        try:
+            self._models = self._modelHashes()
+            history = RunHistory()
+            try:
+                options = self._historyOptions()
+                prediction = history.predict(options, self._models, audioSeconds)
+                self._usualSeconds = history.usualSeconds(options, self._models, audioSeconds)
+            finally:
+                history.close()
+        except (sqlite3.Error, OSError) as e:
+            self.write("Could not read the run history: %s\n" % e)
+            return
+        if prediction is not None:
+            seconds, runs = prediction
+            self.progress.setPrediction(seconds)
+            self.write("Expected to take about %s, going by %d earlier %s like it\n"
+                       % (formatDuration(seconds), runs, "run" if runs == 1 else "runs"))
+
+    def _runSeconds(self, snapshot):
+        with self._controlLock:
+            paused = self._pausedSeconds
+            if self._pausedAt is not None:
+                paused += time.monotonic() - self._pausedAt
+        return max(0.0, snapshot["elapsedSeconds"] - paused)
+
+    def _progressChanged(self, snapshot):
+        # Warn once, part way through, if the run is going much slower than usual
+        if self._usualSeconds and not self._slowWarned and \
+                REGRESSION_CHECK_FRACTION <= snapshot["fraction"] < 1:
+            projected = self._runSeconds(snapshot) / snapshot["fraction"]
+            if isSlow(projected, self._usualSeconds):
+                self._slowWarned = True
+                self.write("Warning: this run is going much slower than earlier runs like it; "
+                           "it looks like taking %s instead of about %s\n"
+                           % (formatDuration(projected), formatDuration(self._usualSeconds)))
+        if self.onProgress is not None:
+            self.onProgress(snapshot)
+
+    def _recordRun(self, returncode):
+        """Add the finished run to the history, warning if it was unusually slow."""
+        snapshot = self.progress.snapshot()
+        if not snapshot["filesTotal"]:
+            return
+        wallSeconds = self._runSeconds(snapshot)
+        audioSeconds = snapshot["audioHoursTotal"] * 3600
+        try:
+            if self._models is None:
+                self._models = self._modelHashes()
+            history = RunHistory()
+            try:
+                options = self._historyOptions()
+                usual = None
+                if returncode == 0:
+                    usual = history.usualSeconds(options, self._models, audioSeconds)
+                history.record(options, self._models, snapshot["filesTotal"], audioSeconds,
+                               wallSeconds, snapshot["stageSeconds"], returncode,
+                               scriptDir=self.scriptDir, dataDir=self.dataDir,
+                               outputDir=self.spectDir)
+            finally:
+                history.close()
+        except (sqlite3.Error, OSError) as e:
+            self.write("Could not save the run to the history: %s\n" % e)
+            return
+        if isSlow(wallSeconds, usual):
+            self.write("Warning: this run took %s, but earlier runs like it suggest about %s. "
+                       "Check whether the computer was busy with other work, short of "
+                       "memory, or reading from a slower disk\n"
+                       % (formatDuration(wallSeconds), formatDuration(usual)))
+
+    def _indexResults(self):
+        indexResults(self.spectDir, self.write)
+
+    def _runGroup(self, files, wholeFolder=False):
+        """Process files, merging their results into the output folder."""
+        if self.windowSeconds > 0:
+            return self._runWindowed(files)
+        return self._runSplit(files, wholeFolder)
+
+    def _runSplit(self, files, wholeFolder=False):
+        if self.agents:
+            return self._runDistributed(files)
+        if wholeFolder and self.shards == 1 and not self.streaming:
+            started = time.monotonic()
+            returncode = self._runPipeline(predictionArgs(self.dataDir, self.spectDir, self.models))
+            self.progress.stageTime("pipeline", time.monotonic() - started)
+            if returncode == 0:
+                self.progress.filesDone(files)
+            return returncode
+        return self._runFiles(files)
+
+    def _runWindowed(self, files):
+        """Process files with long recordings cut into overlapping windows."""
+        windowDir = os.path.join(self.spectDir, SHARD_DIR_NAME, WINDOW_DIR_NAME)
+        shutil.rmtree(windowDir, ignore_errors=True)
+        os.makedirs(windowDir)
+
+        def split(path):
+            return splitRecording(path, windowDir, self.windowSeconds, self.windowOverlap)
+
+        windows = WindowSet()
+        started = time.monotonic()
+        try:
+            # Splitting is mostly disk time, so recordings are cut in parallel
+            with ThreadPoolExecutor(max_workers=self.maxProcesses) as pool:
+                for path, pieces in zip(files, pool.map(split, files)):
+                    windows.add(path, pieces)
+        except OSError as e:
+            self.write("Could not cut recordings into windows: %s\n" % e)
+            return 1
+        if not len(windows):
+            shutil.rmtree(windowDir, ignore_errors=True)
+            return self._runSplit(files)
+        self.progress.stageTime("windows", time.monotonic() - started)
+        self.write("Cut %d of %d recordings into %d windows of %g s overlapping by %g s\n"
+                   % (windows.recordingCount, len(files), len(windows), self.windowSeconds,
+                      self.windowOverlap))
+
+        self._windows = windows
+        try:
+            return self._runSplit(windows.files(files))
+        finally:
+            self._windows = None
+
+    def _makeShards(self, files, count):
+        if self._windows is not None:
+            # Windows stay in order, so the merged tables list detections in
+            # the order a run over the whole recordings would
+            return sharding.makeContiguousShards(files, count)
+        return sharding.makeShards(files, count)
+
+    def _filesDone(self, files):
+        """Report files finished, crediting windows to their recordings."""
+        if self._windows is None:
+            self.progress.filesDone(files)
+            return
+        parts, complete = self._windows.markDone(files)
+        for recording, seconds in parts:
+            self.progress.filePartDone(recording, seconds)
+        self.progress.filesDone(complete)
+
+    def _runPipeline(self, args, output=None, mmapDir=None):
+        """Run the pipeline once, on the warm worker if one is up."""
+        output = output or self.write
+        returncode = self._runWarm(args, output, mmapDir)
+        if returncode is None:
+            if self.cancelled:
+                return CANCELLED
+            returncode = self._runProcess(args, output)
+        return returncode
+
+    def _runWarm(self, args, output, mmapDir=None):
+        """Send a job to a warm worker. Returns None if none is available."""
+        self._resumed.wait()
+        if self.cancelled:
+            return None
+        client = WarmWorkerClient.connect(self.scriptDir)
+        if client is None:
+            return None
+
+        output("Using warm worker (models already loaded)\n")
+        with self._controlLock:
+            self._warmClients.add(client)
+        restoreLimits = self.limits.applyTemporarily(client.pid)
+        try:
+            pumpText(client.runJob(args, mmapDir, self.progress.handleEvent,
+                                   threads=self.limits.threads), output)
+        except (OSError, RuntimeError) as e:
+            if not self.cancelled:
+                output("Warm worker failed: " + str(e) + "\n")
+            return None
+        finally:
+            restoreLimits()
+            if self.cancelled and not client.waitStopped():
+                # Stuck in native code; a worker left running would keep using
+                # the processors, so it goes and the next run starts afresh
+                output("The warm worker did not stop the cancelled job; stopping the worker\n")
+                killTree(client.pid)
+            with self._controlLock:
+                self._warmClients.discard(client)
+        return client.returncode
+
+    def _runProcess(self, args, output):
+        self._resumed.wait()
+        if self.cancelled:
+            return CANCELLED
+
+        channel = ProgressChannel(self.progress.handleEvent)
+        process = None
+        try:
+            process = subprocess.Popen(
+                pipelineCommand(args), stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT, cwd=self.scriptDir,
+                **channel.popenKwargs(self.limits.childEnv()))
+            channel.start()
+            self.limits.apply(process.pid)
+            with self._controlLock:
+                self._processes.add(process)
+                # pause() or cancel() may have run while the process started
+                if self.cancelled:
+                    killTree(process.pid)
+                elif self.paused:
+                    suspendTree(process.pid)
+            pumpOutput(process.stdout, output)
+            returncode = process.wait()
+            return CANCELLED if self.cancelled else returncode
+        finally:
+            if process is not None:
+                with self._controlLock:
+                    self._processes.discard(process)
+            channel.close()
+
+    def _runFiles(self, files):
+        """Run the pipeline over some of the sound folder's files.
+
+        The files are split into shards that run in their own work folders,
+        and the results are merged into the output folder afterwards. With
+        overlapping stages the worker pools of each stage take the place
+        of shards, so the files run as one.
+        """
+        shards = [files] if self.streaming else self._makeShards(files, self.shards)
+        shardRoot = os.path.join(self.spectDir, SHARD_DIR_NAME)
+
+        if len(shards) > 1:
+            self.write("Splitting %d files into %d shards, %d running at once\n"
+                       % (len(files), len(shards), min(len(shards), self.maxProcesses)))
+
+        shardDirs = []
+        for index, shardFiles in enumerate(shards):
+            inputDir = os.path.join(shardRoot, "shard_%02d_input" % index)
+            outputDir = os.path.join(shardRoot, "shard_%02d" % index)
+            shardDirs.append((index, shardFiles, inputDir, outputDir))
+
+        def runShard(shard):
+            index, shardFiles, inputDir, outputDir = shard
+            if self.cancelled:
+                return CANCELLED
+            prefixer = None
+            output = self.write
+            if len(shardDirs) > 1:
+                prefixer = LinePrefixer("[shard %d] " % index, self.write)
+                output = prefixer.feed
+
+            if self.streaming:
+                returncode = self._runStreaming(shardFiles, inputDir, outputDir, output)
+            elif len(shardDirs) == 1:
+                returncode = self._runPipeline(
+                    predictionArgs(inputDir, outputDir, self.models))
+            else:
+                # Parallel shards always use their own processes; a warm worker
+                # would serialize them
+                returncode = self._runProcess(
+                    predictionArgs(inputDir, outputDir, self.models), output)
+            if returncode == 0:
+                self._filesDone(shardFiles)
+
+            if prefixer is not None:
+                prefixer.flush()
+            return returncode
+
+        try:
+            for _, shardFiles, inputDir, outputDir in shardDirs:
+                if not self.streaming:
+                    sharding.stageFiles(shardFiles, inputDir)
+                os.makedirs(outputDir, exist_ok=True)
+            with ThreadPoolExecutor(max_workers=self.maxProcesses) as pool:
+                returncodes = list(pool.map(runShard, shardDirs))
+        finally:
+            # The staged recordings may be copies, so they never outlive the
+            # shards, whether or not they succeeded
+            for _, _, inputDir, _ in shardDirs:
+                shutil.rmtree(inputDir, ignore_errors=True)
+
+        return self._mergeShards(shardRoot, [shard[3] for shard in shardDirs],
+                                 returncodes, files)
+
+    def _mergeShards(self, shardRoot, outputDirs, returncodes, files):
+        """Merge the shard outputs into the output folder if every shard succeeded."""
+        if self.cancelled:
+            self.write("Partial results are left in %s\n" % shardRoot)
+            return CANCELLED
+
+        failed = [index for index, code in enumerate(returncodes) if code]
+        if failed:
+            self.write("Shards %s failed; their outputs are left in %s\n"
+                       % (", ".join(map(str, failed)), shardRoot))
+            return 1
+
+        if self._windows is not None:
+            for outputDir in outputDirs:
+                self._windows.translateOutput(outputDir)
+            files = self._windows.recordings(files)
+        sharding.mergeOutputs(outputDirs, self.spectDir, replacedFiles=files)
+        shutil.rmtree(shardRoot, ignore_errors=True)
+        if len(outputDirs) > 1:
+            self.write("Merged results of %d shards into %s\n"
+                       % (len(outputDirs), self.spectDir))
+        return 0
+
+    def _runDistributed(self, files):
+        """Run shards of files on the agents and this computer.
+
+        Every slot, remote or local, takes the next shard from a shared
+        queue as it becomes free. A shard whose agent drops out goes back
+        into the queue and that agent gets no more work in this run; the
+        local slots keep taking shards until all are done, so the run
+        finishes even if every agent is lost.
+        """
+        # Local shards are limited like those of a run on this computer alone
+        localSlots = max(1, min(self.shards, self.maxProcesses, defaultSlots()))
+        slots = [None] * localSlots
+        for host, port in self.agents:
+            client = AgentClient(host, port, self.agentToken)
+            status = client.ping()
+            if status is None:
+                self.write("Agent %s is not reachable or refused the token; "
+                           "running without it\n" % client.name)
+                continue
+            self.write("Agent %s (%s) has %d slots\n"
+                       % (client.name, status["host"], status["slots"]))
+            slots.extend([client] * status["slots"])
+
+        shards = self._makeShards(files, len(slots) * SHARDS_PER_SLOT)
+        shardRoot = os.path.join(self.spectDir, SHARD_DIR_NAME)
+        outputDirs = [os.path.join(shardRoot, "shard_%02d" % index)
+                      for index in range(len(shards))]
+        self.write("Splitting %d files into %d shards for %d slots on %d computers\n"
+                   % (len(files), len(shards), len(slots),
+                      len(set(slots) - {None}) + 1))
+
+        pending = queue.Queue()
+        for index in range(len(shards)):
+            pending.put(index)
+        returncodes = [None] * len(shards)
+        lost = set()
+        errors = []
+        lock = threading.Lock()
+
+        def allDone():
+            # An error in any slot stops the others taking more shards
+            with lock:
+                return bool(errors) or all(code is not None for code in returncodes)
+
+        def runSlot(client):
+            name = "local" if client is None else client.name
+            prefixer = LinePrefixer("[%s] " % name, self.write)
+            try:
+                runShards(client, name, prefixer)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+            finally:
+                prefixer.flush()
+
+        def runShards(client, name, prefixer):
+            while not self.cancelled and not allDone():
+                if client is not None and client.name in lost:
+                    return
+                try:
+                    index = pending.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                shardFiles = shards[index]
+                outputDir = outputDirs[index]
+                # A dropped agent may have left partial results behind
+                shutil.rmtree(outputDir, ignore_errors=True)
+                os.makedirs(outputDir)
+                if client is None:
+                    inputDir = outputDir + "_input"
+                    sharding.stageFiles(shardFiles, inputDir)
+                    returncode = self._runProcess(
+                        predictionArgs(inputDir, outputDir, self.models), prefixer.feed)
+                else:
+                    try:
+                        returncode = self._runRemote(client, shardFiles, outputDir,
+                                                     prefixer.feed)
+                    except AgentLost as e:
+                        if self.cancelled:
+                            return
+                        with lock:
+                            lost.add(client.name)
+                        self.write("Agent %s dropped out (%s); shard %d will run "
+                                   "elsewhere\n" % (client.name, e, index))
+                        pending.put(index)
+                        return
+                with lock:
+                    returncodes[index] = returncode
+                if returncode == 0:
+                    self._filesDone(shardFiles)
+                    self.write("Shard %d (%d files) done on %s\n"
+                               % (index, len(shardFiles), name))
+
+        with ThreadPoolExecutor(max_workers=len(slots)) as pool:
+            list(pool.map(runSlot, slots))
+        if errors:
+            raise errors[0]
+
+        return self._mergeShards(shardRoot, outputDirs, returncodes, files)
+
+    def _runRemote(self, client, files, outputDir, output):
+        self._resumed.wait()
+        with self._controlLock:
+            self._agentClients.add(client)
+        try:
+            return client.runShard(files, self._modelPaths(), outputDir, output,
+                                   self.progress.handleEvent)
+        finally:
+            with self._controlLock:
+                self._agentClients.discard(client)
+
+    def _runStreaming(self, files, workDir, outputDir, output):
+        """Generate spectrograms and predict on them as two overlapping stages.
+
+        Each stage has its own pool of pipeline processes, so the stage
+        that takes longer can be given more of them. Spectrogram workers
+        take batches of recordings in turn and hand each generated batch
+        folder over a bounded queue to the prediction workers. Results are
+        merged into outputDir in batch order, so the tables list detections
+        in the order one process would. Without keepSpectrograms the batch
+        folders live in scratch storage and spectrograms are deleted once
+        they have been predicted on.
+        """
+        batches = [files[i:i + self.streamBatchSize]
+                   for i in range(0, len(files), self.streamBatchSize)]
+        spectWorkers = max(1, min(self.spectrogramWorkers or self.shards,
+                                  self.maxProcesses, len(batches)))
+        predictWorkers = max(1, min(self.predictionWorkers or self.shards,
+                                    self.maxProcesses, len(batches)))
+        if spectWorkers > 1 or predictWorkers > 1:
+            self.write("Making spectrograms with %d %s and predicting with %d\n"
+                       % (spectWorkers, "process" if spectWorkers == 1 else "processes",
+                          predictWorkers))
+
+        pending = queue.Queue()
+        for index, batchFiles in enumerate(batches):
+            pending.put((index, batchFiles))
+        ready = queue.Queue(maxsize=self.queueDepth * predictWorkers)
+        failed = threading.Event()
+        errors = []
+        lock = threading.Lock()
+        mergeLock = threading.Lock()
+        # Batches waiting for and being worked on by each stage
+        counts = {"spectrograms": [len(batches), 0], "predictions": [0, 0]}
+        workers = {"spectrograms": spectWorkers, "predictions": predictWorkers}
+        producing = [spectWorkers]
+        predicted = {}
+        nextMerge = [0]
+
+        def moved(stage, waiting=0, running=0):
+            with lock:
+                counts[stage][0] += waiting
+                counts[stage][1] += running
+                state = list(counts[stage])
+            self.progress.stageQueue(stage, state[0], state[1], workers[stage])
+
+        if not self.keepSpectrograms:
+            workDir = scratchDir("elp_spill_")
+
+        def stageOutput(stage, worker, count):
+            # One prefixer per worker; each holds back its own partial line
+            name = stage if count == 1 else "%s %d" % (stage, worker)
+            return LinePrefixer("[%s] " % name, output)
+
+        def produce(worker):
+            spectOutput = stageOutput("spectrograms", worker, spectWorkers)
+            try:
+                produceBatches(spectOutput)
+            except Exception as e:
+                errors.append(e)
+                failed.set()
+            finally:
+                with lock:
+                    producing[0] -= 1
+                    last = producing[0] == 0
+                if last:
+                    for _ in range(predictWorkers):
+                        ready.put(None)
+
+        def produceBatches(spectOutput):
+            while not failed.is_set() and not self.cancelled:
+                try:
+                    index, batchFiles = pending.get_nowait()
+                except queue.Empty:
+                    break
+                moved("spectrograms", -1, 1)
+                batchDir = os.path.join(workDir, "batch_%04d" % index)
+                inputDir = os.path.join(batchDir, "input")
+                batchSpectDir = os.path.join(batchDir, "spect")
+                os.makedirs(batchSpectDir, exist_ok=True)
+
+                misses = batchFiles
+                if self._cache is not None:
+                    cacheKeys = {path: self._cache.key(path, self._cacheParams)
+                                 for path in batchFiles}
+                    misses = [path for path in batchFiles
+                              if not self._cache.fetch(cacheKeys[path], batchSpectDir, path)]
+
+                returncode = 0
+                if misses:
+                    sharding.stageFiles(misses, inputDir)
+                    cached = set(_listFiles(batchSpectDir))
+                    # Spectrograms do not need the models, so this stage never
+                    # waits on the warm worker that prediction may be using
+                    started = time.monotonic()
+                    returncode = self._runProcess(
+                        dataGenerationArgs(inputDir, batchSpectDir), spectOutput.feed)
+                    self.progress.stageTime("spectrograms", time.monotonic() - started)
+                    spectOutput.flush()
+                    shutil.rmtree(inputDir, ignore_errors=True)
+                    if returncode == 0 and self._cache is not None:
+                        self._cacheSpectrograms(
+                            misses, cacheKeys,
+                            [f for f in _listFiles(batchSpectDir) if f not in cached])
+                moved("spectrograms", 0, -1)
+                if returncode:
+                    failed.set()
+                    break
+                self.progress.stageFilesDone("spectrograms", batchFiles)
+                spectrograms = _listFiles(batchSpectDir)
+                moved("predictions", 1)
+                # Blocks while the prediction workers have enough batches waiting
+                ready.put((index, batchFiles, batchDir, batchSpectDir, spectrograms))
+
+        def predict(worker):
+            predictOutput = stageOutput("predictions", worker, predictWorkers)
+            while True:
+                batch = ready.get()
+                if batch is None:
+                    break
+                index, batchFiles, batchDir, batchSpectDir, spectrograms = batch
+                moved("predictions", -1, 1)
+                try:
+                    if failed.is_set() or self.cancelled:
+                        continue
+                    started = time.monotonic()
+                    args = modelPredictionArgs(batchSpectDir, self.models)
+                    if predictWorkers == 1:
+                        returncode = self._runPipeline(args, predictOutput.feed,
+                                                       mmapDir=batchSpectDir)
+                    else:
+                        # A warm worker would serialize the prediction workers
+                        returncode = self._runProcess(args, predictOutput.feed)
+                    self.progress.stageTime("predictions", time.monotonic() - started)
+                    predictOutput.flush()
+                    if returncode:
+                        failed.set()
+                        continue
+                    self._filesDone(batchFiles)
+                    self.progress.stageFilesDone("predictions", batchFiles)
+                    if not self.keepSpectrograms:
+                        for path in spectrograms:
+                            os.remove(path)
+                    mergeBatches(index, (batchFiles, batchDir, batchSpectDir))
+                except Exception as e:
+                    # Keep taking batches so the spectrogram workers never block
+                    errors.append(e)
+                    failed.set()
+                finally:
+                    moved("predictions", 0, -1)
+
+        def mergeBatches(index, batch):
+            # One worker at a time merges every batch that is next in order
+            with mergeLock:
+                predicted[index] = batch
+                while nextMerge[0] in predicted:
+                    batchFiles, batchDir, batchSpectDir = predicted.pop(nextMerge[0])
+                    sharding.mergeOutputs([batchSpectDir], outputDir, replacedFiles=batchFiles)
+                    shutil.rmtree(batchDir, ignore_errors=True)
+                    nextMerge[0] += 1
+
+        self.progress.stageQueue("spectrograms", len(batches), 0, spectWorkers)
+        self.progress.stageQueue("predictions", 0, 0, predictWorkers)
+        producers = [threading.Thread(target=produce, args=(worker,), daemon=True)
+                     for worker in range(spectWorkers)]
+        predictors = [threading.Thread(target=predict, args=(worker,), daemon=True)
+                      for worker in range(predictWorkers)]
+        try:
+            for thread in producers + predictors:
+                thread.start()
+            for thread in producers + predictors:
+                thread.join()
+            if errors:
+                raise errors[0]
+        finally:
+            # Scratch storage may be memory, so it goes even when a worker failed
+            if not self.keepSpectrograms:
+                shutil.rmtree(workDir, ignore_errors=True)
+        if self.cancelled:
+            return CANCELLED
+        return 1 if failed.is_set() else 0
+
+    def _cacheSpectrograms(self, recordings, cacheKeys, spectFiles):
+        owners = attributeSpectrograms(recordings, spectFiles)
+        if owners is None:
+            self.write("Spectrogram names do not match their recordings; "
+                       "this batch is not cached\n")
+            return
+        for path, files in owners.items():
+            if files:
+                self._cache.store(cacheKeys[path], path, files)
+
+
+def _listFiles(folder):
+    """Paths of all files below folder."""
+    return [os.path.join(root, name)
+            for root, _, names in os.walk(folder) for name in names]
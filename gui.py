@@ -1,32 +1,68 @@
 import sys
+import startup_profile
+startup_profile.install()
+
 import ctypes
-import subprocess
-import images_qr  # necessary to load icons properly
-import sys
+import os
+import threading
+import time
+from collections import deque
 
 # Import QApplication and the required widgets from PyQt5.QtWidgets
 from PyQt5.QtCore import Qt, QObject, QThread, QTimer, QTime, pyqtSignal
 from PyQt5.QtGui import QIcon, QFont, QTextCursor
 from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QGridLayout, \
     QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton, QLabel, QFileDialog, \
-    QPlainTextEdit, QDialog
+    QPlainTextEdit, QSpinBox, QCheckBox, QProgressBar, QGroupBox, \
+    QTableWidget, QTableWidgetItem, QAbstractItemView, QComboBox
 
-from help_dialog import HelpDialog
+# The help dialog, icons and the modules that run the detector are imported
+# on first use, so the main window appears as soon as Qt is loaded
 
 
 __version__ = '0.1'
 __author__ = 'Anchey Peng'
 
 
+DEFAULT_MAX_LOG_LINES = 5000
+DISPLAY_REFRESH_MS = 100
+# A starting warm worker is checked for this often, for up to WORKER_START_SECONDS
+WORKER_CHECK_MS = 1000
+WORKER_START_SECONDS = 120
+
+
+def formatTime(secs):
+    """Format a number of seconds as mm:ss, or hh:mm:ss from an hour up."""
+    hours = secs // 3600
+    secs %= 3600
+    minutes = secs // 60
+    secs %= 60
+
+    if (hours == 0):
+        return "%02d:%02d" % (minutes, secs)
+    else:
+        return "%02d:%02d:%02d" % (hours, minutes, secs)
+
+
+def formatBytes(count):
+    """Format a byte count with a binary unit, e.g. 1.5 GB."""
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(count) < 1024:
+            return "%.1f %s" % (count, unit)
+        count /= 1024
+    return "%.1f TB" % count
+
+
 class DetectorUi(QMainWindow):
     """ELP Detector View (GUI)."""
 
-    def __init__(self):
+    def __init__(self, maxLogLines=DEFAULT_MAX_LOG_LINES):
         """View initializer."""
         super().__init__()
+        self._maxLogLines = maxLogLines
         # Set some main window's properties
         self.setWindowTitle('ELP Detector')
-        self.setWindowIcon(QIcon(':/elp-logo.png'))
+        self.helpDialog = None
 
         # Set the central widget and the general layout
         self.generalLayout = QVBoxLayout()
@@ -37,6 +73,8 @@ class DetectorUi(QMainWindow):
 
         # Create the display and the buttons
         self._createFolderSelect()
+        self._createRunOptions()
+        self._createJobQueue()
         self._createOutputView()
         self._createProgressIndicator()
         self._createButtons()
@@ -79,6 +117,234 @@ class DetectorUi(QMainWindow):
         # Add the display to the general layout
         self.generalLayout.addLayout(folderSelectLayout)
 
+    def _createRunOptions(self):
+        """Create the parallel run options"""
+        optionsLayout = QHBoxLayout()
+
+        shardsLabel = QLabel("Parallel Shards: ")
+        self.shardsSpin = QSpinBox()
+        self.shardsSpin.setRange(1, 256)
+        self.shardsSpin.setToolTip(
+            "Split the sound folder into this many parts, each run by its own process")
+
+        processesLabel = QLabel("Max Processes: ")
+        self.processesSpin = QSpinBox()
+        self.processesSpin.setRange(1, 256)
+        self.processesSpin.setValue(os.cpu_count() or 1)
+        self.processesSpin.setToolTip(
+            "Maximum number of detector processes running at the same time")
+
+        optionsLayout.addWidget(shardsLabel)
+        optionsLayout.addWidget(self.shardsSpin)
+        optionsLayout.addSpacing(20)
+        optionsLayout.addWidget(processesLabel)
+        optionsLayout.addWidget(self.processesSpin)
+        optionsLayout.addSpacing(20)
+
+        self.incrementalCheck = QCheckBox("Only New or Changed Files")
+        self.incrementalCheck.setToolTip(
+            "Skip recordings the output folder already has results for")
+        optionsLayout.addWidget(self.incrementalCheck)
+
+        self.streamingCheck = QCheckBox("Overlap Stages")
+        self.streamingCheck.setToolTip(
+            "Predict on finished spectrograms while later ones are still being made")
+        optionsLayout.addWidget(self.streamingCheck)
+
+        self.spectWorkersSpin = QSpinBox()
+        self.spectWorkersSpin.setRange(0, 256)
+        self.spectWorkersSpin.setSpecialValueText("Auto")
+        self.spectWorkersSpin.setPrefix("Spect. ")
+        self.spectWorkersSpin.setToolTip(
+            "Processes making spectrograms when stages overlap. Auto uses one per shard")
+        self.predictWorkersSpin = QSpinBox()
+        self.predictWorkersSpin.setRange(0, 256)
+        self.predictWorkersSpin.setSpecialValueText("Auto")
+        self.predictWorkersSpin.setPrefix("Pred. ")
+        self.predictWorkersSpin.setToolTip(
+            "Processes running the models when stages overlap. Auto uses one per shard")
+        for spin in (self.spectWorkersSpin, self.predictWorkersSpin):
+            spin.setEnabled(False)
+            self.streamingCheck.toggled.connect(spin.setEnabled)
+            optionsLayout.addWidget(spin)
+
+        self.keepSpectCheck = QCheckBox("Keep Spectrograms")
+        self.keepSpectCheck.setChecked(True)
+        self.keepSpectCheck.setToolTip(
+            "Save spectrograms to the output folder. When unchecked they are "
+            "passed to the models through temporary storage and then deleted")
+        optionsLayout.addWidget(self.keepSpectCheck)
+
+        self.checkpointCheck = QCheckBox("Checkpoint")
+        self.checkpointCheck.setToolTip(
+            "Save results every few recordings, so an interrupted run can be "
+            "resumed instead of started over. Runs take longer, since the "
+            "pipeline is started again for every group")
+        optionsLayout.addWidget(self.checkpointCheck)
+        optionsLayout.addSpacing(20)
+
+        windowLabel = QLabel("Split Recordings (min): ")
+        self.windowSpin = QSpinBox()
+        self.windowSpin.setRange(0, 1440)
+        self.windowSpin.setSpecialValueText("Off")
+        self.windowSpin.setToolTip(
+            "Cut recordings longer than this into overlapping windows that run "
+            "in parallel shards; detections in the overlaps are only kept once")
+        optionsLayout.addWidget(windowLabel)
+        optionsLayout.addWidget(self.windowSpin)
+        optionsLayout.addSpacing(20)
+
+        cacheLabel = QLabel("Spectrogram Cache (GB): ")
+        self.cacheSpin = QSpinBox()
+        self.cacheSpin.setRange(0, 10000)
+        self.cacheSpin.setToolTip(
+            "Disk space for reusing spectrograms of recordings processed before. "
+            "0 turns the cache off")
+        optionsLayout.addWidget(cacheLabel)
+        optionsLayout.addWidget(self.cacheSpin)
+        optionsLayout.addStretch(1)
+
+        self.generalLayout.addLayout(optionsLayout)
+
+        limitsLayout = QHBoxLayout()
+
+        threadsLabel = QLabel("Threads per Process: ")
+        self.threadsSpin = QSpinBox()
+        self.threadsSpin.setRange(0, 256)
+        self.threadsSpin.setSpecialValueText("Auto")
+        self.threadsSpin.setToolTip(
+            "Limit the threads each detector process uses. Auto lets torch decide")
+
+        cpusLabel = QLabel("CPU Cores: ")
+        self.cpusEdit = QLineEdit()
+        self.cpusEdit.setPlaceholderText("All")
+        self.cpusEdit.setMaximumWidth(120)
+        self.cpusEdit.setToolTip(
+            "Run the detector only on these cores, for example 0-3,6")
+
+        self.lowPriorityCheck = QCheckBox("Low Priority")
+        self.lowPriorityCheck.setToolTip(
+            "Run the detector below normal priority so the computer stays responsive")
+
+        limitsLayout.addWidget(threadsLabel)
+        limitsLayout.addWidget(self.threadsSpin)
+        limitsLayout.addSpacing(20)
+        limitsLayout.addWidget(cpusLabel)
+        limitsLayout.addWidget(self.cpusEdit)
+        limitsLayout.addSpacing(20)
+        limitsLayout.addWidget(self.lowPriorityCheck)
+        limitsLayout.addSpacing(20)
+
+        modelsLabel = QLabel("Models: ")
+        self.modelVariantCombo = QComboBox()
+        self.modelVariantCombo.addItem("Original", None)
+        self.modelVariantCombo.addItem("TorchScript", "torchscript")
+        self.modelVariantCombo.addItem("Quantized int8", "quantized")
+        self.modelVariantCombo.setToolTip(
+            "Run faster CPU builds of the models, made the first time they are used. "
+            "Quantized models are fastest but may find slightly different calls; "
+            "compare_models.py shows the difference on a sample folder")
+        limitsLayout.addWidget(modelsLabel)
+        limitsLayout.addWidget(self.modelVariantCombo)
+        limitsLayout.addSpacing(20)
+
+        agentsLabel = QLabel("Agents: ")
+        self.agentsEdit = QLineEdit()
+        self.agentsEdit.setPlaceholderText("host:port, host:port")
+        self.agentsEdit.setToolTip(
+            "Other computers running remote_agent.py that share the work of a run")
+        self.agentTokenEdit = QLineEdit(os.environ.get("ELP_AGENT_TOKEN", ""))
+        self.agentTokenEdit.setEchoMode(QLineEdit.Password)
+        self.agentTokenEdit.setPlaceholderText("Agent token")
+        self.agentTokenEdit.setMaximumWidth(120)
+        self.checkAgentsBtn = QPushButton('Check Agents')
+        limitsLayout.addWidget(agentsLabel)
+        limitsLayout.addWidget(self.agentsEdit, 1)
+        limitsLayout.addWidget(self.agentTokenEdit)
+        limitsLayout.addWidget(self.checkAgentsBtn)
+
+        self.generalLayout.addLayout(limitsLayout)
+
+    def _createJobQueue(self):
+        """Create the job queue panel"""
+        queueLayout = QVBoxLayout()
+
+        self.queueTable = QTableWidget(0, 5)
+        self.queueTable.setHorizontalHeaderLabels(
+            ["Job", "Sound Folder", "Output Folder", "Status", "Progress"])
+        self.queueTable.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.queueTable.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.queueTable.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.queueTable.verticalHeader().hide()
+        self.queueTable.horizontalHeader().setStretchLastSection(True)
+        self.queueTable.setMaximumHeight(150)
+        queueLayout.addWidget(self.queueTable)
+
+        queueBtnLayout = QHBoxLayout()
+        self.enqueueBtn = QPushButton('Add to Queue')
+        self.enqueueBtn.setToolTip("Queue a run with the folders and options above")
+        self.queueUpBtn = QPushButton('Up')
+        self.queueDownBtn = QPushButton('Down')
+        self.queueRemoveBtn = QPushButton('Remove')
+        self.queuePauseBtn = QPushButton('Pause/Resume')
+        self.queueCancelBtn = QPushButton('Cancel Job')
+
+        slotsLabel = QLabel("Concurrent Processes: ")
+        self.slotsSpin = QSpinBox()
+        self.slotsSpin.setRange(1, 256)
+        self.slotsSpin.setToolTip(
+            "Maximum detector processes for all queued jobs together. "
+            "The default fits this computer's cores and free memory")
+
+        self.queueStatsLabel = QLabel()
+
+        queueBtnLayout.addWidget(self.enqueueBtn)
+        queueBtnLayout.addWidget(self.queueUpBtn)
+        queueBtnLayout.addWidget(self.queueDownBtn)
+        queueBtnLayout.addWidget(self.queueRemoveBtn)
+        queueBtnLayout.addWidget(self.queuePauseBtn)
+        queueBtnLayout.addWidget(self.queueCancelBtn)
+        queueBtnLayout.addSpacing(20)
+        queueBtnLayout.addWidget(slotsLabel)
+        queueBtnLayout.addWidget(self.slotsSpin)
+        queueBtnLayout.addStretch(1)
+        queueBtnLayout.addWidget(self.queueStatsLabel)
+        queueLayout.addLayout(queueBtnLayout)
+
+        queueGroup = QGroupBox("Job Queue")
+        queueGroup.setLayout(queueLayout)
+        self.generalLayout.addWidget(queueGroup)
+
+    def setQueueJobs(self, jobs):
+        """Show the queued jobs in queue order."""
+        selectedId = self.selectedJobId()
+        self.queueTable.setRowCount(len(jobs))
+        for row, job in enumerate(jobs):
+            progress = ""
+            if job.progress is not None:
+                progress = "%d/%d files" % (job.progress["filesDone"],
+                                            job.progress["filesTotal"])
+            values = [str(job.id), job.dataDir, job.spectDir, job.status, progress]
+            for column, value in enumerate(values):
+                self.queueTable.setItem(row, column, QTableWidgetItem(value))
+            if job.id == selectedId:
+                self.queueTable.selectRow(row)
+
+    def selectedJobId(self):
+        """Id of the job selected in the queue table, or None."""
+        rows = self.queueTable.selectionModel().selectedRows()
+        if not rows:
+            return None
+        return int(self.queueTable.item(rows[0].row(), 0).text())
+
+    def setQueueStats(self, stats):
+        counts = stats["counts"]
+        self.queueStatsLabel.setText(
+            "%d running, %d queued, %d done, %.1f audio h per h" % (
+                counts.get("Running", 0) + counts.get("Paused", 0), counts.get("Queued", 0),
+                counts.get("Done", 0) + counts.get("Failed", 0) + counts.get("Cancelled", 0),
+                stats["throughput"]))
+
     def _createButtons(self):
         """Create run and cancel buttons"""
         btnLayout = QHBoxLayout()
@@ -86,14 +352,51 @@ class DetectorUi(QMainWindow):
         self.helpBtn = QPushButton('Help')
         # self.helpBtn.setFixedWidth(200)
 
+        self.resultsBtn = QPushButton('Results')
+        self.resultsBtn.setToolTip(
+            "Browse, filter and sort the detections in the output folder")
+
+        self.logBtn = QPushButton('Logs')
+        self.logBtn.setToolTip("Open a saved run log from the output folder")
+
+        self.watchBtn = QPushButton('Watch Folder')
+        self.watchBtn.setToolTip(
+            "Keep processing new recordings as they arrive in the sound folder")
+
+        self.workerBtn = QPushButton('Start Worker')
+        self.workerBtn.setToolTip(
+            "Keep the detector models loaded between runs")
+
+        self.tuneBtn = QPushButton('Tune')
+        self.tuneBtn.setToolTip(
+            "Time short runs over clips of the sound folder to find the fastest "
+            "settings for this computer, and use them from now on")
+
         self.runBtn = QPushButton('Run')
         # self.runBtn.setFixedWidth(200)
 
+        self.pauseBtn = QPushButton('Pause')
+        self.pauseBtn.setEnabled(False)
+
+        self.resumeRunBtn = QPushButton('Resume Interrupted')
+        self.resumeRunBtn.setToolTip(
+            "Continue a checkpointed run that was stopped, processing only "
+            "the recordings it had not finished")
+
         self.cancelBtn = QPushButton('Cancel')
         # self.cancelBtn.setFixedWidth(200)
+        self.cancelBtn.setToolTip(
+            "Stop the current run, or close the window when nothing is running")
 
         btnLayout.addWidget(self.helpBtn, 1, alignment=Qt.AlignRight)
+        btnLayout.addWidget(self.resultsBtn, 0, alignment=Qt.AlignRight)
+        btnLayout.addWidget(self.logBtn, 0, alignment=Qt.AlignRight)
+        btnLayout.addWidget(self.watchBtn, 0, alignment=Qt.AlignRight)
+        btnLayout.addWidget(self.workerBtn, 0, alignment=Qt.AlignRight)
+        btnLayout.addWidget(self.tuneBtn, 0, alignment=Qt.AlignRight)
         btnLayout.addWidget(self.runBtn, 0, alignment=Qt.AlignRight)
+        btnLayout.addWidget(self.pauseBtn, 0, alignment=Qt.AlignRight)
+        btnLayout.addWidget(self.resumeRunBtn, 0, alignment=Qt.AlignRight)
         btnLayout.addWidget(self.cancelBtn, 0, alignment=Qt.AlignRight)
 
         self.generalLayout.addLayout(btnLayout)
@@ -103,16 +406,53 @@ class DetectorUi(QMainWindow):
         self.outputView = QPlainTextEdit()
         self.outputView.setFont(QFont('Courier New'))
         self.outputView.setMinimumHeight(250)
+        # Oldest lines are dropped once the limit is reached
+        self.outputView.setMaximumBlockCount(self._maxLogLines)
         # self.outputView.setReadOnly(True)
         self.outputView.setStyleSheet("margin: 10px")
         self.generalLayout.addWidget(self.outputView)
 
+        # Ring buffer mirroring the view, so a flood of output can be shown
+        # by redrawing the last maxLogLines lines instead of inserting them all
+        self._logLines = deque(maxlen=self._maxLogLines)
+        self._pendingText = []
+        self._pendingLines = 0
+        self._displayTimer = QTimer(self, interval=DISPLAY_REFRESH_MS,
+                                    timeout=self._flushDisplayText)
+
     def _createProgressIndicator(self):
+        progressLayout = QHBoxLayout()
+
         # creating a label object
         self._timeLabel = QLabel()
 
-        # adding label to the layout
-        self.generalLayout.addWidget(self._timeLabel)
+        self._progressBar = QProgressBar()
+        self._progressBar.setRange(0, 1000)
+        self._progressBar.setTextVisible(False)
+        self._progressLabel = QLabel()
+        self._resourceLabel = QLabel()
+        self._resourceLabel.setToolTip(
+            "CPU, memory and disk use of the detector processes. "
+            "Each run's samples are saved to elp_resources_*.csv in the output folder")
+
+        # adding the labels and progress bar to the layout
+        progressLayout.addWidget(self._timeLabel)
+        progressLayout.addWidget(self._resourceLabel)
+        progressLayout.addWidget(self._progressBar, 1)
+        progressLayout.addWidget(self._progressLabel)
+        self._watchLabel = QLabel()
+        progressLayout.addWidget(self._watchLabel)
+        self.generalLayout.addLayout(progressLayout)
+        self._stagesLabel = QLabel()
+        self._stagesLabel.setToolTip(
+            "Batches waiting for and being worked on by each stage's processes. "
+            "Batches piling up before a stage mean it needs more processes")
+        self.generalLayout.addWidget(self._stagesLabel)
+        self._progressBar.hide()
+        self._progressLabel.hide()
+        self._resourceLabel.hide()
+        self._watchLabel.hide()
+        self._stagesLabel.hide()
 
         self._t = QTime()
         self._timer = QTimer(self, interval=100, timeout=self._updateTime)
@@ -125,6 +465,10 @@ class DetectorUi(QMainWindow):
         self._timer.start()
         self._t.start()
         self._timeLabel.show()
+        self._progressBar.hide()
+        self._progressLabel.hide()
+        self._resourceLabel.hide()
+        self._stagesLabel.hide()
 
     def stopTimer(self):
         self._timer.stop()
@@ -133,49 +477,124 @@ class DetectorUi(QMainWindow):
             "Run complete. Total Time: " + self._timeStr)
 
     def _updateTime(self):
-
-        def formatTime(h, m, s):
-            h = str(h)
-            m = str(m)
-            s = str(s)
-            if (len(h) < 2):
-                h = "0" + h
-            if (len(m) < 2):
-                m = "0" + m
-            if (len(s) < 2):
-                s = "0" + s
-
-            if (h == "00"):
-                return m + ":" + s
-            else:
-                return h + ":" + m + ":" + s
-
-        secs = QTime.elapsed(self._t) // 1000
-        hours = secs // 3600
-        secs %= 3600
-        minutes = secs // 60
-        secs %= 60
-
-        self._timeStr = formatTime(hours, minutes, secs)
+        self._timeStr = formatTime(QTime.elapsed(self._t) // 1000)
 
         self._timeLabel.setText(
             "Time Elapsed: " + self._timeStr)
 
+    def updateProgress(self, progress):
+        """Show a progress snapshot from the detector run."""
+        self._progressBar.setValue(int(progress["fraction"] * 1000))
+        self._progressBar.show()
+
+        text = "%d/%d files" % (progress["filesDone"], progress["filesTotal"])
+        if progress["audioHoursTotal"] > 0:
+            text += ", %.1f of %.1f audio h, %.1f audio h per h" % (
+                progress["audioHoursDone"], progress["audioHoursTotal"],
+                progress["throughput"])
+        if progress["etaSeconds"] is not None:
+            text += ", ETA " + formatTime(int(progress["etaSeconds"]))
+        if progress.get("predictedSeconds") is not None:
+            text += " (runs like this take about %s)" % formatTime(
+                int(progress["predictedSeconds"]))
+        self._progressLabel.setText(text)
+        self._progressLabel.show()
+
+        stages = progress.get("stages")
+        if stages:
+            parts = []
+            for stage in ("spectrograms", "predictions"):
+                info = stages.get(stage)
+                if info is None:
+                    continue
+                if progress["audioHoursTotal"] > 0:
+                    rate = "%.1f audio h per h" % info["throughput"]
+                else:
+                    rate = "%.0f files per h" % info["filesPerHour"]
+                parts.append("%s: %d/%d busy, %d waiting, %s" % (
+                    stage.capitalize(), info["running"], info["workers"],
+                    info["waiting"], rate))
+            self._stagesLabel.setText("   ".join(parts))
+            self._stagesLabel.show()
+
+    def updateResources(self, sample):
+        """Show a resource usage sample of the detector processes."""
+        text = "CPU %d%%, RAM %s (peak %s), read %s/s, write %s/s" % (
+            sample["cpuPercent"], formatBytes(sample["rssBytes"]),
+            formatBytes(sample["peakRssBytes"]), formatBytes(sample["readRate"]),
+            formatBytes(sample["writeRate"]))
+        swapRate = sample["swapInRate"] + sample["swapOutRate"]
+        if swapRate > 0:
+            text += ", swapping %s/s" % formatBytes(swapRate)
+        self._resourceLabel.setText(text)
+        self._resourceLabel.show()
+
+    def updateWatchStats(self, stats):
+        """Show the backlog and latency of watch mode; None hides them."""
+        if stats is None:
+            self._watchLabel.hide()
+            return
+        text = "Watching: %d waiting, %d done" % (stats["backlog"], stats["processed"])
+        if stats["failed"]:
+            text += ", %d failed" % stats["failed"]
+        if stats["lastLatency"] is not None:
+            text += ", latency %s (average %s)" % (
+                formatTime(int(stats["lastLatency"])), formatTime(int(stats["meanLatency"])))
+        self._watchLabel.setText(text)
+        self._watchLabel.show()
+
+    def loadResources(self):
+        """Load the icons, after the window is first shown."""
+        # Importing images_qr registers the icons with Qt's resource system
+        import images_qr  # noqa: F401
+        self.setWindowIcon(QIcon(':/elp-logo.png'))
+
     def showHelpDialog(self):
-        self.helpDialog = HelpDialog()
+        if self.helpDialog is None:
+            from help_dialog import HelpDialog
+            self.helpDialog = HelpDialog()
         self.helpDialog.exec()
 
 
     def appendDisplayText(self, text):
-        """Set outputView's text."""
-        # self.outputView.appendPlainText(text)
-        self.outputView.moveCursor(QTextCursor.End)
+        """Queue output for outputView. The view is refreshed on a timer."""
         if(text != ""):
+            self._pendingText.append(text)
+            self._pendingLines += text.count("\n")
+            if not self._displayTimer.isActive():
+                self._displayTimer.start()
+
+    def _flushDisplayText(self):
+        """Show queued output, redrawing from the ring buffer when there is a lot."""
+        if not self._pendingText:
+            self._displayTimer.stop()
+            return
+
+        text = "".join(self._pendingText)
+        self._pendingText = []
+
+        # Continue a partial last line before splitting into the ring buffer
+        if self._logLines and not self._logLines[-1].endswith("\n"):
+            text = self._logLines.pop() + text
+            self.outputView.moveCursor(QTextCursor.End)
+            self.outputView.moveCursor(QTextCursor.StartOfBlock, QTextCursor.KeepAnchor)
+            self.outputView.textCursor().removeSelectedText()
+        self._logLines.extend(text.splitlines(True))
+
+        if self._pendingLines > self._maxLogLines // 4:
+            self.outputView.setPlainText("".join(self._logLines))
+        else:
+            self.outputView.moveCursor(QTextCursor.End)
             self.outputView.insertPlainText(text)
-            self.outputView.update()
+        self.outputView.moveCursor(QTextCursor.End)
+        self._pendingLines = 0
 
     def setDisplayText(self, text):
         """Set outputView's text."""
+        self._pendingText = []
+        self._pendingLines = 0
+        self._logLines.clear()
+        self._logLines.extend(text.splitlines(True))
         self.outputView.setPlainText(text)
 
     def displayText(self):
@@ -184,7 +603,7 @@ class DetectorUi(QMainWindow):
 
     def clearDisplay(self):
         """Clear the outputView."""
-        self.outputView.setPlainText("")
+        self.setDisplayText("")
         self.outputView.setFocus()
 
     
@@ -193,34 +612,25 @@ class DetectorUi(QMainWindow):
 class SubprocessWorker(QObject):
     runStarted = pyqtSignal()
     writeOutput = pyqtSignal(str)
+    progressChanged = pyqtSignal(dict)
+    resourcesChanged = pyqtSignal(dict)
     finished = pyqtSignal()
 
-    def __init__(self, scriptDir, dataDir, spectDir):
+    def __init__(self, scriptDir, dataDir, spectDir, **runOptions):
         super().__init__()
         self.scriptDir = scriptDir
         self.dataDir = dataDir
         self.spectDir = spectDir
 
-        self.inferencePipeline = ["python", "-u", "Inference_pipeline.py",
-                                  "--process_data", "--make_predictions",
-                                  "--model_0", "2_Stage_Model/first_stage.pt",
-                                  "--model_1", "2_Stage_Model/second_stage.pt",
-                                  "--data_dir", self.dataDir, "--spect_out", self.spectDir]
-
-        # self.dataGeneration = ["python", "-u", "Inference_pipeline.py",
-        #                        "--process_data", "--data_dir", dataDir, "--spect_out", spectDir]
-
-        # # uses dataDir for the spect directory bc spect output does not work properly
-        # self.modelPredictions = ["python", "-u", "Inference_pipeline.py",
-        #                          "--make_predictions",
-        #                          "--model_0", "2_Stage_Model/first_stage.pt",
-        #                          "--model_1", "2_Stage_Model/second_stage.pt",
-        #                          "--spect_path", dataDir]
+        from detector_runner import DetectorRun
+        self.detectorRun = DetectorRun(scriptDir, dataDir, spectDir,
+                                       output=self.writeOutput.emit,
+                                       onProgress=self.progressChanged.emit,
+                                       onResources=self.resourcesChanged.emit,
+                                       **runOptions)
 
     def run(self):
 
-        # steps = [self.inferencePipeline,
-        #          self.dataGeneration, self.modelPredictions]
         if (not self.scriptDir or not self.dataDir or not self.spectDir):
             if (not self.scriptDir):
                 print("Please select a script directory before running.")
@@ -234,21 +644,37 @@ class SubprocessWorker(QObject):
 
         self.runStarted.emit()
 
-        steps = [self.inferencePipeline]
+        try:
+            self.detectorRun.run()
+            print("Detector run has completed. ")
+        except Exception as e:
+            # Run must be enabled again whatever went wrong
+            self.writeOutput.emit("Detector run failed: %s\n" % e)
+        finally:
+            self.finished.emit()
+
+
+class JobQueueSignals(QObject):
+    """Carries job scheduler callbacks from its threads to the GUI thread."""
+    jobChanged = pyqtSignal(object)
+    writeOutput = pyqtSignal(str)
+
 
-        for step in steps:
-            process = subprocess.Popen(
-                step, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=self.scriptDir)
-            for line in iter(process.stdout.readline, b''):
-                strLine = line.decode(sys.stdout.encoding)
+class AgentSignals(QObject):
+    """Carries agent status checks from their threads to the GUI thread."""
+    writeOutput = pyqtSignal(str)
 
-                # comment this line out before bundling to exe
-                # sys.stdout.write(strLine)
-                self.writeOutput.emit(strLine)
 
-        print("Detector run has completed. ")
+class TuneSignals(QObject):
+    """Carries tuning output and its result from its thread to the GUI thread."""
+    writeOutput = pyqtSignal(str)
+    finished = pyqtSignal(object)
 
-        self.finished.emit()
+
+class WatchSignals(QObject):
+    """Carries watch mode callbacks from its threads to the GUI thread."""
+    statsChanged = pyqtSignal(dict)
+    writeOutput = pyqtSignal(str)
 
 
 class GuiController:
@@ -257,19 +683,91 @@ class GuiController:
     def __init__(self, view):
         """Controller Initializer"""
         self._view = view
+        self._scheduler = None
+        self._activeRun = None
+        self._queueSignals = JobQueueSignals()
+        self._queueSignals.jobChanged.connect(self._refreshQueue)
+        self._queueSignals.writeOutput.connect(self._view.appendDisplayText)
+        self._watchSession = None
+        self._resultsDialog = None
+        self._logViewers = []
+        self._watchSignals = WatchSignals()
+        self._watchSignals.statsChanged.connect(self._view.updateWatchStats)
+        self._watchSignals.writeOutput.connect(self._view.appendDisplayText)
+        self._agentSignals = AgentSignals()
+        self._agentSignals.writeOutput.connect(self._view.appendDisplayText)
+        self._tuner = None
+        self._streamBatchSize = None
+        self._tuneSignals = TuneSignals()
+        self._tuneSignals.writeOutput.connect(self._view.appendDisplayText)
+        self._tuneSignals.finished.connect(self._tuningFinished)
         # Connect signals and slots
         self._connectSignals()
 
-    def _runDetector(self):
+    def _runOptions(self):
+        """DetectorRun options chosen in the view."""
+        from process_control import ProcessLimits, parseCpuList
+        from spect_cache import GB
+        try:
+            cpus = parseCpuList(self._view.cpusEdit.text())
+        except ValueError:
+            self._view.appendDisplayText(
+                "Ignoring CPU cores '%s'; use a list such as 0-3,6\n"
+                % self._view.cpusEdit.text())
+            cpus = None
+        limits = ProcessLimits(threads=self._view.threadsSpin.value(), cpus=cpus,
+                               lowPriority=self._view.lowPriorityCheck.isChecked())
+        from remote_agent import parseAgentList
+        try:
+            agents = parseAgentList(self._view.agentsEdit.text())
+        except ValueError as e:
+            self._view.appendDisplayText("Ignoring the agents: %s\n" % e)
+            agents = []
+        options = {"limits": limits,
+                   "agents": agents,
+                   "agentToken": self._view.agentTokenEdit.text(),
+                   "shards": self._view.shardsSpin.value(),
+                   "maxProcesses": self._view.processesSpin.value(),
+                   "incremental": self._view.incrementalCheck.isChecked(),
+                   "streaming": self._view.streamingCheck.isChecked(),
+                   "spectrogramWorkers": self._view.spectWorkersSpin.value() or None,
+                   "predictionWorkers": self._view.predictWorkersSpin.value() or None,
+                   "keepSpectrograms": self._view.keepSpectCheck.isChecked(),
+                   "checkpoint": self._view.checkpointCheck.isChecked(),
+                   "windowSeconds": self._view.windowSpin.value() * 60,
+                   "modelVariant": self._view.modelVariantCombo.currentData(),
+                   "cacheBudget": self._view.cacheSpin.value() * GB}
+        if self._streamBatchSize:
+            options["streamBatchSize"] = self._streamBatchSize
+        return options
+
+    def _runDetector(self, resumeInterrupted=False):
 
         scriptDir = self._view.scriptFolderEdit.text()
         dataDir = self._view.soundFolderEdit.text()
         spectDir = self._view.outputFolderEdit.text()
 
+        if spectDir and not resumeInterrupted:
+            from checkpoint import Checkpoint
+            checkpoint = Checkpoint.load(spectDir)
+            if checkpoint is not None and checkpoint.remaining():
+                self._view.appendDisplayText(
+                    "The output folder has an interrupted run with %d recordings left; "
+                    "starting over. Use Resume Interrupted to continue it instead.\n"
+                    % len(checkpoint.remaining()))
+
         # Create QThread object
         self.thread = QThread()
         # Create a worker object
-        self.worker = SubprocessWorker(scriptDir, dataDir, spectDir)
+        self.worker = SubprocessWorker(scriptDir, dataDir, spectDir,
+                                       resumeInterrupted=resumeInterrupted,
+                                       **self._runOptions())
+
+        # Only one direct run at a time; use the job queue for more
+        self._view.runBtn.setEnabled(False)
+        self._view.resumeRunBtn.setEnabled(False)
+        self._view.pauseBtn.setEnabled(True)
+        self._activeRun = self.worker.detectorRun
 
         # Move worker to the thread
         self.worker.moveToThread(self.thread)
@@ -278,20 +776,315 @@ class GuiController:
         self.worker.finished.connect(self.thread.quit)
         self.worker.finished.connect(self.worker.deleteLater)
         self.worker.finished.connect(self._view.stopTimer)
+        self.worker.finished.connect(self._runFinished)
 
         self.thread.finished.connect(self.thread.deleteLater)
 
         self.worker.runStarted.connect(self._view.startTimer)
         self.worker.writeOutput.connect(self._view.appendDisplayText)
+        self.worker.progressChanged.connect(self._view.updateProgress)
+        self.worker.resourcesChanged.connect(self._view.updateResources)
         # Start the thread
         self.thread.start()
 
+    def _runFinished(self):
+        self._activeRun = None
+        self._view.runBtn.setEnabled(True)
+        self._view.resumeRunBtn.setEnabled(True)
+        self._view.pauseBtn.setEnabled(False)
+        self._view.pauseBtn.setText('Pause')
+
+    def _cancelRun(self):
+        """Cancel the current run, or close the window if there is none."""
+        if self._activeRun is None:
+            QApplication.quit()
+            return
+        self._view.appendDisplayText("Cancelling run...\n")
+        # Stopping the process tree can take a few seconds
+        threading.Thread(target=self._activeRun.cancel, daemon=True).start()
+
+    def _togglePause(self):
+        if self._activeRun is None:
+            return
+        if self._activeRun.paused:
+            self._activeRun.resume()
+            self._view.pauseBtn.setText('Pause')
+            self._view.appendDisplayText("Run resumed.\n")
+        else:
+            self._activeRun.pause()
+            self._view.pauseBtn.setText('Resume')
+            self._view.appendDisplayText("Run paused.\n")
+
+    def _stopAll(self):
+        """Stop every run when the application quits, so no processes are left behind."""
+        if self._activeRun is not None:
+            self._activeRun.cancel()
+        if self._scheduler is not None:
+            self._scheduler.cancelAll()
+        if self._watchSession is not None:
+            self._watchSession.stop()
+        if self._tuner is not None:
+            self._tuner.cancel()
+
+    def _showResults(self):
+        """Open the results panel for the output folder."""
+        spectDir = self._view.outputFolderEdit.text()
+        if not spectDir or not os.path.isdir(spectDir):
+            self._view.appendDisplayText("Please select an output folder to browse.\n")
+            return
+        from results_view import ResultsDialog
+        import sqlite3
+        try:
+            self._resultsDialog = ResultsDialog(spectDir)
+        except (sqlite3.Error, OSError) as e:
+            self._view.appendDisplayText("Could not open the results: %s\n" % e)
+            return
+        self._resultsDialog.show()
+
+    def _showLog(self):
+        """Open a run log from the output folder in the log viewer."""
+        path, _ = QFileDialog.getOpenFileName(
+            None, "Open Run Log", self._view.outputFolderEdit.text(),
+            "Run logs (elp_run_*.log*);;All files (*)")
+        if not path:
+            return
+        from log_view import LogViewer
+        try:
+            viewer = LogViewer(path)
+        except (OSError, ValueError) as e:
+            self._view.appendDisplayText("Could not open the log: %s\n" % e)
+            return
+        self._logViewers = [v for v in self._logViewers if v.isVisible()] + [viewer]
+        viewer.show()
+
+    def _checkAgents(self):
+        """Report whether each agent listed can be reached."""
+        from remote_agent import AgentClient, parseAgentList
+        try:
+            agents = parseAgentList(self._view.agentsEdit.text())
+        except ValueError as e:
+            self._view.appendDisplayText("%s\n" % e)
+            return
+        if not agents:
+            self._view.appendDisplayText("No agents are listed.\n")
+            return
+        token = self._view.agentTokenEdit.text()
+
+        def check(host, port):
+            client = AgentClient(host, port, token)
+            status = client.ping()
+            if status is None:
+                text = "Agent %s is not reachable or refused the token\n" % client.name
+            else:
+                text = "Agent %s (%s): %d slots, %d shards running, %d run so far\n" % (
+                    client.name, status["host"], status["slots"], status["running"],
+                    status["jobsRun"])
+            self._agentSignals.writeOutput.emit(text)
+
+        # Unreachable agents take seconds to time out
+        for host, port in agents:
+            threading.Thread(target=check, args=(host, port), daemon=True).start()
+
+    def _toggleTuning(self):
+        """Start timing trials over the sound folder, or stop them."""
+        if self._tuner is not None:
+            self._view.appendDisplayText("Stopping tuning...\n")
+            threading.Thread(target=self._tuner.cancel, daemon=True).start()
+            return
+
+        scriptDir = self._view.scriptFolderEdit.text()
+        dataDir = self._view.soundFolderEdit.text()
+        if not scriptDir or not dataDir:
+            self._view.appendDisplayText(
+                "Please select the script and sound file folders before tuning.\n")
+            return
+
+        from autotune import Tuner
+        limits = self._runOptions()["limits"]
+        self._tuner = Tuner(scriptDir, dataDir, output=self._tuneSignals.writeOutput.emit,
+                            limits=limits)
+        self._view.tuneBtn.setText('Stop Tuning')
+
+        def tune(tuner):
+            try:
+                profile = tuner.run()
+            except Exception as e:
+                self._tuneSignals.writeOutput.emit("Tuning failed: %s\n" % e)
+                profile = None
+            self._tuneSignals.finished.emit(profile)
+
+        # Trials run the detector several times over
+        threading.Thread(target=tune, args=(self._tuner,), daemon=True).start()
+
+    def _tuningFinished(self, profile):
+        self._tuner = None
+        self._view.tuneBtn.setText('Tune')
+        if profile is not None:
+            self._applyProfile(profile)
+
+    def _applyProfile(self, profile):
+        """Set the run options to a TuningProfile's settings."""
+        self._view.shardsSpin.setValue(profile.processes)
+        self._view.processesSpin.setValue(profile.processes)
+        self._view.threadsSpin.setValue(profile.threads or 0)
+        self._view.streamingCheck.setChecked(profile.streaming)
+        self._streamBatchSize = profile.streamBatchSize
+
+    def _toggleWatch(self):
+        """Start watching the sound folder for new recordings, or stop."""
+        if self._watchSession is not None:
+            # Stopping cancels the batch in progress, which can take a few seconds
+            threading.Thread(target=self._watchSession.stop, daemon=True).start()
+            self._watchSession = None
+            self._view.watchBtn.setText('Watch Folder')
+            self._view.updateWatchStats(None)
+            self._view.appendDisplayText("Stopped watching the sound folder.\n")
+            return
+
+        scriptDir = self._view.scriptFolderEdit.text()
+        dataDir = self._view.soundFolderEdit.text()
+        spectDir = self._view.outputFolderEdit.text()
+        if not scriptDir or not dataDir or not spectDir:
+            self._view.appendDisplayText(
+                "Please select the script, sound file and output folders "
+                "before watching.\n")
+            return
+
+        from watch_folder import WatchSession
+        self._watchSession = WatchSession(
+            scriptDir, dataDir, spectDir, output=self._watchSignals.writeOutput.emit,
+            onStats=self._watchSignals.statsChanged.emit, **self._runOptions())
+        # Finding the recordings not yet processed reads the whole folder
+        threading.Thread(target=self._watchSession.start, daemon=True).start()
+        self._view.watchBtn.setText('Stop Watching')
+
+    def _jobScheduler(self):
+        """The job scheduler, started when the first job is queued."""
+        if self._scheduler is None:
+            from job_queue import JobScheduler
+            self._scheduler = JobScheduler(
+                maxSlots=self._view.slotsSpin.value(),
+                output=self._queueSignals.writeOutput.emit,
+                onJobChanged=self._queueSignals.jobChanged.emit)
+        return self._scheduler
+
+    def _enqueueJob(self):
+        scriptDir = self._view.scriptFolderEdit.text()
+        dataDir = self._view.soundFolderEdit.text()
+        spectDir = self._view.outputFolderEdit.text()
+        if not scriptDir or not dataDir or not spectDir:
+            self._view.appendDisplayText(
+                "Please select the script, sound file and output folders "
+                "before adding a job.\n")
+            return
+
+        from job_queue import Job
+        self._jobScheduler().enqueue(
+            Job(scriptDir, dataDir, spectDir, **self._runOptions()))
+
+    def _moveJob(self, offset):
+        jobId = self._view.selectedJobId()
+        if self._scheduler is not None and jobId is not None:
+            self._scheduler.move(jobId, offset)
+            self._refreshQueue()
+
+    def _removeJob(self):
+        jobId = self._view.selectedJobId()
+        if self._scheduler is not None and jobId is not None:
+            if not self._scheduler.remove(jobId):
+                self._view.appendDisplayText("Running jobs cannot be removed.\n")
+            self._refreshQueue()
+
+    def _toggleJobPause(self):
+        jobId = self._view.selectedJobId()
+        if self._scheduler is None or jobId is None:
+            return
+        from job_queue import RUNNING, PAUSED
+        status = next((job.status for job in self._scheduler.jobs if job.id == jobId), None)
+        if status == PAUSED:
+            self._scheduler.resume(jobId)
+        elif status == RUNNING:
+            self._scheduler.pause(jobId)
+
+    def _cancelJob(self):
+        jobId = self._view.selectedJobId()
+        if self._scheduler is not None and jobId is not None:
+            threading.Thread(target=self._scheduler.cancel, args=(jobId,),
+                             daemon=True).start()
+
+    def _setMaxSlots(self, maxSlots):
+        if self._scheduler is not None:
+            self._scheduler.setMaxSlots(maxSlots)
+
+    def _refreshQueue(self, job=None):
+        if self._scheduler is not None:
+            self._view.setQueueJobs(list(self._scheduler.jobs))
+            self._view.setQueueStats(self._scheduler.stats())
+
+    def _toggleWarmWorker(self):
+        """Start a warm worker for the script folder, or stop the running one."""
+        scriptDir = self._view.scriptFolderEdit.text()
+        if not scriptDir:
+            self._view.appendDisplayText(
+                "Please select a script directory before starting the worker.\n")
+            return
+
+        from warm_worker import WarmWorkerClient, startWarmWorker
+        client = WarmWorkerClient.connect(scriptDir)
+        if client is not None:
+            client.shutdown()
+            self._view.workerBtn.setText('Start Worker')
+            self._view.appendDisplayText("Warm worker stopped.\n")
+            return
+
+        process = startWarmWorker(scriptDir)
+        self._view.workerBtn.setText('Starting Worker...')
+        self._view.workerBtn.setEnabled(False)
+        self._view.appendDisplayText(
+            "Warm worker starting; runs use it once the models are loaded.\n")
+        # The worker only answers once its models are loaded
+        deadline = time.monotonic() + WORKER_START_SECONDS
+        timer = QTimer(self._view, interval=WORKER_CHECK_MS)
+
+        def checkStarted():
+            if WarmWorkerClient.connect(scriptDir) is not None:
+                message = "Warm worker ready.\n"
+                label = 'Stop Worker'
+            elif process.poll() is not None:
+                message = "Warm worker failed to start (exit code %d).\n" % process.returncode
+                label = 'Start Worker'
+            elif time.monotonic() > deadline:
+                message = "Warm worker did not start within %d seconds.\n" % WORKER_START_SECONDS
+                label = 'Start Worker'
+            else:
+                return
+            timer.stop()
+            timer.deleteLater()
+            self._view.appendDisplayText(message)
+            self._view.workerBtn.setText(label)
+            self._view.workerBtn.setEnabled(True)
+
+        timer.timeout.connect(checkStarted)
+        timer.start()
+
     def _openFolderSelect(self, lineEdit):
         """Opens folder select dialog and sets the text of lineEdit to the folder path"""
         folder = str(QFileDialog.getExistingDirectory(
             None, "Select Directory"))
         lineEdit.setText(folder)
 
+    def finishStartup(self):
+        """Work deferred until the window is on screen."""
+        self._view.loadResources()
+        from process_control import defaultSlots
+        self._view.slotsSpin.setValue(defaultSlots())
+        from autotune import TuningProfile
+        profile = TuningProfile.load()
+        if profile is not None:
+            self._applyProfile(profile)
+            self._view.appendDisplayText(
+                "Using the settings tuned for this computer: %s\n" % profile.describe())
+
     def _connectSignals(self):
         """Connects signals and slots"""
 
@@ -299,10 +1092,31 @@ class GuiController:
         self._view.helpBtn.clicked.connect(self._view.showHelpDialog)
 
         # Connect run button to run the detector
-        self._view.runBtn.clicked.connect(self._runDetector)
-
-        # Connect cancel button to close window
-        self._view.cancelBtn.clicked.connect(QApplication.quit)
+        self._view.runBtn.clicked.connect(lambda: self._runDetector())
+        self._view.resumeRunBtn.clicked.connect(
+            lambda: self._runDetector(resumeInterrupted=True))
+
+        # Connect job queue controls
+        self._view.enqueueBtn.clicked.connect(self._enqueueJob)
+        self._view.queueUpBtn.clicked.connect(lambda: self._moveJob(-1))
+        self._view.queueDownBtn.clicked.connect(lambda: self._moveJob(1))
+        self._view.queueRemoveBtn.clicked.connect(self._removeJob)
+        self._view.queuePauseBtn.clicked.connect(self._toggleJobPause)
+        self._view.queueCancelBtn.clicked.connect(self._cancelJob)
+        self._view.slotsSpin.valueChanged.connect(self._setMaxSlots)
+
+        # Connect worker button to start or stop the warm worker
+        self._view.workerBtn.clicked.connect(self._toggleWarmWorker)
+        self._view.tuneBtn.clicked.connect(self._toggleTuning)
+        self._view.watchBtn.clicked.connect(self._toggleWatch)
+        self._view.resultsBtn.clicked.connect(self._showResults)
+        self._view.logBtn.clicked.connect(self._showLog)
+        self._view.checkAgentsBtn.clicked.connect(self._checkAgents)
+
+        # Connect cancel button to stop the run, or close the window when idle
+        self._view.cancelBtn.clicked.connect(self._cancelRun)
+        self._view.pauseBtn.clicked.connect(self._togglePause)
+        QApplication.instance().aboutToQuit.connect(self._stopAll)
         
 
         # Connect folder browse buttons to open folder select dialog
@@ -330,15 +1144,21 @@ def main():
     # Set AppUserModelID
     # Necessary to load windows taskbar icon
     myappid = u'ElephantListeningProject.Detector.GUI.0.1'  # arbitrary string
-    ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
+    if sys.platform == "win32":
+        ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
 
     # Create an instance of QApplication
     detectorUi = QApplication(sys.argv)
+    startup_profile.mark("QApplication created")
     # Show the GUI
     view = DetectorUi()
     view.show()
+    startup_profile.mark("main window shown")
     # Create instances of controller
-    GuiController(view=view)
+    controller = GuiController(view=view)
+    # Runs once the window has been painted
+    QTimer.singleShot(0, startup_profile.finish)
+    QTimer.singleShot(0, controller.finishStartup)
     # Execute the main loop
     sys.exit(detectorUi.exec_())
 
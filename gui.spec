@@ -7,7 +7,9 @@ block_cipher = None
 a = Analysis(['gui.py'],
              pathex=[],
              binaries=[],
-             datas=[('help.txt', '.'), ('detector_requirements.txt', '.')],
+             datas=[('help.txt', '.'), ('detector_requirements.txt', '.'),
+                    ('warm_worker.py', '.'), ('app_dirs.py', '.'),
+                    ('progress.py', '.'), ('sharding.py', '.')],
              hiddenimports=[],
              hookspath=[],
              hooksconfig={},
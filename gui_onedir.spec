@@ -0,0 +1,49 @@
+# -*- mode: python ; coding: utf-8 -*-
+
+# Fast-start build: the program is installed as a folder, so nothing is
+# unpacked to a temporary folder on each launch as with the one-file gui.spec.
+# Binaries are not UPX-compressed, which would also slow every start.
+
+block_cipher = None
+
+
+a = Analysis(['gui.py'],
+             pathex=[],
+             binaries=[],
+             datas=[('help.txt', '.'), ('detector_requirements.txt', '.'),
+                    ('warm_worker.py', '.'), ('app_dirs.py', '.'),
+                    ('progress.py', '.'), ('sharding.py', '.')],
+             hiddenimports=[],
+             hookspath=[],
+             hooksconfig={},
+             runtime_hooks=[],
+             excludes=[],
+             win_no_prefer_redirects=False,
+             win_private_assemblies=False,
+             cipher=block_cipher,
+             noarchive=False)
+pyz = PYZ(a.pure, a.zipped_data,
+             cipher=block_cipher)
+
+exe = EXE(pyz,
+          a.scripts,
+          [],
+          exclude_binaries=True,
+          name='gui',
+          debug=False,
+          bootloader_ignore_signals=False,
+          strip=False,
+          upx=False,
+          console=True,
+          disable_windowed_traceback=False,
+          target_arch=None,
+          codesign_identity=None,
+          entitlements_file=None , icon='icon.ico')
+coll = COLLECT(exe,
+               a.binaries,
+               a.zipfiles,
+               a.datas,
+               strip=False,
+               upx=False,
+               upx_exclude=[],
+               name='gui')
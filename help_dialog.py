@@ -1,12 +1,19 @@
 import os
 import sys
-import subprocess
+import threading
 
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QIcon
+from PyQt5.QtCore import Qt, QObject, pyqtSignal
+from PyQt5.QtGui import QIcon, QTextCursor
 from PyQt5.QtWidgets import QVBoxLayout, QHBoxLayout, QPushButton, \
     QPlainTextEdit, QDialog
 
+INSTALL_OUTPUT_LINES = 5000
+
+class InstallSignals(QObject):
+  """Carries provisioning output from its thread to the GUI thread."""
+  writeOutput = pyqtSignal(str)
+  finished = pyqtSignal(int)
+
 class HelpDialog(QDialog):
   def __init__(self):
     super().__init__()
@@ -25,7 +32,11 @@ class HelpDialog(QDialog):
     self.helpLayout.setContentsMargins(10, 10, 10, 10)
     self.setLayout(self.helpLayout)
 
+    self.provisioner = None
+    self.installSignals = InstallSignals()
+
     self._createInstructions()
+    self._createInstallOutput()
     self._createButtons()
 
     self._connectSignals()
@@ -51,6 +62,13 @@ class HelpDialog(QDialog):
     instructions.setPlainText(helpText)
     self.helpLayout.addWidget(instructions)
 
+  def _createInstallOutput(self):
+    self.installOutput = QPlainTextEdit()
+    self.installOutput.setReadOnly(True)
+    self.installOutput.setMaximumBlockCount(INSTALL_OUTPUT_LINES)
+    self.installOutput.hide()
+    self.helpLayout.addWidget(self.installOutput)
+
   def _createButtons(self):
     btnLayout = QHBoxLayout()
 
@@ -65,6 +83,10 @@ class HelpDialog(QDialog):
     self.helpLayout.addLayout(btnLayout)
 
   def _installDependencies(self):
+    # The button cancels an install in progress
+    if self.provisioner is not None:
+      self.provisioner.cancel()
+      return
 
     # Use this for one file bundling
     requirementsPath = os.path.abspath(os.path.join(self.bundle_dir, "detector_requirements.txt"))
@@ -72,12 +94,39 @@ class HelpDialog(QDialog):
     # Use this for one directory bundling
     #requirementsPath = "detector_requirements.txt"
 
-    subprocess.check_call(["python", "-m", "pip", "install", "-r", requirementsPath])
-
-    print("\nDependencies Installed")
+    from provisioning import Provisioner
+    self.installOutput.clear()
+    self.installOutput.show()
+    try:
+      self.provisioner = Provisioner(requirementsPath, output=self.installSignals.writeOutput.emit)
+    except OSError as e:
+      self._appendInstallOutput("Could not read %s: %s\n" % (requirementsPath, e))
+      return
+    self.installBtn.setText('Cancel Install')
+    # pip can take minutes, so it runs on its own thread
+    threading.Thread(target=self._provision, args=(self.provisioner,), daemon=True).start()
+
+  def _provision(self, provisioner):
+    try:
+      returncode = provisioner.run()
+    except Exception as e:
+      self.installSignals.writeOutput.emit("Installation failed: %s\n" % e)
+      returncode = 1
+    self.installSignals.finished.emit(returncode)
+
+  def _appendInstallOutput(self, text):
+    self.installOutput.moveCursor(QTextCursor.End)
+    self.installOutput.insertPlainText(text)
+    self.installOutput.moveCursor(QTextCursor.End)
+
+  def _installFinished(self, returncode):
+    self.provisioner = None
+    self.installBtn.setText('Install Dependencies')
 
 
   def _connectSignals(self):
     self.okBtn.clicked.connect(self.close)
     self.installBtn.clicked.connect(self._installDependencies)
+    self.installSignals.writeOutput.connect(self._appendInstallOutput)
+    self.installSignals.finished.connect(self._installFinished)
         
\ No newline at end of file
@@ -0,0 +1,225 @@
+"""Queue of detector runs over several sound folders, run a few at a time."""
+
+import os
+import time
+import itertools
+import threading
+
+import psutil
+
+from detector_runner import DetectorRun
+from output_capture import LinePrefixer
+from process_control import MEMORY_PER_PROCESS, defaultSlots
+
+QUEUED = "Queued"
+RUNNING = "Running"
+DONE = "Done"
+FAILED = "Failed"
+CANCELLED = "Cancelled"
+PAUSED = "Paused"
+
+
+class Job:
+    """One queued detector run. runOptions are passed on to DetectorRun."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, scriptDir, dataDir, spectDir, **runOptions):
+        self.id = next(self._ids)
+        self.scriptDir = scriptDir
+        self.dataDir = dataDir
+        self.spectDir = spectDir
+        self.runOptions = runOptions
+        self.status = QUEUED
+        self.returncode = None
+        self.progress = None
+        self.startTime = None
+        self.endTime = None
+        self.detectorRun = None
+
+    @property
+    def slots(self):
+        """Number of pipeline processes the job runs at the same time."""
+        shards = self.runOptions.get("shards", 1)
+        if self.runOptions.get("streaming"):
+            # Counted as one slot for each spectrogram and prediction pair
+            shards = max(shards, self.runOptions.get("spectrogramWorkers") or 0,
+                         self.runOptions.get("predictionWorkers") or 0)
+        maxProcesses = self.runOptions.get("maxProcesses") or os.cpu_count() or 1
+        return max(1, min(shards, maxProcesses))
+
+
+class JobScheduler:
+    """Runs queued jobs in order without exceeding maxSlots pipeline processes.
+
+    A job also waits while free memory is below what its processes need,
+    unless nothing else is running. onJobChanged(job) is called from worker
+    threads whenever a job's status or progress changes, and output(text)
+    receives every job's output prefixed with its job number.
+    """
+
+    def __init__(self, maxSlots=None, output=print, onJobChanged=None):
+        self.maxSlots = maxSlots or defaultSlots()
+        self.output = output
+        self.onJobChanged = onJobChanged
+        self.jobs = []
+        self._cond = threading.Condition()
+        self._busySince = None
+        self._busySeconds = 0.0
+        threading.Thread(target=self._dispatch, daemon=True).start()
+
+    def enqueue(self, job):
+        with self._cond:
+            self.jobs.append(job)
+            self._cond.notify()
+        self._changed(job)
+        return job
+
+    def remove(self, jobId):
+        """Remove a job that has not started. Returns False if it is running."""
+        with self._cond:
+            job = self._find(jobId)
+            if job is None or job.status in (RUNNING, PAUSED):
+                return False
+            self.jobs.remove(job)
+            return True
+
+    def move(self, jobId, offset):
+        """Move a job up (negative offset) or down the queue."""
+        with self._cond:
+            job = self._find(jobId)
+            if job is None:
+                return
+            index = self.jobs.index(job)
+            newIndex = max(0, min(len(self.jobs) - 1, index + offset))
+            self.jobs.insert(newIndex, self.jobs.pop(index))
+            self._cond.notify()
+
+    def cancel(self, jobId):
+        """Cancel a job: a queued one never starts, a running one is stopped."""
+        with self._cond:
+            job = self._find(jobId)
+            if job is None:
+                return
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                self._cond.notify()
+            detectorRun = job.detectorRun if job.status in (RUNNING, PAUSED) else None
+        if detectorRun is not None:
+            # Terminating the processes can take a few seconds, so not under the lock
+            detectorRun.cancel()
+        self._changed(job)
+
+    def cancelAll(self):
+        for job in list(self.jobs):
+            self.cancel(job.id)
+
+    def pause(self, jobId):
+        """Suspend a running job's processes. Its slots stay taken."""
+        with self._cond:
+            job = self._find(jobId)
+            if job is None or job.status != RUNNING or job.detectorRun is None:
+                return
+            job.detectorRun.pause()
+            job.status = PAUSED
+        self._changed(job)
+
+    def resume(self, jobId):
+        with self._cond:
+            job = self._find(jobId)
+            if job is None or job.status != PAUSED:
+                return
+            job.detectorRun.resume()
+            job.status = RUNNING
+        self._changed(job)
+
+    def setMaxSlots(self, maxSlots):
+        with self._cond:
+            self.maxSlots = max(1, maxSlots)
+            self._cond.notify()
+
+    def stats(self):
+        """Queue totals, including audio hours per wall hour while jobs were running."""
+        with self._cond:
+            busySeconds = self._busySeconds
+            if self._busySince is not None:
+                busySeconds += time.monotonic() - self._busySince
+            audioHours = sum(job.progress["audioHoursDone"] for job in self.jobs
+                             if job.progress is not None)
+            counts = {}
+            for job in self.jobs:
+                counts[job.status] = counts.get(job.status, 0) + 1
+        throughput = audioHours * 3600 / busySeconds if busySeconds > 0 else 0.0
+        return {"counts": counts, "audioHoursDone": audioHours,
+                "throughput": throughput}
+
+    def _find(self, jobId):
+        return next((job for job in self.jobs if job.id == jobId), None)
+
+    def _usedSlots(self):
+        return sum(job.slots for job in self.jobs if job.status in (RUNNING, PAUSED))
+
+    def _nextJob(self):
+        """The first queued job that fits, or None. Jobs are not started out of order."""
+        job = next((job for job in self.jobs if job.status == QUEUED), None)
+        if job is None:
+            return None
+        used = self._usedSlots()
+        if used == 0:
+            return job
+        if used + job.slots > self.maxSlots:
+            return None
+        if psutil.virtual_memory().available < job.slots * MEMORY_PER_PROCESS:
+            return None
+        return job
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                job = self._nextJob()
+                while job is None:
+                    # Also wake periodically, as memory may have been freed
+                    self._cond.wait(timeout=5)
+                    job = self._nextJob()
+                job.status = RUNNING
+                job.startTime = time.time()
+                if self._busySince is None:
+                    self._busySince = time.monotonic()
+            self._changed(job)
+            threading.Thread(target=self._runJob, args=(job,), daemon=True).start()
+
+    def _runJob(self, job):
+        prefixer = LinePrefixer("[job %d] " % job.id, self.output)
+
+        def onProgress(progress):
+            job.progress = progress
+            self._changed(job)
+
+        try:
+            detectorRun = DetectorRun(job.scriptDir, job.dataDir, job.spectDir,
+                                      output=prefixer.feed, onProgress=onProgress,
+                                      **job.runOptions)
+            with self._cond:
+                job.detectorRun = detectorRun
+            job.returncode = detectorRun.run()
+        except Exception as e:
+            prefixer.feed("Job failed: %s\n" % e)
+            job.returncode = 1
+        prefixer.flush()
+
+        with self._cond:
+            if job.detectorRun is not None and job.detectorRun.cancelled:
+                job.status = CANCELLED
+            else:
+                job.status = DONE if job.returncode == 0 else FAILED
+            job.detectorRun = None
+            job.endTime = time.time()
+            if not any(other.status in (RUNNING, PAUSED) for other in self.jobs):
+                self._busySeconds += time.monotonic() - self._busySince
+                self._busySince = None
+            self._cond.notify()
+        self._changed(job)
+
+    def _changed(self, job):
+        if self.onJobChanged is not None:
+            self.onJobChanged(job)
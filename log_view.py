@@ -0,0 +1,188 @@
+"""Viewer for run logs too large to load into a text widget."""
+
+import os
+import sys
+
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QTimer
+from PyQt5.QtGui import QIcon, QFont, QColor
+from PyQt5.QtWidgets import QApplication, QDialog, QVBoxLayout, QHBoxLayout, QLabel, \
+    QLineEdit, QPushButton, QTableView, QCheckBox, QHeaderView, QAbstractItemView
+
+from run_log import LogFile, ERROR_WORDS, isErrorLine
+
+
+FOLLOW_INTERVAL_MS = 1000
+
+
+class LogModel(QAbstractListModel):
+    """One row per line of a LogFile, read only when the view asks for it."""
+
+    def __init__(self, logFile):
+        super().__init__()
+        self.logFile = logFile
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.logFile.lineCount
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self.logFile.line(index.row())
+        if role == Qt.ForegroundRole and isErrorLine(self.logFile.line(index.row())):
+            return QColor(Qt.red)
+        return None
+
+    def refresh(self):
+        """Show lines added to the file. Returns True if there were any."""
+        oldCount = self.logFile.lineCount
+        if not self.logFile.refresh():
+            return False
+        if self.logFile.lineCount < oldCount:
+            self.beginResetModel()
+            self.endResetModel()
+        else:
+            # The last line may have been partial and now be complete
+            if oldCount:
+                self.dataChanged.emit(self.index(oldCount - 1), self.index(oldCount - 1))
+            if self.logFile.lineCount > oldCount:
+                self.beginInsertRows(QModelIndex(), oldCount, self.logFile.lineCount - 1)
+                self.endInsertRows()
+        return True
+
+
+class LogViewer(QDialog):
+    """Shows a log file with search and jumps between error lines.
+
+    The table only asks for the lines on screen, so opening a multi-GB
+    log is about as quick as opening a small one. A QTableView with fixed
+    row heights is used because QListView and QTreeView lay out every row
+    when shown, which takes seconds for millions of lines.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.setWindowTitle("ELP Detector Log - " + path)
+        self.setWindowIcon(QIcon(':/elp-logo.png'))
+        self.setWindowFlags(self.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+        self.resize(900, 600)
+
+        self.logFile = LogFile(path)
+        self.model = LogModel(self.logFile)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(10, 10, 10, 10)
+        self.setLayout(layout)
+
+        searchLayout = QHBoxLayout()
+        self.searchEdit = QLineEdit()
+        self.searchEdit.setPlaceholderText("Search")
+        self.caseCheck = QCheckBox("Match Case")
+        self.findPrevBtn = QPushButton("Previous")
+        self.findNextBtn = QPushButton("Next")
+        self.prevErrorBtn = QPushButton("Previous Error")
+        self.nextErrorBtn = QPushButton("Next Error")
+        self.followCheck = QCheckBox("Follow")
+        self.followCheck.setToolTip("Keep showing the end of a log that is still being written")
+        searchLayout.addWidget(self.searchEdit, 1)
+        searchLayout.addWidget(self.caseCheck)
+        searchLayout.addWidget(self.findPrevBtn)
+        searchLayout.addWidget(self.findNextBtn)
+        searchLayout.addWidget(self.prevErrorBtn)
+        searchLayout.addWidget(self.nextErrorBtn)
+        searchLayout.addWidget(self.followCheck)
+        layout.addLayout(searchLayout)
+
+        self.logView = QTableView()
+        self.logView.setModel(self.model)
+        self.logView.verticalHeader().hide()
+        self.logView.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.logView.horizontalHeader().hide()
+        self.logView.horizontalHeader().setStretchLastSection(True)
+        self.logView.setShowGrid(False)
+        self.logView.setWordWrap(False)
+        self.logView.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.logView.setSelectionMode(QAbstractItemView.SingleSelection)
+        font = QFont("Courier")
+        font.setStyleHint(QFont.Monospace)
+        self.logView.setFont(font)
+        layout.addWidget(self.logView)
+
+        self.statusLabel = QLabel()
+        layout.addWidget(self.statusLabel)
+        self._updateStatus()
+
+        self._followTimer = QTimer(self)
+        self._followTimer.setInterval(FOLLOW_INTERVAL_MS)
+        self._followTimer.timeout.connect(self._follow)
+
+        self.searchEdit.returnPressed.connect(lambda: self._find(False))
+        self.findNextBtn.clicked.connect(lambda: self._find(False))
+        self.findPrevBtn.clicked.connect(lambda: self._find(True))
+        self.nextErrorBtn.clicked.connect(lambda: self._findError(False))
+        self.prevErrorBtn.clicked.connect(lambda: self._findError(True))
+        self.followCheck.toggled.connect(self._setFollow)
+        self.logView.selectionModel().currentChanged.connect(lambda: self._updateStatus())
+
+    def _currentLine(self):
+        index = self.logView.currentIndex()
+        return index.row() if index.isValid() else -1
+
+    def _jumpTo(self, line, notFound):
+        if line is None:
+            self.statusLabel.setText(notFound)
+            return
+        index = self.model.index(line)
+        self.logView.setCurrentIndex(index)
+        self.logView.scrollTo(index, QAbstractItemView.PositionAtCenter)
+
+    def _find(self, backwards):
+        text = self.searchEdit.text()
+        if not text:
+            return
+        line = self.logFile.find([text], self._currentLine(), backwards,
+                                 caseSensitive=self.caseCheck.isChecked())
+        self._jumpTo(line, '"%s" not found' % text)
+
+    def _findError(self, backwards):
+        line = self.logFile.find(ERROR_WORDS, self._currentLine(), backwards)
+        self._jumpTo(line, "No errors found")
+
+    def _setFollow(self, follow):
+        if follow:
+            self._follow()
+            self._followTimer.start()
+        else:
+            self._followTimer.stop()
+
+    def _follow(self):
+        self.model.refresh()
+        self.logView.scrollToBottom()
+        self._updateStatus()
+
+    def _updateStatus(self):
+        line = self._currentLine()
+        position = "line %d of " % (line + 1) if line >= 0 else ""
+        self.statusLabel.setText("%s%d lines, %.1f MB" % (
+            position, self.logFile.lineCount, self.logFile.size / 1024 ** 2))
+
+    def done(self, result):
+        # Closing the window or pressing Escape both end here
+        self._followTimer.stop()
+        self.logFile.close()
+        super().done(result)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1 or not os.path.isfile(argv[0]):
+        print("usage: log_view.py <log file>")
+        return 2
+    app = QApplication(sys.argv)
+    viewer = LogViewer(argv[0])
+    viewer.show()
+    return app.exec_()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""Record of which recordings an output folder already holds results for."""
+
+import os
+import json
+import hashlib
+
+
+MANIFEST_NAME = "elp_manifest.json"
+MANIFEST_VERSION = 1
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+_hashes = {}
+
+
+def fileHash(path):
+    """SHA-256 of a file's contents, remembered while its size and mtime stay the same."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key in _hashes:
+        return _hashes[key]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    _hashes[key] = digest.hexdigest()
+    return _hashes[key]
+
+
+def _fileKey(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+class Manifest:
+    """Processed-file manifest stored in an output folder.
+
+    Each input file is recorded with its size, mtime and content hash,
+    together with the hashes of the model files used. The hash is only
+    recomputed when size or mtime change, so checking an unchanged folder
+    costs one stat per file. Changing a model file empties the manifest.
+    """
+
+    def __init__(self, outputDir, modelPaths):
+        self.path = os.path.join(outputDir, MANIFEST_NAME)
+        self.modelPaths = [os.path.abspath(p) for p in modelPaths]
+        self.files = {}
+        self.models = {}
+        self.modelsChanged = False
+        self._checked = {}
+
+    @classmethod
+    def load(cls, outputDir, modelPaths):
+        manifest = cls(outputDir, modelPaths)
+        try:
+            with open(manifest.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+
+        if data.get("version") == MANIFEST_VERSION:
+            manifest.files = data.get("files", {})
+            manifest.models = data.get("models", {})
+
+        currentModels = {}
+        for modelPath in manifest.modelPaths:
+            currentModels[modelPath] = manifest._entryFor(
+                modelPath, manifest.models.get(modelPath))
+        if currentModels != manifest.models:
+            manifest.modelsChanged = bool(manifest.files)
+            manifest.files = {}
+        manifest.models = currentModels
+        return manifest
+
+    def _entryFor(self, path, previous=None):
+        """Manifest entry for path, reusing previous's hash if size and mtime match."""
+        try:
+            stat = os.stat(path)
+            if previous and previous["size"] == stat.st_size and \
+                    previous["mtime"] == stat.st_mtime_ns:
+                return previous
+            return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "sha256": fileHash(path)}
+        except OSError:
+            # Removed since the folder was listed
+            return None
+
+    def pendingFiles(self, files):
+        """The files that are new, or whose contents changed since they were processed."""
+        pending = []
+        for path in files:
+            key = _fileKey(path)
+            previous = self.files.get(key)
+            entry = self._entryFor(path, previous)
+            if entry is None:
+                continue
+            self._checked[key] = entry
+            if previous is None or entry["sha256"] != previous["sha256"]:
+                pending.append(path)
+            elif entry is not previous:
+                # Touched but identical contents; remember the new mtime
+                self.files[key] = entry
+        return pending
+
+    def markDone(self, files):
+        for path in files:
+            key = _fileKey(path)
+            entry = self._checked.pop(key, None) or self._entryFor(path, self.files.get(key))
+            if entry is not None:
+                self.files[key] = entry
+
+    def save(self):
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "models": self.models,
+                       "files": self.files}, f, indent=1)
+        os.replace(tmpPath, self.path)
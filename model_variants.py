@@ -0,0 +1,206 @@
+"""Faster CPU builds of the stage models, made on first use and cached.
+
+Each variant of a model is saved next to it, under
+2_Stage_Model/_variants/<variant>/<checkpoint hash>/, so a changed
+checkpoint gets a new build and the old one is simply no longer used.
+When the script folder cannot be written to, builds go to the user's
+data folder instead. Variants are saved as TorchScript archives, which
+torch.load hands on to torch.jit.load, so the pipeline loads them with
+the same call as the original checkpoints.
+
+    torchscript  the model compiled with torch.jit.script
+    quantized    Linear and recurrent layers quantized to int8 weights with
+                 torch's dynamic quantization, compiled with torch.jit.script
+                 where possible and otherwise saved as a whole module
+
+Only checkpoints saved as whole modules (torch.save(model)) can be
+converted; a checkpoint holding a state_dict raises VariantBuildError.
+"""
+
+import os
+import json
+import threading
+import subprocess
+
+from app_dirs import userDataDir
+from manifest import fileHash
+
+
+VARIANT_DIR_NAME = "_variants"
+VARIANTS = ("torchscript", "quantized")
+VARIANT_NAMES = {"torchscript": "TorchScript", "quantized": "Quantized int8"}
+BUILD_ERROR_NAME = "build_error.txt"
+# Characters of the checkpoint hash naming a build's folder
+HASH_PREFIX = 16
+
+# Run by the pipeline's Python in the script folder, so classes pickled
+# into the checkpoints can be imported. Reads [[source, dest, variant], ...]
+# on stdin and prints a JSON result line for each.
+_BUILD_SCRIPT = r"""
+import os, sys, json
+import torch
+
+def load(path):
+    try:
+        return torch.load(path, map_location="cpu", weights_only=False)
+    except TypeError:
+        return torch.load(path, map_location="cpu")
+
+for source, dest, variant in json.loads(sys.stdin.read()):
+    tmpPath = "%s.%d.tmp" % (dest, os.getpid())
+    try:
+        model = load(source)
+        if not isinstance(model, torch.nn.Module):
+            raise ValueError("it holds a %s rather than a whole model saved with "
+                             "torch.save(model)" % type(model).__name__)
+        model.eval()
+        if variant == "quantized":
+            quantization = getattr(torch, "ao", torch).quantization
+            model = quantization.quantize_dynamic(
+                model, {torch.nn.Linear, torch.nn.LSTM, torch.nn.GRU}, dtype=torch.qint8)
+        try:
+            torch.jit.save(torch.jit.script(model), tmpPath)
+            form = "TorchScript"
+        except Exception:
+            if variant != "quantized":
+                raise
+            torch.save(model, tmpPath)
+            form = "module"
+        os.replace(tmpPath, dest)
+        print(json.dumps({"dest": dest, "form": form}))
+    except Exception as e:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        print(json.dumps({"dest": dest, "error": "%s: %s" % (type(e).__name__, e)}))
+"""
+
+# Builds in one process share their folders, so they take turns
+_buildLock = threading.Lock()
+
+
+class VariantBuildError(Exception):
+    """A model variant could not be built."""
+
+
+def _buildDirs(source, variant):
+    """Folders a build of source may be in, next to it first."""
+    key = fileHash(source)[:HASH_PREFIX]
+    return [os.path.join(os.path.dirname(source), VARIANT_DIR_NAME, variant, key),
+            os.path.join(userDataDir("model_variants"), variant, key)]
+
+
+def _readError(folder):
+    try:
+        with open(os.path.join(folder, BUILD_ERROR_NAME)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def builtModels(scriptDir, variant, models):
+    """Paths of variant's builds of models, or the models themselves if not built yet.
+
+    models are paths relative to scriptDir. Nothing is built.
+    """
+    paths = []
+    for model in models:
+        source = os.path.join(scriptDir, model)
+        found = source
+        if os.path.exists(source):
+            for folder in _buildDirs(source, variant):
+                path = os.path.join(folder, os.path.basename(source))
+                if os.path.exists(path):
+                    found = path
+                    break
+        paths.append(found)
+    return paths
+
+
+def variantModels(scriptDir, variant, models, output=print):
+    """Paths of variant's builds of models, building those not built before.
+
+    models are paths relative to scriptDir. Raises VariantBuildError if a
+    model cannot be converted; the reason is kept with the build, so later
+    runs fail at once instead of trying again until the checkpoint changes.
+    """
+    if variant not in VARIANTS:
+        raise VariantBuildError("unknown model variant %r" % variant)
+    with _buildLock:
+        paths = []
+        jobs = []
+        for model in models:
+            source = os.path.join(scriptDir, model)
+            if not os.path.exists(source):
+                raise VariantBuildError("%s does not exist" % source)
+            folders = _buildDirs(source, variant)
+            path = None
+            for folder in folders:
+                candidate = os.path.join(folder, os.path.basename(source))
+                error = _readError(folder)
+                if error is not None:
+                    raise VariantBuildError("%s: %s" % (model, error))
+                if os.path.exists(candidate):
+                    path = candidate
+                    break
+            if path is None:
+                folder = _writableFolder(folders)
+                path = os.path.join(folder, os.path.basename(source))
+                jobs.append([source, path, variant])
+            paths.append(path)
+
+        if jobs:
+            output("Building %s models (only done once for each checkpoint)\n"
+                   % VARIANT_NAMES[variant])
+            _build(scriptDir, jobs, output)
+    return paths
+
+
+def _writableFolder(folders):
+    for folder in folders:
+        try:
+            os.makedirs(folder, exist_ok=True)
+        except OSError:
+            continue
+        if os.access(folder, os.W_OK):
+            return folder
+    raise VariantBuildError("none of %s can be written to" % ", ".join(folders))
+
+
+def _build(scriptDir, jobs, output):
+    """Run the build script over jobs, raising VariantBuildError for any failure."""
+    try:
+        result = subprocess.run(["python", "-c", _BUILD_SCRIPT], input=json.dumps(jobs),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True, cwd=scriptDir)
+    except OSError as e:
+        raise VariantBuildError("could not start python: %s" % e)
+
+    reports = {}
+    for line in result.stdout.splitlines():
+        try:
+            report = json.loads(line)
+        except ValueError:
+            # The checkpoints' modules may print when imported
+            continue
+        if isinstance(report, dict) and "dest" in report:
+            reports[report["dest"]] = report
+
+    errors = []
+    for source, dest, _ in jobs:
+        report = reports.get(dest)
+        if report is None:
+            # The interpreter failed before reaching this model, as when
+            # torch is missing; nothing is kept, so the next run tries again
+            lines = result.stderr.strip().splitlines()
+            raise VariantBuildError(lines[-1] if lines else
+                                    "the build exited with status %d" % result.returncode)
+        if "error" in report:
+            with open(os.path.join(os.path.dirname(dest), BUILD_ERROR_NAME), "w") as f:
+                f.write(report["error"] + "\n")
+            errors.append("%s: %s" % (os.path.basename(source), report["error"]))
+            continue
+        output("Built %s (%s, %.1f MB, was %.1f MB)\n"
+               % (dest, report["form"], os.path.getsize(dest) / 1024 ** 2,
+                  os.path.getsize(source) / 1024 ** 2))
+    if errors:
+        raise VariantBuildError("; ".join(errors))
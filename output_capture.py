@@ -0,0 +1,136 @@
+"""Coalesced capture of detector output.
+
+Output is read from the child process in large chunks on a reader thread
+and handed on in batches, so the GUI receives a few signals per second
+instead of one per line no matter how verbose the pipeline is.
+"""
+
+import sys
+import time
+import queue
+import codecs
+import threading
+
+
+DEFAULT_MAX_DELAY = 0.1
+DEFAULT_MAX_BYTES = 64 * 1024
+READ_SIZE = 64 * 1024
+
+
+class OutputBatcher:
+    """Collects text and passes it to callback in time- or size-bounded batches."""
+
+    def __init__(self, callback, maxDelay=DEFAULT_MAX_DELAY, maxBytes=DEFAULT_MAX_BYTES):
+        self.callback = callback
+        self.maxDelay = maxDelay
+        self.maxBytes = maxBytes
+        self._parts = []
+        self._size = 0
+        self._firstPending = None
+
+    def add(self, text):
+        if not text:
+            return
+        if self._firstPending is None:
+            self._firstPending = time.monotonic()
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.maxBytes or self.timeUntilFlush() == 0:
+            self.flush()
+
+    def timeUntilFlush(self):
+        """Seconds until pending text is due, or None if nothing is pending."""
+        if self._firstPending is None:
+            return None
+        return max(0.0, self._firstPending + self.maxDelay - time.monotonic())
+
+    def flush(self):
+        if self._parts:
+            text = "".join(self._parts)
+            self._parts = []
+            self._size = 0
+            self._firstPending = None
+            self.callback(text)
+
+
+def decodeStream(stream):
+    """Yield decoded text from a binary stream using large chunked reads."""
+    decoder = codecs.getincrementaldecoder(sys.stdout.encoding or "utf-8")(errors="replace")
+    read = getattr(stream, "read1", stream.read)
+    while True:
+        data = read(READ_SIZE)
+        if not data:
+            break
+        yield decoder.decode(data)
+    yield decoder.decode(b"", final=True)
+
+
+def _produce(texts, chunks):
+    try:
+        for text in texts:
+            chunks.put(text)
+    except BaseException as e:
+        chunks.put(e)
+    chunks.put(None)
+
+
+def pumpText(texts, callback, maxDelay=DEFAULT_MAX_DELAY, maxBytes=DEFAULT_MAX_BYTES):
+    """Deliver an iterable of text pieces to callback through an OutputBatcher.
+
+    The iterable is drained by a helper thread, so a quiet source never holds
+    back text that is already waiting to be shown. Errors raised by the
+    iterable are re-raised here after the pending text is delivered.
+    """
+    chunks = queue.Queue()
+    producer = threading.Thread(target=_produce, args=(texts, chunks), daemon=True)
+    producer.start()
+
+    batcher = OutputBatcher(callback, maxDelay, maxBytes)
+    error = None
+    while True:
+        try:
+            chunk = chunks.get(timeout=batcher.timeUntilFlush())
+        except queue.Empty:
+            batcher.flush()
+            continue
+        if chunk is None:
+            break
+        if isinstance(chunk, BaseException):
+            error = chunk
+            continue
+        batcher.add(chunk)
+
+    batcher.flush()
+    producer.join()
+    if error is not None:
+        raise error
+
+
+def pumpOutput(stream, callback, maxDelay=DEFAULT_MAX_DELAY, maxBytes=DEFAULT_MAX_BYTES):
+    """Read a child process's binary output stream until EOF in batches."""
+    pumpText(decodeStream(stream), callback, maxDelay, maxBytes)
+
+
+class LinePrefixer:
+    """Prefixes each complete line of text before passing it to callback.
+
+    Used to tell apart the interleaved output of parallel pipeline processes.
+    A partial last line is held back until its newline arrives or flush().
+    """
+
+    def __init__(self, prefix, callback):
+        self.prefix = prefix
+        self.callback = callback
+        self._partial = ""
+
+    def feed(self, text):
+        text = self._partial + text
+        lines = text.split("\n")
+        self._partial = lines.pop()
+        if lines:
+            self.callback("".join(self.prefix + line + "\n" for line in lines))
+
+    def flush(self):
+        if self._partial:
+            self.callback(self.prefix + self._partial + "\n")
+            self._partial = ""
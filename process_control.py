@@ -0,0 +1,140 @@
+"""Resource limits and control of detector process trees."""
+
+import os
+
+import psutil
+
+
+# Rough resident size of one pipeline process with torch and both models loaded
+MEMORY_PER_PROCESS = 2 * 1024 ** 3
+
+# Thread pools torch and numpy size from the environment at startup
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                   "NUMEXPR_NUM_THREADS"]
+
+if hasattr(psutil, "BELOW_NORMAL_PRIORITY_CLASS"):
+    LOW_PRIORITY = psutil.BELOW_NORMAL_PRIORITY_CLASS
+else:
+    LOW_PRIORITY = 10
+
+
+def defaultSlots():
+    """Pipeline processes this machine can run at once, by cores and free memory."""
+    cores = os.cpu_count() or 1
+    byMemory = psutil.virtual_memory().available // MEMORY_PER_PROCESS
+    return max(1, min(cores, byMemory))
+
+
+def parseCpuList(text):
+    """Parse a CPU list such as "0-3,6" into [0, 1, 2, 3, 6]. Empty means no limit."""
+    cpus = []
+    for part in text.replace(" ", "").split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return sorted(set(cpus)) or None
+
+
+class ProcessLimits:
+    """Per-run limits for pipeline processes.
+
+    threads caps torch's and OpenMP's thread pools, cpus pins processes to
+    the listed CPU numbers, and lowPriority runs them below normal priority
+    so a shared workstation stays usable.
+    """
+
+    def __init__(self, threads=None, cpus=None, lowPriority=False):
+        self.threads = threads or None
+        self.cpus = cpus or None
+        self.lowPriority = lowPriority
+
+    def childEnv(self, env=None):
+        """Environment for a pipeline process started under these limits."""
+        env = dict(env if env is not None else os.environ)
+        if self.threads:
+            for name in THREAD_ENV_VARS:
+                env[name] = str(self.threads)
+        return env
+
+    def apply(self, pid):
+        """Apply CPU affinity and priority to a running process."""
+        if not self.cpus and not self.lowPriority:
+            return
+        try:
+            process = psutil.Process(pid)
+            if self.cpus and hasattr(process, "cpu_affinity"):
+                process.cpu_affinity(self.cpus)
+            if self.lowPriority:
+                process.nice(LOW_PRIORITY)
+        except psutil.Error:
+            pass
+
+    def applyTemporarily(self, pid):
+        """Apply the limits to a long-lived process; returns a function undoing them."""
+        try:
+            process = psutil.Process(pid)
+            affinity = process.cpu_affinity() if hasattr(process, "cpu_affinity") else None
+            priority = process.nice()
+        except psutil.Error:
+            return lambda: None
+
+        self.apply(pid)
+
+        def restore():
+            # Raising priority back can need privileges on POSIX, in which
+            # case the process keeps running at low priority
+            try:
+                if affinity is not None and self.cpus:
+                    process.cpu_affinity(affinity)
+                if self.lowPriority:
+                    process.nice(priority)
+            except psutil.Error:
+                pass
+
+        return restore
+
+
+def _tree(pid):
+    try:
+        parent = psutil.Process(pid)
+        return [parent] + parent.children(recursive=True)
+    except psutil.Error:
+        return []
+
+
+def killTree(pid, timeout=3):
+    """Terminate a process and all its descendants, killing any that linger."""
+    processes = _tree(pid)
+    for process in processes:
+        try:
+            process.terminate()
+        except psutil.Error:
+            pass
+    _, alive = psutil.wait_procs(processes, timeout=timeout)
+    for process in alive:
+        try:
+            process.kill()
+        except psutil.Error:
+            pass
+
+
+def suspendTree(pid):
+    """Pause a process and all its descendants."""
+    for process in _tree(pid):
+        try:
+            process.suspend()
+        except psutil.Error:
+            pass
+
+
+def resumeTree(pid):
+    """Continue a process tree paused with suspendTree."""
+    for process in _tree(pid):
+        try:
+            process.resume()
+        except psutil.Error:
+            pass
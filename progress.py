@@ -0,0 +1,214 @@
+"""Structured progress reporting for detector runs.
+
+The pipeline can report progress as JSON lines written to a pipe that is
+kept separate from its log output. The pipe is given to the child through
+an environment variable: ELP_PROGRESS_FD holds a file descriptor number
+(POSIX, and jobs run inside the warm worker), ELP_PROGRESS_HANDLE an
+inheritable OS handle (Windows, open it with msvcrt.open_osfhandle).
+Recognised events:
+
+    {"event": "file_done", "file": "rec01.wav", "audioSeconds": 86400.0}
+    {"event": "stage", "stage": "spectrograms", "seconds": 12.5}
+
+Other lines are ignored. The runner reports the same events itself for
+work it can observe, such as finished batches and shards, so progress is
+shown for pipelines that do not write to the channel. Files are counted
+once however many times they are reported.
+
+Runs with overlapping stages also report each stage's worker pool: how
+many batches wait for it, how many its workers are on, and how fast
+recordings pass through it.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+
+import sharding
+
+
+PROGRESS_FD_ENV = "ELP_PROGRESS_FD"
+PROGRESS_HANDLE_ENV = "ELP_PROGRESS_HANDLE"
+
+
+class ProgressTracker:
+    """Turns progress events into files done, throughput and ETA."""
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._done = set()
+        self._parts = {}
+        self._audioDone = 0.0
+        self._predictedSeconds = None
+        self._stageSeconds = {}
+        self._stages = {}
+        self._startTime = time.monotonic()
+
+    def start(self, files):
+        """Begin tracking a run over files. Durations are read from WAV headers."""
+        with self._lock:
+            self._durations = {os.path.basename(path): sharding.wavDuration(path) or 0.0
+                               for path in files}
+            self._done = set()
+            self._parts = {}
+            self._audioDone = 0.0
+            self._predictedSeconds = None
+            self._stages = {}
+            self._startTime = time.monotonic()
+        self._notify()
+
+    def filesDone(self, files):
+        with self._lock:
+            for path in files:
+                name = os.path.basename(path)
+                if name in self._durations and name not in self._done:
+                    self._done.add(name)
+                    self._audioDone += self._durations[name] - self._parts.pop(name, 0.0)
+        self._notify()
+
+    def filePartDone(self, path, seconds):
+        """Count seconds of a file's audio as done, without finishing the file."""
+        with self._lock:
+            name = os.path.basename(path)
+            if name in self._durations and name not in self._done:
+                part = min(self._parts.get(name, 0.0) + seconds, self._durations[name])
+                self._audioDone += part - self._parts.get(name, 0.0)
+                self._parts[name] = part
+        self._notify()
+
+    def setPrediction(self, seconds):
+        """Expected length of the run, used for the ETA until files finish."""
+        with self._lock:
+            self._predictedSeconds = seconds
+        self._notify()
+
+    def stageTime(self, stage, seconds):
+        with self._lock:
+            self._stageSeconds[stage] = self._stageSeconds.get(stage, 0.0) + seconds
+        self._notify()
+
+    def stageQueue(self, stage, waiting, running, workers):
+        """Batches waiting for stage and being worked on by its workers."""
+        with self._lock:
+            info = self._stages.setdefault(stage, _newStage())
+            info.update(waiting=waiting, running=running, workers=workers)
+        self._notify()
+
+    def stageFilesDone(self, stage, files):
+        """Count files as through stage, for its rate."""
+        with self._lock:
+            info = self._stages.setdefault(stage, _newStage())
+            info["filesDone"] += len(files)
+            info["audioDone"] += sum(self._durations.get(os.path.basename(path), 0.0)
+                                     for path in files)
+        self._notify()
+
+    def handleEvent(self, event):
+        """Apply one event from the progress channel."""
+        kind = event.get("event")
+        if kind == "file_done" and event.get("file"):
+            self.filesDone([event["file"]])
+        elif kind == "stage" and event.get("stage"):
+            self.stageTime(event["stage"], float(event.get("seconds", 0.0)))
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = time.monotonic() - self._startTime
+            audioTotal = sum(self._durations.values())
+            filesTotal = len(self._durations)
+            if audioTotal > 0:
+                fraction = self._audioDone / audioTotal
+            else:
+                fraction = len(self._done) / filesTotal if filesTotal else 0.0
+
+            # Audio hours per wall hour is simply audio seconds per wall second
+            throughput = self._audioDone / elapsed if elapsed > 0 else 0.0
+            eta = None
+            if 0 < fraction < 1:
+                eta = elapsed * (1 - fraction) / fraction
+            elif fraction == 0 and self._predictedSeconds is not None:
+                eta = max(0.0, self._predictedSeconds - elapsed)
+
+            stages = {}
+            for stage, info in self._stages.items():
+                stages[stage] = dict(info)
+                stages[stage]["filesPerHour"] = info["filesDone"] * 3600 / elapsed \
+                    if elapsed > 0 else 0.0
+                stages[stage]["throughput"] = info["audioDone"] / elapsed if elapsed > 0 else 0.0
+
+            return {"filesDone": len(self._done), "filesTotal": filesTotal,
+                    "audioHoursDone": self._audioDone / 3600,
+                    "audioHoursTotal": audioTotal / 3600,
+                    "fraction": fraction, "throughput": throughput,
+                    "etaSeconds": eta, "elapsedSeconds": elapsed,
+                    "predictedSeconds": self._predictedSeconds,
+                    "stageSeconds": dict(self._stageSeconds),
+                    "stages": stages}
+
+    def _notify(self):
+        if self.callback is not None:
+            self.callback(self.snapshot())
+
+
+def _newStage():
+    return {"waiting": 0, "running": 0, "workers": 0, "filesDone": 0, "audioDone": 0.0}
+
+
+def readEvents(stream, onEvent):
+    """Parse JSON-line events from a binary stream until EOF."""
+    for line in stream:
+        try:
+            event = json.loads(line.decode("utf-8"))
+        except ValueError:
+            continue
+        if isinstance(event, dict):
+            onEvent(event)
+
+
+class ProgressChannel:
+    """Progress pipe for one child process."""
+
+    def __init__(self, onEvent):
+        self.onEvent = onEvent
+        self._readFd, self._writeFd = os.pipe()
+        self._reader = None
+
+    def popenKwargs(self, env=None):
+        """Extra subprocess.Popen arguments that hand the write end to the child."""
+        env = dict(env if env is not None else os.environ)
+        if sys.platform == "win32":
+            import msvcrt
+            handle = msvcrt.get_osfhandle(self._writeFd)
+            os.set_handle_inheritable(handle, True)
+            env[PROGRESS_HANDLE_ENV] = str(handle)
+            startupInfo = subprocess.STARTUPINFO()
+            startupInfo.lpAttributeList = {"handle_list": [handle]}
+            return {"env": env, "startupinfo": startupInfo}
+        env[PROGRESS_FD_ENV] = str(self._writeFd)
+        return {"env": env, "pass_fds": (self._writeFd,)}
+
+    def start(self):
+        """Start reading; call once the child has been started."""
+        os.close(self._writeFd)
+        self._writeFd = None
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        with os.fdopen(self._readFd, "rb") as stream:
+            readEvents(stream, self.onEvent)
+
+    def close(self):
+        """Wait for the child's end of the pipe to close and stop reading."""
+        if self._writeFd is not None:
+            os.close(self._writeFd)
+            self._writeFd = None
+            os.close(self._readFd)
+        if self._reader is not None:
+            # A grandchild that inherited the pipe could keep it open forever
+            self._reader.join(timeout=5)
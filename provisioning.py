@@ -0,0 +1,265 @@
+"""Installs the detector pipeline's dependencies, skipping work already done.
+
+Run on a computer with internet access, and the same operating system and
+Python version, to fill a wheelhouse that can be copied to computers
+without it:
+
+    python provisioning.py --download_only --wheelhouse <folder>
+"""
+
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import threading
+import subprocess
+
+from app_dirs import userDataDir, pathKey
+from output_capture import pumpOutput
+from process_control import killTree
+
+
+REQUIREMENTS_NAME = "detector_requirements.txt"
+WHEELHOUSE_ENV = "ELP_WHEELHOUSE"
+PIP_OPTIONS = ["--disable-pip-version-check", "--progress-bar", "off"]
+
+_REQUIREMENT = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[[^\]]*\])?\s*(?:==\s*([^\s;,]+))?")
+
+# Run by the target interpreter: reports requirements it does not satisfy
+_CHECK_SCRIPT = r"""
+import sys, json
+try:
+    from importlib.metadata import version, PackageNotFoundError
+except ImportError:
+    import pkg_resources
+    PackageNotFoundError = pkg_resources.DistributionNotFound
+    version = lambda name: pkg_resources.get_distribution(name).version
+missing = []
+for name, wanted in json.loads(sys.stdin.read()):
+    try:
+        installed = version(name)
+    except PackageNotFoundError:
+        installed = None
+    if installed is None or (wanted and installed.split("+")[0] != wanted):
+        missing.append([name, wanted, installed])
+sitePackages = [p for p in sys.path if p.endswith(("site-packages", "dist-packages"))]
+print(json.dumps({"missing": missing, "sitePackages": sitePackages}))
+"""
+
+
+def parseRequirements(text):
+    """(name, pinned version or None) for each requirement line."""
+    requirements = []
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line or line.startswith("-"):
+            continue
+        match = _REQUIREMENT.match(line)
+        if match:
+            requirements.append((match.group(1), match.group(2)))
+    return requirements
+
+
+def defaultWheelhouse():
+    return os.environ.get(WHEELHOUSE_ENV) or userDataDir("wheelhouse")
+
+
+def _dirTimes(paths):
+    times = {}
+    for path in paths:
+        try:
+            times[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            times[path] = None
+    return times
+
+
+class Provisioner:
+    """Brings the pipeline's Python environment up to detector_requirements.txt.
+
+    run() first compares a stamp saved after the last successful check with
+    the requirements file and the modification times of the interpreter's
+    site-packages folders, which change whenever a package is installed or
+    removed; if they match nothing else is done. Otherwise the interpreter
+    reports which pinned versions it lacks, which takes well under a
+    second. Missing packages are installed from the wheelhouse without
+    using the network, and only if the wheelhouse lacks some of them are
+    they downloaded into it first, so later installs on this or any
+    computer the wheelhouse is copied to need no network. With offline set
+    nothing is downloaded. Output of pip is passed to output as it runs.
+    """
+
+    def __init__(self, requirementsPath, output=print, python=None, wheelhouse=None,
+                 offline=False):
+        self.requirementsPath = requirementsPath
+        self.output = output
+        # The pipeline runs with python on PATH, which a frozen GUI is not
+        self.python = python or shutil.which("python") or "python"
+        self.wheelhouse = wheelhouse or defaultWheelhouse()
+        self.offline = offline
+        with open(requirementsPath) as f:
+            self.requirementsText = f.read()
+        self.requirements = parseRequirements(self.requirementsText)
+        self.stampPath = os.path.join(userDataDir("provisioning"),
+                                      pathKey(self.python) + ".json")
+        self._process = None
+        self._lock = threading.Lock()
+        self._cancelled = False
+
+    def _fingerprint(self):
+        key = self.python + "\0" + self.requirementsText
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def isUpToDate(self):
+        """True if nothing changed since the environment last matched."""
+        try:
+            with open(self.stampPath) as f:
+                stamp = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return stamp.get("fingerprint") == self._fingerprint() and \
+            stamp.get("sitePackages") == _dirTimes(stamp["sitePackages"])
+
+    def check(self):
+        """Requirements the interpreter lacks, as (name, wanted, installed) lists.
+
+        The stamp is saved when there are none.
+        """
+        result = subprocess.run([self.python, "-c", _CHECK_SCRIPT],
+                                input=json.dumps(self.requirements),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        if result.returncode != 0:
+            raise RuntimeError("could not check %s: %s" % (self.python, result.stderr.strip()))
+        report = json.loads(result.stdout)
+        if not report["missing"]:
+            with open(self.stampPath, "w") as f:
+                json.dump({"fingerprint": self._fingerprint(),
+                           "sitePackages": _dirTimes(report["sitePackages"])}, f)
+        return report["missing"]
+
+    def _check(self):
+        try:
+            return self.check()
+        except (OSError, RuntimeError, ValueError) as e:
+            self.output("Could not check the installed packages: %s\n" % e)
+            return None
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            process = self._process
+        if process is not None:
+            killTree(process.pid)
+
+    def _pip(self, args):
+        with self._lock:
+            if self._cancelled:
+                return 1
+            try:
+                self._process = subprocess.Popen(
+                    [self.python, "-m", "pip"] + args + PIP_OPTIONS,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            except OSError as e:
+                self.output("Could not run pip: %s\n" % e)
+                return 1
+        try:
+            pumpOutput(self._process.stdout, self.output)
+            return self._process.wait()
+        finally:
+            with self._lock:
+                self._process = None
+
+    def _hasWheels(self):
+        return os.path.isdir(self.wheelhouse) and any(
+            name.endswith((".whl", ".tar.gz", ".zip")) for name in os.listdir(self.wheelhouse))
+
+    def _installFromWheelhouse(self):
+        return self._pip(["install", "--no-index", "--find-links", self.wheelhouse,
+                          "-r", self.requirementsPath])
+
+    def download(self):
+        """Add any missing packages to the wheelhouse. Returns pip's exit status."""
+        os.makedirs(self.wheelhouse, exist_ok=True)
+        self.output("Downloading packages into %s\n" % self.wheelhouse)
+        return self._pip(["download", "--dest", self.wheelhouse, "--find-links",
+                          self.wheelhouse, "-r", self.requirementsPath])
+
+    def run(self, force=False):
+        """Install what is missing. Returns 0 when the environment is up to date."""
+        if not force and self.isUpToDate():
+            self.output("Dependencies are already installed for %s\n" % self.python)
+            return 0
+        missing = self._check()
+        if missing is None:
+            return 1
+        if not missing:
+            self.output("Dependencies are already installed for %s\n" % self.python)
+            return 0
+        self.output("Installing missing packages: %s\n" % ", ".join(
+            name for name, _, _ in missing))
+
+        returncode = 1
+        if self._hasWheels():
+            self.output("Installing from the wheelhouse %s\n" % self.wheelhouse)
+            returncode = self._installFromWheelhouse()
+            if returncode != 0 and not self._cancelled:
+                self.output("The wheelhouse does not have every package\n")
+        if returncode != 0 and not self.offline:
+            returncode = self.download()
+            if returncode == 0:
+                returncode = self._installFromWheelhouse()
+        if self._cancelled:
+            self.output("Installation cancelled\n")
+            return 1
+        if returncode != 0:
+            self.output("Installation failed\n")
+            return returncode
+
+        missing = self._check()
+        if missing is None:
+            return 1
+        if missing:
+            self.output("Still missing after installing: %s\n" % ", ".join(
+                "%s==%s (have %s)" % tuple(item) for item in missing))
+            return 1
+        self.output("Dependencies Installed\n")
+        return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Install the detector pipeline's dependencies")
+    parser.add_argument("--requirements",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                             REQUIREMENTS_NAME),
+                        help="requirements file (default: %s next to this script)"
+                        % REQUIREMENTS_NAME)
+    parser.add_argument("--python", help="interpreter to install into (default: python on PATH)")
+    parser.add_argument("--wheelhouse",
+                        help="folder of downloaded packages (default: $%s or %s)"
+                        % (WHEELHOUSE_ENV, os.path.join("~", ".elp_detector", "wheelhouse")))
+    parser.add_argument("--offline", action="store_true",
+                        help="install only from the wheelhouse, never from the internet")
+    parser.add_argument("--download_only", action="store_true",
+                        help="fill the wheelhouse for installing on other computers")
+    parser.add_argument("--force", action="store_true",
+                        help="check the installed packages even if nothing seems to have changed")
+    args = parser.parse_args(argv)
+
+    def write(text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    provisioner = Provisioner(args.requirements, output=write, python=args.python,
+                              wheelhouse=args.wheelhouse, offline=args.offline)
+    if args.download_only:
+        return provisioner.download()
+    return provisioner.run(force=args.force)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,456 @@
+"""Agent that runs detector shards for a run on another computer.
+
+Start an agent on every computer that should help with a run, using the
+detector's own Python installation and a copy of the script folder:
+
+    python remote_agent.py --script_dir <script folder> --token <secret>
+
+Then list the agents as host:port in the GUI or with detector_cli.py
+--agents, giving the same token. The computer running the detector sends
+each agent shards of the sound folder: the recordings and, once per model
+version, the stage models. The agent runs the pipeline on them and sends
+the pipeline's output, progress and result files back.
+
+The agent accepts jobs from anyone who knows the token, so use one that is
+hard to guess and only run agents on trusted networks. Several agents can
+run on one computer with different --port and --work_dir values, which is
+also how distribution is tried out on a single machine.
+"""
+
+import os
+import sys
+import json
+import socket
+import select
+import shutil
+import secrets
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from app_dirs import userDataDir
+from manifest import fileHash
+from output_capture import pumpOutput
+from process_control import killTree
+from progress import ProgressChannel
+
+
+PIPELINE_SCRIPT = "Inference_pipeline.py"
+DEFAULT_PORT = 5890
+AGENT_TOKEN_ENV = "ELP_AGENT_TOKEN"
+# Agents send a heartbeat this often while a shard runs...
+HEARTBEAT_INTERVAL = 5.0
+# ...and one silent for this long has dropped out
+AGENT_TIMEOUT = 30.0
+PING_TIMEOUT = 5.0
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+def parseAgentList(text):
+    """(host, port) pairs from text such as "lab-pc:5890, 10.0.0.7"."""
+    agents = []
+    for item in text.replace(",", " ").split():
+        host, _, port = item.rpartition(":")
+        if not host:
+            host, port = port, ""
+        try:
+            agents.append((host, int(port) if port else DEFAULT_PORT))
+        except ValueError:
+            raise ValueError("not a host:port agent address: %s" % item)
+    return agents
+
+
+def _sendMessage(sock, message):
+    sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+
+def _readMessage(stream):
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line.decode("utf-8"))
+
+
+def _sendFile(sock, header, path):
+    """Send a message announcing a file of header["size"] bytes, then the bytes."""
+    _sendMessage(sock, header)
+    with open(path, "rb") as f:
+        sock.sendfile(f)
+
+
+def _receiveFile(stream, size, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        while size > 0:
+            chunk = stream.read(min(size, COPY_CHUNK_BYTES))
+            if not chunk:
+                raise ConnectionError("connection closed during a file transfer")
+            f.write(chunk)
+            size -= len(chunk)
+
+
+def _safeRelativePath(path):
+    """path if it stays inside the folder it is relative to, else None."""
+    path = os.path.normpath(path)
+    if os.path.isabs(path) or path == ".." or path.startswith(".." + os.sep):
+        return None
+    return path
+
+
+class AgentLost(Exception):
+    """The agent stopped responding or closed the connection during a shard."""
+
+
+class AgentClient:
+    """Sends shards to one agent."""
+
+    def __init__(self, host, port, token, timeout=AGENT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.timeout = timeout
+        self._sockets = set()
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return "%s:%d" % (self.host, self.port)
+
+    def _request(self, message, timeout=None):
+        sock = socket.create_connection((self.host, self.port),
+                                        timeout=timeout or self.timeout)
+        message["token"] = self.token
+        _sendMessage(sock, message)
+        return sock
+
+    def ping(self, timeout=PING_TIMEOUT):
+        """Agent status dict, or None if it cannot be reached or refuses the token."""
+        try:
+            sock = self._request({"cmd": "ping"}, timeout)
+            with sock, sock.makefile("rb") as stream:
+                reply = _readMessage(stream)
+        except (OSError, ValueError):
+            return None
+        if not reply or reply.get("type") != "pong":
+            return None
+        return reply
+
+    def runShard(self, files, modelPaths, outputDir, output, onProgress=None):
+        """Run the pipeline on files on the agent, writing its results to outputDir.
+
+        modelPaths are the first and second stage models; the agent is only
+        sent those it has not seen before. Returns the pipeline's exit
+        status. Raises AgentLost if the agent drops out, in which case
+        outputDir may hold partial results.
+        """
+        try:
+            sock = self._request({
+                "cmd": "run",
+                "models": [{"name": os.path.basename(path), "sha": fileHash(path),
+                            "size": os.path.getsize(path)} for path in modelPaths],
+                "files": [os.path.basename(path) for path in files]})
+        except OSError as e:
+            raise AgentLost(str(e))
+        with self._lock:
+            self._sockets.add(sock)
+        try:
+            with sock, sock.makefile("rb") as stream:
+                return self._runShard(sock, stream, files, modelPaths, outputDir,
+                                      output, onProgress)
+        except (OSError, ValueError) as e:
+            raise AgentLost(str(e) or e.__class__.__name__)
+        finally:
+            with self._lock:
+                self._sockets.discard(sock)
+
+    def _runShard(self, sock, stream, files, modelPaths, outputDir, output, onProgress):
+        reply = _readMessage(stream)
+        if reply is None or reply.get("type") != "need":
+            raise ConnectionError("the agent refused the shard")
+        needed = set(reply["models"])
+        for path in modelPaths:
+            sha = fileHash(path)
+            if sha in needed:
+                output("Sending %s to agent %s\n" % (os.path.basename(path), self.name))
+                _sendFile(sock, {"type": "model", "sha": sha,
+                                 "size": os.path.getsize(path)}, path)
+                needed.discard(sha)
+        for path in files:
+            _sendFile(sock, {"type": "file", "name": os.path.basename(path),
+                             "size": os.path.getsize(path)}, path)
+
+        while True:
+            message = _readMessage(stream)
+            if message is None:
+                raise ConnectionError("the agent closed the connection")
+            kind = message["type"]
+            if kind == "output":
+                output(message["data"])
+            elif kind == "progress":
+                if onProgress is not None:
+                    onProgress(message["event"])
+            elif kind == "result":
+                relPath = _safeRelativePath(message["path"])
+                if relPath is None:
+                    raise ValueError("unsafe result path from the agent: %s" % message["path"])
+                _receiveFile(stream, message["size"], os.path.join(outputDir, relPath))
+            elif kind == "done":
+                return message["returncode"]
+            elif kind == "error":
+                output("Agent %s: %s\n" % (self.name, message["message"]))
+                return 1
+
+    def cancel(self):
+        """Abandon running shards; the agent stops their pipelines."""
+        with self._lock:
+            sockets = list(self._sockets)
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class _Job:
+    """Messages of one shard job, sent from several threads."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = threading.Lock()
+        self.lost = threading.Event()
+        # Set once the job no longer needs heartbeats
+        self.stopped = threading.Event()
+        self.process = None
+
+    def send(self, message):
+        with self._lock:
+            if self.lost.is_set():
+                return
+            try:
+                _sendMessage(self.conn, message)
+            except OSError:
+                self._lose()
+
+    def sendFile(self, header, path):
+        with self._lock:
+            _sendFile(self.conn, header, path)
+
+    def watch(self):
+        """Stop the job as soon as the coordinator closes the connection.
+
+        Nothing is sent to the agent once the files are in, so anything
+        readable means the coordinator cancelled or went away.
+        """
+        while not self.stopped.is_set():
+            try:
+                readable, _, _ = select.select([self.conn], [], [], 1.0)
+                if not readable:
+                    continue
+                if self.conn.recv(1):
+                    continue
+            except (OSError, ValueError):
+                pass
+            if not self.stopped.is_set():
+                self._lose()
+            return
+
+    def _lose(self):
+        # The coordinator cancelled or went away; stop the pipeline
+        self.lost.set()
+        self.stopped.set()
+        if self.process is not None:
+            killTree(self.process.pid)
+
+
+class AgentServer:
+    """Accepts shard jobs from coordinators and runs them slots at a time."""
+
+    def __init__(self, scriptDir, token, host="0.0.0.0", port=DEFAULT_PORT,
+                 workDir=None, slots=1):
+        self.scriptDir = os.path.abspath(scriptDir)
+        self.token = token
+        self.host = host
+        self.port = port
+        self.workDir = workDir or userDataDir("agent")
+        self.slots = slots
+        self.jobsRun = 0
+        self.running = 0
+        self._slots = threading.Semaphore(slots)
+        self._stateLock = threading.Lock()
+        self._modelLock = threading.Lock()
+        os.makedirs(os.path.join(self.workDir, "models"), exist_ok=True)
+        # Shards left by an agent that was stopped mid-job
+        shutil.rmtree(os.path.join(self.workDir, "jobs"), ignore_errors=True)
+        os.makedirs(os.path.join(self.workDir, "jobs"))
+
+    def _modelPath(self, model):
+        return os.path.join(self.workDir, "models", model["sha"],
+                            os.path.basename(model["name"]))
+
+    def _handleConnection(self, conn):
+        with conn, conn.makefile("rb") as stream:
+            try:
+                message = _readMessage(stream)
+            except ValueError:
+                return
+            if not message or not secrets.compare_digest(
+                    str(message.get("token", "")), self.token):
+                return
+            cmd = message.get("cmd")
+            if cmd == "ping":
+                with self._stateLock:
+                    _sendMessage(conn, {"type": "pong", "host": socket.gethostname(),
+                                        "slots": self.slots, "running": self.running,
+                                        "jobsRun": self.jobsRun})
+            elif cmd == "run":
+                self._runJob(conn, stream, message)
+
+    def _runJob(self, conn, stream, message):
+        models = message["models"]
+        jobDir = tempfile.mkdtemp(prefix="job_", dir=os.path.join(self.workDir, "jobs"))
+        inputDir = os.path.join(jobDir, "input")
+        outputDir = os.path.join(jobDir, "output")
+        os.makedirs(inputDir)
+        os.makedirs(outputDir)
+        job = _Job(conn)
+        try:
+            needed = sorted(set(model["sha"] for model in models
+                                if not os.path.exists(self._modelPath(model))))
+            # Models are stored by content, so files of a new model
+            # version never replace ones a running shard is using
+            _sendMessage(conn, {"type": "need", "models": needed})
+            for _ in needed:
+                self._receiveModel(stream, models)
+            for name in message["files"]:
+                header = _readMessage(stream)
+                if header is None:
+                    return
+                _receiveFile(stream, header["size"],
+                             os.path.join(inputDir, os.path.basename(header["name"])))
+
+            heartbeat = threading.Thread(target=self._heartbeat, args=(job,), daemon=True)
+            heartbeat.start()
+            threading.Thread(target=job.watch, daemon=True).start()
+            with self._slots:
+                with self._stateLock:
+                    self.running += 1
+                try:
+                    returncode = self._runPipeline(job, [self._modelPath(m) for m in models],
+                                                   inputDir, outputDir)
+                finally:
+                    with self._stateLock:
+                        self.running -= 1
+                        self.jobsRun += 1
+            if job.lost.is_set():
+                return
+            for root, _, names in os.walk(outputDir):
+                for name in names:
+                    path = os.path.join(root, name)
+                    job.sendFile({"type": "result", "size": os.path.getsize(path),
+                                  "path": os.path.relpath(path, outputDir)}, path)
+            job.stopped.set()
+            heartbeat.join()
+            _sendMessage(conn, {"type": "done", "returncode": returncode})
+        except (OSError, ValueError) as e:
+            job.stopped.set()
+            try:
+                _sendMessage(conn, {"type": "error", "message": str(e)})
+            except OSError:
+                pass
+        finally:
+            job.stopped.set()
+            shutil.rmtree(jobDir, ignore_errors=True)
+
+    def _receiveModel(self, stream, models):
+        header = _readMessage(stream)
+        if header is None or header.get("type") != "model":
+            raise ValueError("expected a model file")
+        sameModels = [m for m in models if m["sha"] == header["sha"]]
+        tmpPath = os.path.join(self.workDir, "models",
+                               "%s.%d.tmp" % (header["sha"], threading.get_ident()))
+        _receiveFile(stream, header["size"], tmpPath)
+        if fileHash(tmpPath) != header["sha"]:
+            os.remove(tmpPath)
+            raise ValueError("model %s was damaged in transfer" % sameModels[0]["name"])
+        with self._modelLock:
+            # The same file may be given under several names
+            for model in sameModels[1:]:
+                os.makedirs(os.path.dirname(self._modelPath(model)), exist_ok=True)
+                shutil.copyfile(tmpPath, self._modelPath(model))
+            os.makedirs(os.path.dirname(self._modelPath(sameModels[0])), exist_ok=True)
+            os.replace(tmpPath, self._modelPath(sameModels[0]))
+
+    def _heartbeat(self, job):
+        while not job.stopped.wait(HEARTBEAT_INTERVAL):
+            job.send({"type": "heartbeat"})
+
+    def _runPipeline(self, job, modelPaths, inputDir, outputDir):
+        args = ["--process_data", "--make_predictions",
+                "--model_0", modelPaths[0], "--model_1", modelPaths[1],
+                "--data_dir", inputDir, "--spect_out", outputDir]
+        channel = ProgressChannel(lambda event: job.send({"type": "progress", "event": event}))
+        try:
+            job.process = subprocess.Popen(
+                [sys.executable, "-u", PIPELINE_SCRIPT] + args,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=self.scriptDir,
+                **channel.popenKwargs())
+            channel.start()
+            if job.lost.is_set():
+                killTree(job.process.pid)
+            pumpOutput(job.process.stdout,
+                       lambda text: job.send({"type": "output", "data": text}))
+            return job.process.wait()
+        finally:
+            channel.close()
+
+    def serve(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen()
+        print("ELP detector agent listening on %s:%d with %d slots"
+              % (self.host, listener.getsockname()[1], self.slots), flush=True)
+        try:
+            while True:
+                conn, _ = listener.accept()
+                conn.settimeout(AGENT_TIMEOUT)
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                threading.Thread(target=self._handleConnection, args=(conn,),
+                                 daemon=True).start()
+        finally:
+            listener.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ELP detector worker agent")
+    parser.add_argument("--script_dir", required=True,
+                        help="folder containing Inference_pipeline.py")
+    parser.add_argument("--token", default=os.environ.get(AGENT_TOKEN_ENV),
+                        help="secret the coordinator must send (default: $%s, "
+                        "or a new one that is printed)" % AGENT_TOKEN_ENV)
+    parser.add_argument("--host", default="0.0.0.0",
+                        help="address to listen on (default: all)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help="port to listen on (default: %d)" % DEFAULT_PORT)
+    parser.add_argument("--slots", type=int, default=1,
+                        help="shards to run at once (default: 1)")
+    parser.add_argument("--work_dir",
+                        help="folder for models and shards in progress "
+                        "(default: ~/.elp_detector/agent)")
+    args = parser.parse_args()
+
+    token = args.token
+    if not token:
+        token = secrets.token_hex(16)
+        print("Agent token: %s" % token, flush=True)
+    server = AgentServer(args.script_dir, token, host=args.host, port=args.port,
+                         workDir=args.work_dir, slots=max(1, args.slots))
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""Indexed store of detections, kept in the output folder as SQLite."""
+
+import os
+import io
+import re
+import csv
+import hashlib
+import sqlite3
+import calendar
+import datetime
+
+from sharding import TABLE_EXTENSIONS
+
+
+RESULTS_DB_NAME = "elp_results.sqlite"
+TAIL_BYTES = 4096
+INSERT_BATCH = 10000
+
+# Header names the pipeline or Raven selection tables may use, lower case
+FILE_COLUMNS = ("file", "filename", "file name", "begin file", "begin path",
+                "recording", "sound file", "path")
+START_COLUMNS = ("start", "start time", "start (s)", "start_time", "begin time (s)",
+                 "begin time", "begin", "onset")
+END_COLUMNS = ("end", "end time", "end (s)", "end_time", "end time (s)", "offset")
+SCORE_COLUMNS = ("score", "confidence", "probability", "prob", "prediction", "pred")
+
+# Recorder file names hold their start time, e.g. nn01a_20180126_000000.wav
+_START_PATTERN = re.compile(r"(\d{8})[_-]?(\d{6})")
+
+SORT_COLUMNS = {"file": "r.name", "start": "d.start", "end": "d.end",
+                "score": "d.score", "time": "d.clockTime"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    startTime REAL
+);
+CREATE TABLE IF NOT EXISTS detections (
+    recording INTEGER NOT NULL,
+    tableName TEXT NOT NULL,
+    start REAL,
+    end REAL,
+    score REAL,
+    clockTime REAL,
+    secondOfDay INTEGER
+);
+CREATE TABLE IF NOT EXISTS tables (
+    name TEXT PRIMARY KEY,
+    inode INTEGER,
+    size INTEGER,
+    mtime INTEGER,
+    tailHash TEXT
+);
+CREATE INDEX IF NOT EXISTS detectionsByRecording ON detections (recording, start);
+CREATE INDEX IF NOT EXISTS detectionsByScore ON detections (score);
+CREATE INDEX IF NOT EXISTS detectionsByTime ON detections (secondOfDay);
+CREATE INDEX IF NOT EXISTS detectionsByTable ON detections (tableName);
+"""
+
+
+def recordingStartTime(name):
+    """Start of a recording from its file name, as UTC-style epoch seconds, or None."""
+    match = _START_PATTERN.search(name)
+    if match is None:
+        return None
+    try:
+        start = datetime.datetime.strptime("".join(match.groups()), "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+    return float(calendar.timegm(start.timetuple()))
+
+
+def _findColumn(header, names):
+    for index, column in enumerate(header):
+        if column in names:
+            return index
+    return None
+
+
+def _toFloat(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _tailHash(path, size):
+    with open(path, "rb") as f:
+        start = max(0, size - TAIL_BYTES)
+        f.seek(start)
+        return hashlib.sha1(f.read(size - start)).hexdigest()
+
+
+class ResultsStore:
+    """Detections of an output folder's result tables.
+
+    ingest() reads every result table in the folder that has start time
+    and score columns. Tables are only read again when they change, and
+    a table that was only appended to is read from where it left off.
+    Detections are indexed by recording, score and time of day, so
+    queries over millions of them return a page at a time quickly.
+    """
+
+    def __init__(self, outputDir):
+        self.outputDir = outputDir
+        self.path = os.path.join(outputDir, RESULTS_DB_NAME)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._recordingIds = {}
+
+    def close(self):
+        self._db.close()
+
+    def _tablePaths(self):
+        for root, dirs, names in os.walk(self.outputDir):
+            # Work folders of runs in progress
+            dirs[:] = [d for d in dirs if not d.startswith("_")]
+            for name in names:
+                if name.lower().endswith(TABLE_EXTENSIONS) and not name.startswith("elp_"):
+                    yield os.path.join(root, name)
+
+    def ingest(self):
+        """Bring the store up to date with the folder's tables. Returns rows added."""
+        added = 0
+        seen = set()
+        with self._db:
+            for path in self._tablePaths():
+                tableName = os.path.relpath(path, self.outputDir)
+                seen.add(tableName)
+                added += self._ingestTable(path, tableName)
+            for (tableName,) in self._db.execute("SELECT name FROM tables").fetchall():
+                if tableName not in seen:
+                    self._db.execute("DELETE FROM detections WHERE tableName = ?", (tableName,))
+                    self._db.execute("DELETE FROM tables WHERE name = ?", (tableName,))
+        return added
+
+    def _ingestTable(self, path, tableName):
+        stat = os.stat(path)
+        previous = self._db.execute(
+            "SELECT inode, size, mtime, tailHash FROM tables WHERE name = ?",
+            (tableName,)).fetchone()
+        if previous is not None and previous[1:3] == (stat.st_size, stat.st_mtime_ns):
+            return 0
+
+        offset = 0
+        if previous is not None and previous[0] == stat.st_ino and \
+                stat.st_size > previous[1] and _tailHash(path, previous[1]) == previous[3]:
+            # Rows were appended, as when results are merged group by group
+            offset = previous[1]
+        else:
+            self._db.execute("DELETE FROM detections WHERE tableName = ?", (tableName,))
+
+        added = self._readTable(path, tableName, offset, stat.st_size)
+        self._db.execute(
+            "INSERT OR REPLACE INTO tables VALUES (?, ?, ?, ?, ?)",
+            (tableName, stat.st_ino, stat.st_size, stat.st_mtime_ns,
+             _tailHash(path, stat.st_size)))
+        return added
+
+    def _readTable(self, path, tableName, offset, size):
+        with open(path, "rb") as f:
+            headerLine = f.readline().decode("utf-8", "replace")
+            delimiter = "\t" if "\t" in headerLine else ","
+            header = [column.strip().strip('"').lower()
+                      for column in headerLine.rstrip("\r\n").split(delimiter)]
+            startColumn = _findColumn(header, START_COLUMNS)
+            scoreColumn = _findColumn(header, SCORE_COLUMNS)
+            if startColumn is None or scoreColumn is None:
+                return 0
+            endColumn = _findColumn(header, END_COLUMNS)
+            fileColumn = _findColumn(header, FILE_COLUMNS)
+
+            if offset:
+                f.seek(offset)
+            data = f.read(size - f.tell())
+
+        # Per-recording tables name their recording in the file name instead
+        defaultRecording = os.path.splitext(os.path.basename(path))[0]
+        reader = csv.reader(io.StringIO(data.decode("utf-8", "replace")), delimiter=delimiter)
+        rows = []
+        added = 0
+        for row in reader:
+            if len(row) <= max(startColumn, scoreColumn) or row == header:
+                continue
+            start = _toFloat(row[startColumn])
+            if start is None:
+                # A repeated header, or a row that is not a detection
+                continue
+            name = defaultRecording
+            if fileColumn is not None and fileColumn < len(row):
+                name = os.path.basename(row[fileColumn].replace("\\", "/")) or name
+            recordingId, startTime = self._recording(name)
+            end = _toFloat(row[endColumn]) if endColumn is not None and \
+                endColumn < len(row) else None
+            clockTime = secondOfDay = None
+            if startTime is not None:
+                clockTime = startTime + start
+                secondOfDay = int(clockTime) % 86400
+            rows.append((recordingId, tableName, start, end, _toFloat(row[scoreColumn]),
+                         clockTime, secondOfDay))
+            if len(rows) >= INSERT_BATCH:
+                added += self._insert(rows)
+                rows = []
+        return added + self._insert(rows)
+
+    def _insert(self, rows):
+        self._db.executemany("INSERT INTO detections VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def _recording(self, name):
+        cached = self._recordingIds.get(name)
+        if cached is not None:
+            return cached
+        startTime = recordingStartTime(name)
+        self._db.execute("INSERT OR IGNORE INTO recordings (name, startTime) VALUES (?, ?)",
+                         (name, startTime))
+        recordingId = self._db.execute(
+            "SELECT id FROM recordings WHERE name = ?", (name,)).fetchone()[0]
+        self._recordingIds[name] = (recordingId, startTime)
+        return recordingId, startTime
+
+    @staticmethod
+    def _where(fileFilter=None, timeFrom=None, timeTo=None, minScore=None):
+        """SQL condition and parameters for a query's filters.
+
+        timeFrom and timeTo are seconds after midnight; a range that wraps
+        past midnight, such as 22:00 to 02:00, is allowed.
+        """
+        conditions = []
+        params = []
+        if fileFilter:
+            conditions.append("r.name LIKE ?")
+            params.append("%" + fileFilter + "%")
+        if timeFrom is not None and timeTo is not None:
+            if timeFrom <= timeTo:
+                conditions.append("d.secondOfDay BETWEEN ? AND ?")
+            else:
+                conditions.append("(d.secondOfDay >= ? OR d.secondOfDay <= ?)")
+            params.extend([timeFrom, timeTo])
+        if minScore is not None:
+            conditions.append("d.score >= ?")
+            params.append(minScore)
+        return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+    def count(self, **filters):
+        where, params = self._where(**filters)
+        return self._db.execute(
+            "SELECT COUNT(*) FROM detections d JOIN recordings r ON r.id = d.recording"
+            + where, params).fetchone()[0]
+
+    def query(self, orderBy="score", descending=True, limit=500, offset=0, **filters):
+        """Rows of (file, start, end, score, clockTime) matching the filters."""
+        where, params = self._where(**filters)
+        order = "%s %s" % (SORT_COLUMNS[orderBy], "DESC" if descending else "ASC")
+        return self._db.execute(
+            "SELECT r.name, d.start, d.end, d.score, d.clockTime "
+            "FROM detections d JOIN recordings r ON r.id = d.recording"
+            + where + " ORDER BY " + order + " LIMIT ? OFFSET ?",
+            params + [limit, offset]).fetchall()
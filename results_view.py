@@ -0,0 +1,227 @@
+"""Results panel for browsing the detections of an output folder."""
+
+import sqlite3
+import datetime
+import threading
+from collections import OrderedDict
+
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QTime, pyqtSignal
+from PyQt5.QtGui import QIcon
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, \
+    QPushButton, QTableView, QTimeEdit, QCheckBox, QHeaderView, QAbstractItemView
+
+from results_store import ResultsStore
+
+
+BLOCK_ROWS = 500
+CACHED_BLOCKS = 20
+
+
+class ResultsModel(QAbstractTableModel):
+    """Table model reading detections from a ResultsStore a block at a time.
+
+    Only the blocks of rows being looked at are fetched, and a few recent
+    ones are kept, so scrolling through millions of detections stays quick.
+    """
+
+    COLUMNS = [("File", "file"), ("Start (s)", "start"), ("End (s)", "end"),
+               ("Score", "score"), ("Time", "time")]
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+        self.filters = {}
+        self.orderBy = "score"
+        self.descending = True
+        self._rowCount = 0
+        self._blocks = OrderedDict()
+        self.refresh()
+
+    def refresh(self):
+        self.beginResetModel()
+        self._blocks.clear()
+        self._rowCount = self.store.count(**self.filters)
+        self.endResetModel()
+
+    def setFilters(self, **filters):
+        self.filters = filters
+        self.refresh()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._rowCount
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNS[section][0]
+        return None
+
+    def _row(self, row):
+        blockIndex = row // BLOCK_ROWS
+        block = self._blocks.get(blockIndex)
+        if block is None:
+            block = self.store.query(orderBy=self.orderBy, descending=self.descending,
+                                     limit=BLOCK_ROWS, offset=blockIndex * BLOCK_ROWS,
+                                     **self.filters)
+            self._blocks[blockIndex] = block
+            if len(self._blocks) > CACHED_BLOCKS:
+                self._blocks.popitem(last=False)
+        else:
+            self._blocks.move_to_end(blockIndex)
+        offset = row - blockIndex * BLOCK_ROWS
+        return block[offset] if offset < len(block) else None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        row = self._row(index.row())
+        if row is None:
+            return None
+        value = row[index.column()]
+        if value is None:
+            return ""
+        if index.column() == 4:
+            return datetime.datetime.utcfromtimestamp(value).strftime("%Y-%m-%d %H:%M:%S")
+        if isinstance(value, float):
+            return "%.3f" % value if index.column() == 3 else "%.2f" % value
+        return value
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.orderBy = self.COLUMNS[column][1]
+        self.descending = order == Qt.DescendingOrder
+        self.refresh()
+
+
+class ResultsDialog(QDialog):
+    """Filterable, sortable view of every detection in an output folder.
+
+    New or changed result tables are read into the store on a background
+    thread, when the panel opens and on Refresh; until then the detections
+    already indexed are shown.
+    """
+
+    # The number of detections added, or the error reading the tables
+    ingestFinished = pyqtSignal(object)
+
+    def __init__(self, outputDir):
+        super().__init__()
+        self.setWindowTitle("ELP Detector Results - " + outputDir)
+        self.setWindowIcon(QIcon(':/elp-logo.png'))
+        self.setWindowFlags(self.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+        self.resize(800, 600)
+
+        self.outputDir = outputDir
+        self.store = ResultsStore(outputDir)
+        self._closed = False
+        self.model = ResultsModel(self.store)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(10, 10, 10, 10)
+        self.setLayout(layout)
+
+        filterLayout = QHBoxLayout()
+        self.fileEdit = QLineEdit()
+        self.fileEdit.setPlaceholderText("File name contains")
+        self.timeCheck = QCheckBox("Time of day from")
+        self.timeFromEdit = QTimeEdit(QTime(0, 0))
+        self.timeToEdit = QTimeEdit(QTime(23, 59))
+        for timeEdit in (self.timeFromEdit, self.timeToEdit):
+            timeEdit.setDisplayFormat("HH:mm")
+        self.scoreEdit = QLineEdit()
+        self.scoreEdit.setPlaceholderText("Any")
+        self.scoreEdit.setMaximumWidth(80)
+        self.applyBtn = QPushButton("Apply")
+        self.refreshBtn = QPushButton("Refresh")
+        self.refreshBtn.setToolTip("Read result tables that changed since the panel opened")
+
+        filterLayout.addWidget(self.fileEdit, 1)
+        filterLayout.addWidget(self.timeCheck)
+        filterLayout.addWidget(self.timeFromEdit)
+        filterLayout.addWidget(QLabel("to"))
+        filterLayout.addWidget(self.timeToEdit)
+        filterLayout.addWidget(QLabel("Min Score:"))
+        filterLayout.addWidget(self.scoreEdit)
+        filterLayout.addWidget(self.applyBtn)
+        filterLayout.addWidget(self.refreshBtn)
+        layout.addLayout(filterLayout)
+
+        self.tableView = QTableView()
+        self.tableView.setModel(self.model)
+        self.tableView.setSortingEnabled(True)
+        self.tableView.sortByColumn(3, Qt.DescendingOrder)
+        self.tableView.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.tableView.verticalHeader().hide()
+        # Fixed row heights and column widths, so Qt never measures every row
+        self.tableView.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.tableView.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        self.tableView.horizontalHeader().setStretchLastSection(True)
+        self.tableView.setColumnWidth(0, 280)
+        layout.addWidget(self.tableView)
+
+        self.countLabel = QLabel()
+        layout.addWidget(self.countLabel)
+        self._updateCount()
+
+        self.applyBtn.clicked.connect(self._applyFilters)
+        self.fileEdit.returnPressed.connect(self._applyFilters)
+        self.scoreEdit.returnPressed.connect(self._applyFilters)
+        self.refreshBtn.clicked.connect(self._refresh)
+        self.ingestFinished.connect(self._ingestFinished)
+        self._refresh()
+
+    def _applyFilters(self):
+        filters = {"fileFilter": self.fileEdit.text().strip() or None}
+        if self.timeCheck.isChecked():
+            filters["timeFrom"] = QTime(0, 0).secsTo(self.timeFromEdit.time())
+            # Include the whole "to" minute
+            filters["timeTo"] = QTime(0, 0).secsTo(self.timeToEdit.time()) + 59
+        scoreText = self.scoreEdit.text().strip()
+        if scoreText:
+            try:
+                filters["minScore"] = float(scoreText)
+            except ValueError:
+                self.countLabel.setText("Min Score must be a number")
+                return
+        self.model.setFilters(**filters)
+        self._updateCount()
+
+    def _refresh(self):
+        self.refreshBtn.setEnabled(False)
+        self.countLabel.setText("%d detections; reading result tables..."
+                                % self.model.rowCount())
+        threading.Thread(target=self._ingest, daemon=True).start()
+
+    def _ingest(self):
+        # A connection of its own, as the view's is only used on the GUI thread
+        try:
+            store = ResultsStore(self.outputDir)
+            try:
+                result = store.ingest()
+            finally:
+                store.close()
+        except (sqlite3.Error, OSError) as e:
+            result = e
+        self.ingestFinished.emit(result)
+
+    def _ingestFinished(self, result):
+        if self._closed:
+            return
+        self.refreshBtn.setEnabled(True)
+        if isinstance(result, Exception):
+            self._updateCount()
+            self.countLabel.setText(self.countLabel.text() +
+                                    "; could not read the result tables: %s" % result)
+            return
+        self.model.refresh()
+        self._updateCount()
+
+    def _updateCount(self):
+        self.countLabel.setText("%d detections" % self.model.rowCount())
+
+    def done(self, result):
+        # Closing the window or pressing Escape both end here
+        self._closed = True
+        self.store.close()
+        super().done(result)
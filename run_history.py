@@ -0,0 +1,169 @@
+"""History of detector runs on this computer, kept in a local SQLite database."""
+
+import os
+import json
+import time
+import sqlite3
+import statistics
+
+from app_dirs import userDataDir, hostName
+
+
+HISTORY_DB_NAME = "run_history.sqlite"
+# Most recent comparable runs used for predictions and comparisons
+HISTORY_RUNS = 20
+# Comparable runs needed before a slow run is reported
+MIN_REGRESSION_RUNS = 3
+# A run is reported when its throughput is below this fraction of usual
+REGRESSION_RATIO = 0.6
+# and both it and the usual time are longer than this, and it is this much
+# longer than usual; short runs are mostly start-up and model loading,
+# whose time varies too much to compare
+MIN_REGRESSION_SECONDS = 60
+
+# Run options that change how fast a run goes; runs are compared only
+# with runs that used the same values
+SPEED_OPTIONS = ("shards", "maxProcesses", "threads", "cpus", "streaming", "streamBatchSize",
+                 "spectrogramWorkers", "predictionWorkers",
+                 "keepSpectrograms", "cacheBudget", "windowSeconds", "agents", "modelVariant")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    host TEXT NOT NULL,
+    scriptDir TEXT,
+    dataDir TEXT,
+    outputDir TEXT,
+    settings TEXT NOT NULL,
+    options TEXT,
+    models TEXT,
+    files INTEGER,
+    audioSeconds REAL,
+    wallSeconds REAL,
+    stageSeconds TEXT,
+    returncode INTEGER
+);
+CREATE INDEX IF NOT EXISTS runsBySettings ON runs (host, settings, started);
+"""
+
+
+def formatDuration(seconds):
+    """seconds as a rough length of time, such as "2 h 05 min"."""
+    seconds = int(round(seconds))
+    if seconds < 90:
+        return "%d s" % seconds
+    minutes = (seconds + 30) // 60
+    if minutes < 60:
+        return "%d min" % minutes
+    return "%d h %02d min" % divmod(minutes, 60)
+
+
+def isSlow(seconds, usualSeconds):
+    """Whether a run taking seconds is much slower than the usualSeconds of runs like it."""
+    return (usualSeconds is not None and seconds >= MIN_REGRESSION_SECONDS
+            and usualSeconds >= MIN_REGRESSION_SECONDS
+            and seconds - usualSeconds > MIN_REGRESSION_SECONDS
+            and seconds * REGRESSION_RATIO > usualSeconds)
+
+
+def settingsKey(options):
+    """Key of the speed-related options in a dict of DetectorRun options."""
+    return json.dumps({name: options.get(name) for name in SPEED_OPTIONS}, sort_keys=True)
+
+
+def _fitDuration(runs):
+    """(fixed seconds, seconds per audio second) fitting earlier runs.
+
+    Each run pays a fixed cost, mainly loading the models, besides the
+    time its audio takes, so small runs alone would make large ones look
+    slow. A least-squares line is used when the runs differ enough in
+    size for one; otherwise the median rate with no fixed cost.
+    """
+    points = [(audio, wall) for audio, wall in runs if audio > 0 and wall > 0]
+    if not points:
+        return None
+    rate = statistics.median(wall / audio for audio, wall in points)
+    if len(points) >= 3:
+        meanAudio = statistics.mean(audio for audio, _ in points)
+        meanWall = statistics.mean(wall for _, wall in points)
+        spread = sum((audio - meanAudio) ** 2 for audio, _ in points)
+        if spread > 0 and max(audio for audio, _ in points) > 2 * min(audio for audio, _ in points):
+            slope = sum((audio - meanAudio) * (wall - meanWall)
+                        for audio, wall in points) / spread
+            fixed = meanWall - slope * meanAudio
+            if slope > 0 and fixed >= 0:
+                return fixed, slope
+    return 0.0, rate
+
+
+class RunHistory:
+    """Every detector run's settings, size and timings, for this user.
+
+    Runs are kept for all computers sharing the home folder, but
+    predictions and comparisons only use runs of this computer with the
+    same speed settings and, where possible, the same model files.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(userDataDir(), HISTORY_DB_NAME)
+        self.host = hostName()
+        # Several queued runs may finish at once
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def record(self, options, models, files, audioSeconds, wallSeconds, stageSeconds,
+               returncode, scriptDir=None, dataDir=None, outputDir=None, started=None):
+        """Add a run. options are its DetectorRun options, models its model hashes."""
+        with self._db:
+            cursor = self._db.execute(
+                "INSERT INTO runs (started, host, scriptDir, dataDir, outputDir, settings, "
+                "options, models, files, audioSeconds, wallSeconds, stageSeconds, returncode) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (started or time.time() - wallSeconds, self.host, scriptDir, dataDir,
+                 outputDir, settingsKey(options), json.dumps(options, sort_keys=True, default=str),
+                 json.dumps(models, sort_keys=True), files, audioSeconds, wallSeconds,
+                 json.dumps(stageSeconds), returncode))
+        return cursor.lastrowid
+
+    def _similar(self, options, models=None):
+        """(audioSeconds, wallSeconds) of recent successful comparable runs."""
+        query = ("SELECT audioSeconds, wallSeconds FROM runs WHERE host = ? AND settings = ? "
+                 "AND returncode = 0 AND files > 0")
+        params = [self.host, settingsKey(options)]
+        if models is not None:
+            query += " AND models = ?"
+            params.append(json.dumps(models, sort_keys=True))
+        query += " ORDER BY started DESC LIMIT ?"
+        return self._db.execute(query, params + [HISTORY_RUNS]).fetchall()
+
+    def predict(self, options, models, audioSeconds, sameModels=False):
+        """(seconds a run is likely to take, runs the guess is based on), or None.
+
+        Unless sameModels is set, runs with other model files are used
+        when there are none with these, as models seldom change speed much.
+        """
+        if audioSeconds <= 0:
+            return None
+        runs = self._similar(options, models)
+        if not runs and not sameModels:
+            runs = self._similar(options)
+        fit = _fitDuration(runs)
+        if fit is None:
+            return None
+        fixed, rate = fit
+        return fixed + rate * audioSeconds, len(runs)
+
+    def usualSeconds(self, options, models, audioSeconds):
+        """How long comparable runs with the same models suggest a run should take.
+
+        None when there are too few such runs to compare with.
+        """
+        prediction = self.predict(options, models, audioSeconds, sameModels=True)
+        if prediction is None or prediction[1] < MIN_REGRESSION_RUNS:
+            return None
+        return prediction[0]
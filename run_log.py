@@ -0,0 +1,277 @@
+"""Run output saved to rotating log files in the output folder."""
+
+import os
+import re
+import mmap
+import time
+import bisect
+import threading
+from collections import OrderedDict
+
+
+RUN_LOG_PREFIX = "elp_run_"
+DEFAULT_MAX_BYTES = 100 * 1024 ** 2
+DEFAULT_BACKUPS = 9
+
+# LogFile indexes the start of roughly every this many bytes
+INDEX_BLOCK_BYTES = 1024 * 1024
+CACHED_BLOCKS = 16
+SEARCH_WINDOW_BYTES = 16 * 1024 ** 2
+# Words marking lines worth jumping to, matched ignoring case
+ERROR_WORDS = ("error", "exception", "failed", "traceback")
+
+
+def runLogName():
+    """File name for a new run's log."""
+    return RUN_LOG_PREFIX + time.strftime("%Y%m%d_%H%M%S") + ".log"
+
+
+class RunLog:
+    """Appends a run's output to a log file as it arrives.
+
+    Text is written through unbuffered, so the log is complete up to the
+    last output even if the program is killed. When the file grows past
+    maxBytes it is renamed to name.1 (name.1 to name.2 and so on), keeping
+    at most backups old files, so a very verbose run cannot fill the disk.
+    If the file cannot be written, for example because the disk is full,
+    logging stops but the run carries on.
+    """
+
+    def __init__(self, path, maxBytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._file = open(path, "ab", buffering=0)
+        self._size = self._file.tell()
+
+    @classmethod
+    def create(cls, outputDir, **kwargs):
+        return cls(os.path.join(outputDir, runLogName()), **kwargs)
+
+    def write(self, text):
+        data = text.encode("utf-8", "replace")
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                if self._size and self._size + len(data) > self.maxBytes:
+                    self._rotate()
+                self._file.write(data)
+                self._size += len(data)
+            except OSError:
+                # A full disk must not stop the run; the log just ends here
+                if self._file is not None:
+                    self._file.close()
+                self._file = None
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            older = "%s.%d" % (self.path, index)
+            if os.path.exists(older):
+                os.replace(older, "%s.%d" % (self.path, index + 1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "ab", buffering=0)
+        self._size = 0
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def isErrorLine(text):
+    text = text.lower()
+    return any(word in text for word in ERROR_WORDS)
+
+
+class LogFile:
+    """Read-only view of a log file of any size, read through mmap.
+
+    Only a sparse index is kept: the line number at the start of each block
+    of about INDEX_BLOCK_BYTES. A line is found by looking up its block and
+    scanning that block, whose line offsets are cached for the few blocks
+    used most recently. Searches scan the mapped file a window at a time,
+    so even a multi-GB log is never read into memory at once. refresh()
+    picks up lines added to a log that is still being written, including
+    one that RunLog has rotated.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lineCount = 0
+        self._file = open(path, "rb")
+        self._map = None
+        self._size = 0
+        self._blockOffsets = []
+        self._blockLines = []
+        self._blockCache = OrderedDict()
+        self.refresh()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    @property
+    def size(self):
+        return self._size
+
+    def refresh(self):
+        """Index lines added since the last call. Returns True if anything changed."""
+        try:
+            rotated = os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except OSError:
+            rotated = False
+        if rotated:
+            # RunLog renamed the file to .1 and started a new one
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.close()
+            self._file = open(self.path, "rb")
+            self._size = 0
+            self._blockOffsets = []
+            self._blockLines = []
+            self._blockCache.clear()
+        size = os.fstat(self._file.fileno()).st_size
+        if size == self._size and not rotated:
+            return False
+        if size < self._size:
+            # Truncated; start again
+            self._blockOffsets = []
+            self._blockLines = []
+            self._blockCache.clear()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._size = size
+        if size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # The last block may have ended in a partial line, so index it again
+        start = line = 0
+        if self._blockOffsets:
+            start = self._blockOffsets.pop()
+            line = self._blockLines.pop()
+            self._blockCache.pop(len(self._blockOffsets), None)
+        self._index(start, line)
+        return True
+
+    def _index(self, pos, line):
+        data = self._map
+        while pos < self._size:
+            end = min(pos + INDEX_BLOCK_BYTES, self._size)
+            if end < self._size:
+                newline = data.find(b"\n", end - 1)
+                end = self._size if newline < 0 else newline + 1
+            self._blockOffsets.append(pos)
+            self._blockLines.append(line)
+            line += data[pos:end].count(b"\n")
+            pos = end
+        if self._size and self._map[self._size - 1:self._size] != b"\n":
+            line += 1
+        self.lineCount = line
+
+    def _blockEnd(self, block):
+        if block + 1 < len(self._blockOffsets):
+            return self._blockOffsets[block + 1]
+        return self._size
+
+    def _lineOffsets(self, block):
+        """Start offsets of the lines in block, plus the block's end."""
+        offsets = self._blockCache.get(block)
+        if offsets is not None:
+            self._blockCache.move_to_end(block)
+            return offsets
+        start = self._blockOffsets[block]
+        end = self._blockEnd(block)
+        offsets = [start]
+        offsets.extend(start + match.end()
+                       for match in re.finditer(b"\n", self._map[start:end]))
+        if offsets[-1] != end:
+            offsets.append(end)
+        self._blockCache[block] = offsets
+        if len(self._blockCache) > CACHED_BLOCKS:
+            self._blockCache.popitem(last=False)
+        return offsets
+
+    def lineOffset(self, line):
+        """Offset of the start of line (counting from 0)."""
+        if line >= self.lineCount:
+            return self._size
+        block = bisect.bisect_right(self._blockLines, line) - 1
+        return self._lineOffsets(block)[line - self._blockLines[block]]
+
+    def line(self, line):
+        if not 0 <= line < self.lineCount:
+            return ""
+        block = bisect.bisect_right(self._blockLines, line) - 1
+        offsets = self._lineOffsets(block)
+        index = line - self._blockLines[block]
+        text = self._map[offsets[index]:offsets[index + 1]]
+        return text.rstrip(b"\r\n").decode("utf-8", "replace")
+
+    def lineAt(self, offset):
+        """Number of the line containing offset."""
+        block = bisect.bisect_right(self._blockOffsets, offset) - 1
+        offsets = self._lineOffsets(block)
+        return self._blockLines[block] + bisect.bisect_right(offsets, offset) - 1
+
+    def find(self, words, fromLine, backwards=False, caseSensitive=False):
+        """Number of the next line after fromLine containing any of words, or None.
+
+        The search wraps around the end of the file. It goes through the
+        file a window at a time with bytes.find, which is much faster than
+        a regular expression over the mapping.
+        """
+        if self._map is None or not words:
+            return None
+        needles = [word.encode("utf-8") for word in words]
+        if not caseSensitive:
+            needles = [needle.lower() for needle in needles]
+        overlap = max(len(needle) for needle in needles) - 1
+        if not backwards:
+            start = self.lineOffset(fromLine + 1)
+            offset = self._search(needles, caseSensitive, overlap, start, self._size)
+            if offset is None:
+                offset = self._search(needles, caseSensitive, overlap, 0, start)
+        else:
+            start = self.lineOffset(max(fromLine, 0))
+            offset = self._searchBack(needles, caseSensitive, overlap, 0, start)
+            if offset is None:
+                offset = self._searchBack(needles, caseSensitive, overlap, start, self._size)
+        return None if offset is None else self.lineAt(offset)
+
+    def _window(self, start, end, caseSensitive):
+        data = self._map[start:min(end, self._size)]
+        return data if caseSensitive else data.lower()
+
+    def _search(self, needles, caseSensitive, overlap, start, end):
+        """Offset of the first needle found starting in start..end."""
+        while start < end:
+            windowEnd = min(end, start + SEARCH_WINDOW_BYTES)
+            data = self._window(start, windowEnd + overlap, caseSensitive)
+            found = [index for index in (data.find(needle) for needle in needles)
+                     if 0 <= index < windowEnd - start]
+            if found:
+                return start + min(found)
+            start = windowEnd
+        return None
+
+    def _searchBack(self, needles, caseSensitive, overlap, start, end):
+        """Offset of the last needle found starting in start..end."""
+        while end > start:
+            windowStart = max(start, end - SEARCH_WINDOW_BYTES)
+            data = self._window(windowStart, end + overlap, caseSensitive)
+            found = [index for index in (data.rfind(needle, 0, end - windowStart - 1 + len(needle))
+                                         for needle in needles) if index >= 0]
+            if found:
+                return windowStart + max(found)
+            end = windowStart
+        return None
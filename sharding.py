@@ -0,0 +1,173 @@
+"""Splitting a sound folder into balanced shards and merging their results."""
+
+import os
+import re
+import heapq
+import shutil
+import wave
+
+
+TABLE_EXTENSIONS = (".csv", ".txt", ".tsv")
+
+
+def listSoundFiles(dataDir):
+    """Regular, non-hidden files directly inside dataDir, sorted by name."""
+    files = []
+    for entry in os.scandir(dataDir):
+        if entry.is_file() and not entry.name.startswith("."):
+            files.append(entry.path)
+    return sorted(files)
+
+
+def wavDuration(path):
+    """Length of a WAV file in seconds, or None if it cannot be read as WAV."""
+    try:
+        with wave.open(path, "rb") as wavFile:
+            return wavFile.getnframes() / float(wavFile.getframerate())
+    except (wave.Error, EOFError, OSError, ZeroDivisionError):
+        return None
+
+
+def fileWeights(files):
+    """Work estimate per file: audio duration when every file is a WAV, else size."""
+    durations = [wavDuration(path) for path in files]
+    if all(duration is not None for duration in durations):
+        return durations
+    return [os.path.getsize(path) for path in files]
+
+
+def makeShards(files, count, weights=None):
+    """Split files into at most count shards with roughly equal total weight.
+
+    Uses longest-processing-time-first: the heaviest remaining file always
+    goes to the currently lightest shard.
+    """
+    if weights is None:
+        weights = fileWeights(files)
+    count = max(1, min(count, len(files)))
+
+    heap = [(0, index) for index in range(count)]
+    shards = [[] for _ in range(count)]
+    for weight, path in sorted(zip(weights, files), reverse=True):
+        total, index = heapq.heappop(heap)
+        shards[index].append(path)
+        heapq.heappush(heap, (total + weight, index))
+
+    return [sorted(shard) for shard in shards if shard]
+
+
+def makeContiguousShards(files, count, weights=None):
+    """Split files, keeping their order, into at most count runs of similar weight.
+
+    Merging such shards one after another keeps results in file order.
+    """
+    if weights is None:
+        weights = fileWeights(files)
+    count = max(1, min(count, len(files)))
+    total = float(sum(weights))
+
+    shards = [[]]
+    done = 0
+    for path, weight in zip(files, weights):
+        # Start the next shard once this one has its share, counting a file
+        # as in whichever shard holds most of it
+        if shards[-1] and len(shards) < count and done + weight / 2.0 > total * len(shards) / count:
+            shards.append([])
+        shards[-1].append(path)
+        done += weight
+    return [shard for shard in shards if shard]
+
+
+def stageFiles(files, destDir):
+    """Make files available in destDir without copying where the OS allows it."""
+    os.makedirs(destDir, exist_ok=True)
+    for path in files:
+        stageFile(path, os.path.join(destDir, os.path.basename(path)))
+
+
+def stageFile(path, dest):
+    """Make path available as dest, replacing it, without copying where possible."""
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(path, dest)
+    except OSError:
+        try:
+            os.symlink(os.path.abspath(path), dest)
+        except OSError:
+            shutil.copy2(path, dest)
+
+
+def _appendTable(src, dest):
+    """Append a result table to an existing one, skipping a repeated header."""
+    with open(dest, "r", newline="") as destFile:
+        header = destFile.readline()
+    with open(src, "r", newline="") as srcFile, open(dest, "a", newline="") as destFile:
+        firstLine = srcFile.readline()
+        if firstLine != header:
+            destFile.write(firstLine)
+        shutil.copyfileobj(srcFile, destFile)
+
+
+def _mentionsRecording(row, names):
+    for field in re.split(r"[,\t]", row):
+        field = field.strip().strip('"')
+        if os.path.basename(field) in names:
+            return True
+    return False
+
+
+def _dropRows(table, recordings):
+    """Remove a table's rows that refer to any of the given recordings."""
+    names = set()
+    for path in recordings:
+        name = os.path.basename(path)
+        names.add(name)
+        names.add(os.path.splitext(name)[0])
+
+    tmpPath = table + ".tmp"
+    with open(table, "r", newline="") as src, open(tmpPath, "w", newline="") as dest:
+        dest.write(src.readline())
+        for row in src:
+            if not _mentionsRecording(row, names):
+                dest.write(row)
+    os.replace(tmpPath, table)
+
+
+def mergeOutputs(shardOutputDirs, outputDir, replacedFiles=()):
+    """Merge per-shard output folders into outputDir.
+
+    Files are moved into place keeping their relative paths. When two shards
+    produce a result table with the same name the rows are concatenated;
+    any other clash keeps both files, suffixing the later one with its shard.
+
+    Output left in outputDir by an earlier run is treated as older results:
+    its files are replaced, and rows of its tables that refer to one of
+    replacedFiles (recordings processed again by this run) are dropped
+    before the new rows are appended.
+    """
+    merged = set()
+    for shardIndex, shardDir in enumerate(shardOutputDirs):
+        for root, _, names in os.walk(shardDir):
+            relDir = os.path.relpath(root, shardDir)
+            destDir = os.path.normpath(os.path.join(outputDir, relDir))
+            os.makedirs(destDir, exist_ok=True)
+            for name in names:
+                src = os.path.join(root, name)
+                dest = os.path.join(destDir, name)
+                isTable = name.lower().endswith(TABLE_EXTENSIONS)
+                if os.path.exists(dest) and dest not in merged:
+                    if not isTable:
+                        os.remove(dest)
+                    elif replacedFiles:
+                        _dropRows(dest, replacedFiles)
+
+                if not os.path.exists(dest):
+                    shutil.move(src, dest)
+                elif isTable:
+                    _appendTable(src, dest)
+                else:
+                    stem, ext = os.path.splitext(name)
+                    dest = os.path.join(destDir, "%s_shard%02d%s" % (stem, shardIndex, ext))
+                    shutil.move(src, dest)
+                merged.add(dest)
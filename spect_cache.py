@@ -0,0 +1,171 @@
+"""Content-addressed spectrogram cache shared by all output folders."""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+import sharding
+from app_dirs import userDataDir
+from manifest import fileHash
+
+
+INDEX_NAME = "index.json"
+MAX_AUDIO_HASHES = 100000
+GB = 1024 ** 3
+
+
+def pipelineParamsKey(scriptDir, args):
+    """Hash of everything besides the audio that decides what spectrograms look like.
+
+    The spectrogram parameters live in the pipeline code, which may import
+    helper modules, so every Python file under scriptDir is hashed together
+    with the arguments used for data generation.
+    """
+    digest = hashlib.sha256()
+    for path in _pythonFiles(scriptDir):
+        digest.update(json.dumps([os.path.relpath(path, scriptDir).replace(os.sep, "/"),
+                                  fileHash(path)]).encode())
+    digest.update(json.dumps(list(args)).encode())
+    return digest.hexdigest()
+
+
+def _pythonFiles(folder):
+    """Paths of the .py files under folder, in a fixed order."""
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = [name for name in dirs if name != "__pycache__" and not name.startswith(".")]
+        paths.extend(os.path.join(root, name) for name in files if name.endswith(".py"))
+    return sorted(paths)
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class SpectrogramCache:
+    """Spectrograms of single recordings keyed by audio hash and pipeline parameters.
+
+    Entries are folders under the cache root. When the cache grows past
+    budgetBytes the least recently used entries are evicted. Spectrogram
+    names are kept relative to the stem of the recording they were made
+    for, so a recording with the same audio under another name, such as a
+    copy or a renamed file, gets them under its own name.
+    """
+
+    def __init__(self, budgetBytes, root=None):
+        self.root = root or userDataDir("spect_cache")
+        self.budgetBytes = budgetBytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._indexPath = os.path.join(self.root, INDEX_NAME)
+        try:
+            with open(self._indexPath) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        self._entries = index.get("entries", {})
+        # Audio hashes by (path, size, mtime) so unchanged files are not re-read
+        self._audioHashes = index.get("audioHashes", {})
+
+    def key(self, audioPath, paramsKey):
+        stat = os.stat(audioPath)
+        statKey = "%s|%d|%d" % (os.path.abspath(audioPath), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            audioHash = self._audioHashes.get(statKey)
+        if audioHash is None:
+            audioHash = fileHash(audioPath)
+            with self._lock:
+                self._audioHashes[statKey] = audioHash
+        return hashlib.sha256((audioHash + paramsKey).encode()).hexdigest()
+
+    def _entryDir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def fetch(self, key, destDir, recording):
+        """Place a cached entry's spectrograms in destDir, named after recording.
+
+        Returns False on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            entryDir = self._entryDir(key)
+            # Entries from before names were kept relative to the recording
+            # cannot be renamed, so they count as misses
+            if entry is None or "suffixes" not in entry or not os.path.isdir(entryDir):
+                self.misses += 1
+                return False
+            entry["lastUsed"] = time.time()
+            self.hits += 1
+        os.makedirs(destDir, exist_ok=True)
+        stem = _stem(recording)
+        for index, suffix in enumerate(entry["suffixes"]):
+            sharding.stageFile(os.path.join(entryDir, "%04d" % index),
+                               os.path.join(destDir, stem + suffix))
+        return True
+
+    def store(self, key, recording, files):
+        """Add recording's spectrogram files, whose names start with its stem."""
+        stem = _stem(recording)
+        entryDir = self._entryDir(key)
+        tmpDir = entryDir + ".tmp%d" % threading.get_ident()
+        os.makedirs(tmpDir, exist_ok=True)
+        for index, path in enumerate(files):
+            sharding.stageFile(path, os.path.join(tmpDir, "%04d" % index))
+        with self._lock:
+            shutil.rmtree(entryDir, ignore_errors=True)
+            os.replace(tmpDir, entryDir)
+            self._entries[key] = {
+                "suffixes": [os.path.basename(path)[len(stem):] for path in files],
+                "size": sum(os.path.getsize(path) for path in files),
+                "lastUsed": time.time()}
+            self._evict()
+
+    def _evict(self):
+        total = sum(entry["size"] for entry in self._entries.values())
+        if total <= self.budgetBytes:
+            return
+        for key, entry in sorted(self._entries.items(), key=lambda item: item[1]["lastUsed"]):
+            if total <= self.budgetBytes:
+                break
+            shutil.rmtree(self._entryDir(key), ignore_errors=True)
+            try:
+                os.rmdir(os.path.dirname(self._entryDir(key)))
+            except OSError:
+                pass
+            del self._entries[key]
+            total -= entry["size"]
+
+    def save(self):
+        """Evict down to the budget and write the index."""
+        with self._lock:
+            self._evict()
+            # Oldest audio hashes go first; they belong to files long since seen
+            while len(self._audioHashes) > MAX_AUDIO_HASHES:
+                del self._audioHashes[next(iter(self._audioHashes))]
+            tmpPath = self._indexPath + ".tmp"
+            with open(tmpPath, "w") as f:
+                json.dump({"entries": self._entries, "audioHashes": self._audioHashes}, f)
+            os.replace(tmpPath, self._indexPath)
+
+
+def attributeSpectrograms(recordings, spectFiles):
+    """Map each recording to the spectrogram files named after it.
+
+    A file belongs to the recording whose file name stem is the longest
+    prefix of its name. Returns None if any file cannot be attributed, in
+    which case the batch's spectrograms are not cached.
+    """
+    stems = sorted(((os.path.splitext(os.path.basename(path))[0], path)
+                    for path in recordings), key=lambda item: -len(item[0]))
+    owners = {path: [] for path in recordings}
+    for spectFile in spectFiles:
+        name = os.path.basename(spectFile)
+        owner = next((path for stem, path in stems if name.startswith(stem)), None)
+        if owner is None:
+            return None
+        owners[owner].append(spectFile)
+    return owners
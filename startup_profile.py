@@ -0,0 +1,163 @@
+"""Startup time profiler for the GUI.
+
+Run with --profile-startup (or ELP_PROFILE_STARTUP=1) to print, once the
+main window is up, how long each stage of startup took and which imports
+cost the most. In a one-file build the time the bootloader spends
+unpacking the bundle is shown too.
+"""
+
+import os
+import sys
+import time
+
+
+PROFILE_FLAG = "--profile-startup"
+PROFILE_ENV = "ELP_PROFILE_STARTUP"
+
+_profiler = None
+
+
+class _TimedLoader:
+    """Loader wrapper timing module creation and execution; the rest is delegated."""
+
+    def __init__(self, loader, name, profiler):
+        self._loader = loader
+        self._name = name
+        self._profiler = profiler
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        # Extension modules such as PyQt5.QtCore do their work here
+        self._profiler.enter(self._name)
+        try:
+            return self._loader.create_module(spec)
+        finally:
+            self._profiler.leave(finished=False)
+
+    def exec_module(self, module):
+        self._profiler.enter(self._name)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler.leave()
+
+
+class _TimingFinder:
+    """Meta path finder that wraps the loaders other finders return."""
+
+    def __init__(self, profiler):
+        self._profiler = profiler
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                spec.loader = _TimedLoader(spec.loader, name, self._profiler)
+            return spec
+        return None
+
+
+class StartupProfiler:
+    """Records import times and named startup marks."""
+
+    def __init__(self):
+        self.startTime = time.time()
+        self._startCounter = time.perf_counter()
+        self.marks = []
+        self.imports = {}
+        self._stack = []
+
+    def elapsed(self):
+        return time.perf_counter() - self._startCounter
+
+    def enter(self, name):
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def leave(self, finished=True):
+        name, started, childTime = self._stack.pop()
+        total = time.perf_counter() - started
+        if self._stack:
+            self._stack[-1][2] += total
+        elif finished:
+            self.marks.append(("import " + name, self.elapsed()))
+        inclusive, selfTime = self.imports.get(name, (0.0, 0.0))
+        self.imports[name] = (inclusive + total, selfTime + total - childTime)
+
+    def mark(self, label):
+        self.marks.append((label, self.elapsed()))
+
+    def _processTimes(self):
+        """Seconds from process creation to profiling, and spent unpacking a one-file bundle."""
+        try:
+            import psutil
+            process = psutil.Process()
+            beforePython = self.startTime - process.create_time()
+            unpacking = None
+            parent = process.parent()
+            # A one-file build's bootloader unpacks the bundle, then starts
+            # the same executable again to run the program
+            if getattr(sys, "frozen", False) and parent is not None \
+                    and parent.exe() == process.exe():
+                unpacking = process.create_time() - parent.create_time()
+            return beforePython, unpacking
+        except Exception:
+            return None, None
+
+    def report(self, stream=None, top=15):
+        stream = stream or sys.stderr
+        beforePython, unpacking = self._processTimes()
+        stream.write("Startup profile\n")
+        if unpacking is not None:
+            stream.write("  %8.1f ms  unpacking the one-file bundle\n" % (unpacking * 1000))
+        if beforePython is not None:
+            stream.write("  %8.1f ms  interpreter start until profiling began\n"
+                         % (beforePython * 1000))
+
+        stream.write("Steps (time since the previous step):\n")
+        previous = 0.0
+        for label, at in self.marks:
+            stream.write("  %8.1f ms  %s\n" % ((at - previous) * 1000, label))
+            previous = at
+        total = previous + (beforePython or 0.0) + (unpacking or 0.0)
+        stream.write("  %8.1f ms  total time to first window\n" % (total * 1000))
+
+        stream.write("Slowest imports (own time, time including the imports they made):\n")
+        slowest = sorted(self.imports.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (inclusive, selfTime) in slowest[:top]:
+            stream.write("  %8.1f ms  %8.1f ms  %s\n" % (selfTime * 1000, inclusive * 1000, name))
+        stream.flush()
+
+
+def requested():
+    return PROFILE_FLAG in sys.argv or bool(os.environ.get(PROFILE_ENV))
+
+
+def install():
+    """Start profiling if requested. Call before the imports to be measured."""
+    global _profiler
+    if _profiler is None and requested():
+        _profiler = StartupProfiler()
+        sys.meta_path.insert(0, _TimingFinder(_profiler))
+    return _profiler
+
+
+def mark(label):
+    if _profiler is not None:
+        _profiler.mark(label)
+
+
+def finish():
+    """Print the report and stop timing imports."""
+    global _profiler
+    if _profiler is None:
+        return
+    sys.meta_path[:] = [finder for finder in sys.meta_path
+                        if not isinstance(finder, _TimingFinder)]
+    _profiler.report()
+    _profiler = None
@@ -0,0 +1,170 @@
+"""Resource usage sampling of detector process trees."""
+
+import csv
+import time
+import threading
+
+import psutil
+
+
+DEFAULT_INTERVAL = 1.0
+RESOURCE_LOG_PREFIX = "elp_resources_"
+
+CSV_FIELDS = ["time", "elapsedSeconds", "processes", "cpuPercent", "rssBytes",
+              "peakRssBytes", "readBytes", "writeBytes", "readRate", "writeRate",
+              "swapInRate", "swapOutRate"]
+
+
+def resourceLogName():
+    """File name for a new run's resource time series."""
+    return RESOURCE_LOG_PREFIX + time.strftime("%Y%m%d_%H%M%S") + ".csv"
+
+
+class ResourceMonitor:
+    """Samples CPU, memory and disk I/O of the process trees under rootPids().
+
+    rootPids is called on every sample, so processes that start and stop
+    during the run are followed. CPU percent is summed over the tree, so a
+    process keeping four cores busy reports 400. Read and write bytes count
+    only I/O done while the monitor runs. Swap rates are for the whole
+    machine, as swapping is not attributed to processes. Each sample is
+    passed to callback and appended to csvPath if given.
+    """
+
+    def __init__(self, rootPids, callback=None, csvPath=None, interval=DEFAULT_INTERVAL):
+        self.rootPids = rootPids
+        self.callback = callback
+        self.csvPath = csvPath
+        self.interval = interval
+        self.peakRss = 0
+        self._processes = {}
+        self._baselineIo = {}
+        self._lastIo = {}
+        self._exitedIo = [0, 0]
+        self._stop = threading.Event()
+        self._thread = None
+        self._csvFile = None
+        self._writer = None
+
+    def start(self):
+        self._startTime = time.time()
+        self._lastSample = time.monotonic()
+        self._lastTotals = (0, 0)
+        self._lastSwap = self._swapCounters()
+        if self.csvPath:
+            self._csvFile = open(self.csvPath, "w", newline="")
+            self._writer = csv.DictWriter(self._csvFile, CSV_FIELDS)
+            self._writer.writeheader()
+        self._thread = threading.Thread(target=self._sampleLoop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling, after taking a final sample."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if self._csvFile is not None:
+            self._csvFile.close()
+            self._csvFile = None
+
+    def _sampleLoop(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+        self.sample()
+
+    def _tree(self):
+        """Current processes of the tree, reusing Process objects between samples.
+
+        cpu_percent measures since the previous call on the same object,
+        so keeping them makes each sample cheap and its CPU figure exact.
+        """
+        current = {}
+        for pid in self.rootPids():
+            try:
+                root = self._processes.get(pid) or psutil.Process(pid)
+                tree = [root] + root.children(recursive=True)
+            except psutil.Error:
+                continue
+            for process in tree:
+                current[process.pid] = self._processes.get(process.pid, process)
+        return current
+
+    def _ioCounters(self, process):
+        try:
+            counters = process.io_counters()
+        except (psutil.Error, AttributeError):
+            # Not available on macOS
+            return None
+        return counters.read_bytes, counters.write_bytes
+
+    @staticmethod
+    def _swapCounters():
+        try:
+            swap = psutil.swap_memory()
+        except (psutil.Error, RuntimeError):
+            return 0, 0
+        return swap.sin, swap.sout
+
+    def sample(self):
+        processes = self._tree()
+        cpu = 0.0
+        rss = 0
+        for pid, process in processes.items():
+            try:
+                with process.oneshot():
+                    # Processes already running when monitoring started,
+                    # such as a warm worker, only count I/O from now on
+                    if pid not in self._processes and process.create_time() < self._startTime:
+                        self._baselineIo[pid] = self._ioCounters(process)
+                    # Measured since the previous sample; 0 for new processes
+                    cpu += process.cpu_percent()
+                    rss += process.memory_info().rss
+                    io = self._ioCounters(process)
+            except psutil.Error:
+                continue
+            if io is not None:
+                self._lastIo[pid] = io
+
+        for pid in set(self._processes) - set(processes):
+            # Keep the I/O of processes that have exited
+            last = self._lastIo.pop(pid, None)
+            base = self._baselineIo.pop(pid, None) or (0, 0)
+            if last is not None:
+                self._exitedIo[0] += last[0] - base[0]
+                self._exitedIo[1] += last[1] - base[1]
+        self._processes = processes
+
+        readBytes, writeBytes = self._exitedIo
+        for pid, io in self._lastIo.items():
+            base = self._baselineIo.get(pid) or (0, 0)
+            readBytes += io[0] - base[0]
+            writeBytes += io[1] - base[1]
+
+        now = time.monotonic()
+        seconds = max(now - self._lastSample, 1e-6)
+        swap = self._swapCounters()
+        self.peakRss = max(self.peakRss, rss)
+        snapshot = {"time": time.time(),
+                    "elapsedSeconds": time.time() - self._startTime,
+                    "processes": len(processes),
+                    "cpuPercent": cpu,
+                    "rssBytes": rss,
+                    "peakRssBytes": self.peakRss,
+                    "readBytes": readBytes,
+                    "writeBytes": writeBytes,
+                    "readRate": (readBytes - self._lastTotals[0]) / seconds,
+                    "writeRate": (writeBytes - self._lastTotals[1]) / seconds,
+                    "swapInRate": (swap[0] - self._lastSwap[0]) / seconds,
+                    "swapOutRate": (swap[1] - self._lastSwap[1]) / seconds}
+        self._lastSample = now
+        self._lastTotals = (readBytes, writeBytes)
+        self._lastSwap = swap
+
+        if self._writer is not None:
+            self._writer.writerow(snapshot)
+            self._csvFile.flush()
+        if self.callback is not None:
+            self.callback(snapshot)
+        return snapshot
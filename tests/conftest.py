@@ -0,0 +1,49 @@
+import os
+import sys
+import wave
+import shutil
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+
+# The benchmarks' stand-in pipeline writes one spectrogram file per recording
+# and one detection per spectrogram, so results show which recording each
+# spectrogram was credited to
+STAND_IN_PIPELINE = os.path.join(REPO_DIR, "benchmarks", "standin_pipeline.py")
+
+
+def writeWav(path, seconds=1.0, rate=8000, value=0):
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(bytes([value % 256, 0]) * int(seconds * rate))
+
+
+@pytest.fixture(autouse=True)
+def userHome(tmp_path, monkeypatch):
+    """Keeps caches, history and profiles out of the real home folder."""
+    home = tmp_path / "home"
+    monkeypatch.setenv("ELP_DETECTOR_HOME", str(home))
+    return home
+
+
+@pytest.fixture
+def scriptDir(tmp_path, monkeypatch):
+    # Quiet and small, as the tests only look at which files are made
+    monkeypatch.setenv("ELP_BENCH_LINES_PER_FILE", "0")
+    monkeypatch.setenv("ELP_BENCH_SPECT_KB", "1")
+    folder = tmp_path / "scripts"
+    (folder / "2_Stage_Model").mkdir(parents=True)
+    shutil.copy(STAND_IN_PIPELINE, str(folder / "Inference_pipeline.py"))
+    (folder / "2_Stage_Model" / "first_stage.pt").write_bytes(b"first")
+    (folder / "2_Stage_Model" / "second_stage.pt").write_bytes(b"second")
+    return folder
+
+
+def readDetections(outputDir):
+    with open(os.path.join(str(outputDir), "predictions.csv")) as f:
+        return sorted(line.split(",")[0] for line in f.read().splitlines()[1:])
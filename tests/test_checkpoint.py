@@ -0,0 +1,53 @@
+import os
+
+from conftest import writeWav, readDetections
+from checkpoint import Checkpoint, CHECKPOINT_NAME
+from detector_runner import DetectorRun
+
+
+def makeRun(scriptDir, soundDir, outputDir, **options):
+    return DetectorRun(str(scriptDir), str(soundDir), str(outputDir), output=lambda text: None,
+                       checkpointFiles=2, resourceLog=False, runLog=False,
+                       indexResults=False, history=False, **options)
+
+
+def testResumeProcessesOnlyWhatTheFailedRunLeft(tmp_path, scriptDir, monkeypatch):
+    soundDir = tmp_path / "sound"
+    soundDir.mkdir()
+    names = ["rec%03d.wav" % index for index in range(6)]
+    for name in names:
+        writeWav(soundDir / name)
+    outputDir = tmp_path / "out"
+    outputDir.mkdir()
+
+    runGroup = DetectorRun._runGroup
+    groups = []
+    failing = {2}
+
+    def failSomeGroups(run, files, wholeFolder=False):
+        groups.append([os.path.basename(path) for path in files])
+        if len(groups) in failing:
+            return 1
+        return runGroup(run, files, wholeFolder)
+
+    monkeypatch.setattr(DetectorRun, "_runGroup", failSomeGroups)
+    assert makeRun(scriptDir, soundDir, outputDir, checkpoint=True).run() == 1
+    assert readDetections(outputDir) == names[:2]
+    checkpoint = Checkpoint.load(str(outputDir))
+    assert [os.path.basename(path) for path in checkpoint.remaining()] == names[2:]
+
+    groups.clear()
+    failing.clear()
+    assert makeRun(scriptDir, soundDir, outputDir, resumeInterrupted=True).run() == 0
+    assert groups == [names[2:4], names[4:6]]
+    assert readDetections(outputDir) == names
+    assert not os.path.exists(str(outputDir / CHECKPOINT_NAME))
+
+
+def testResumeWithoutCheckpointFails(tmp_path, scriptDir):
+    soundDir = tmp_path / "sound"
+    soundDir.mkdir()
+    writeWav(soundDir / "rec.wav")
+    outputDir = tmp_path / "out"
+    outputDir.mkdir()
+    assert makeRun(scriptDir, soundDir, outputDir, resumeInterrupted=True).run() == 1
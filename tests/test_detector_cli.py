@@ -0,0 +1,64 @@
+import os
+
+from conftest import writeWav, readDetections
+import detector_cli
+import watch_folder
+from detector_runner import CANCELLED
+
+
+def testRelativeFolders(tmp_path, scriptDir, monkeypatch):
+    (tmp_path / "sound").mkdir()
+    (tmp_path / "out").mkdir()
+    writeWav(tmp_path / "sound" / "rec.wav")
+    monkeypatch.chdir(str(tmp_path))
+
+    returncode = detector_cli.main([
+        "--script_dir", os.path.relpath(str(scriptDir)), "--sound_dir", "sound",
+        "--output_dir", "out", "--no_profile", "--no_resource_log", "--no_run_log",
+        "--log_file", "cli.log"])
+    assert returncode == 0
+    assert readDetections(tmp_path / "out") == ["rec.wav"]
+
+
+def makeFolders(tmp_path):
+    (tmp_path / "sound").mkdir()
+    (tmp_path / "out").mkdir()
+    writeWav(tmp_path / "sound" / "rec.wav")
+    return ["--sound_dir", str(tmp_path / "sound"), "--output_dir", str(tmp_path / "out"),
+            "--no_profile"]
+
+
+def testCancelledRunExitsWith130(tmp_path, scriptDir, monkeypatch):
+    monkeypatch.setattr(detector_cli.DetectorRun, "run", lambda run: CANCELLED)
+    returncode = detector_cli.main(["--script_dir", str(scriptDir)] + makeFolders(tmp_path) +
+                                   ["--log_file", str(tmp_path / "cli.log")])
+    assert returncode == detector_cli.EXIT_CANCELLED == 130
+
+
+def testWatchHonoursTheLogAndIndexOptions(tmp_path, scriptDir, monkeypatch):
+    sessions = []
+
+    class FakeSession:
+        def __init__(self, scriptDir, dataDir, spectDir, output, onStats, **options):
+            self.options = options
+            sessions.append(self)
+
+        def start(self):
+            pass
+
+        def stop(self):
+            self.stopped = True
+
+    def interrupt(seconds):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(watch_folder, "WatchSession", FakeSession)
+    monkeypatch.setattr(detector_cli.time, "sleep", interrupt)
+    returncode = detector_cli.main(
+        ["--script_dir", str(scriptDir), "--watch", "--no_index", "--no_run_log",
+         "--no_resource_log", "--log_file", str(tmp_path / "cli.log")] + makeFolders(tmp_path))
+    assert returncode == 0
+    options = sessions[0].options
+    assert (options["indexResults"], options["runLog"], options["resourceLog"]) == \
+        (False, False, False)
+    assert sessions[0].stopped
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+import detector_runner
+import sharding
+from conftest import writeWav
+from detector_runner import DetectorRun, SHARD_DIR_NAME
+
+
+def makeRun(tmp_path, scriptDir, count=4, **options):
+    soundDir = tmp_path / "sound"
+    soundDir.mkdir()
+    for index in range(count):
+        writeWav(soundDir / ("rec%03d.wav" % index))
+    outputDir = tmp_path / "out"
+    outputDir.mkdir()
+    return DetectorRun(str(scriptDir), str(soundDir), str(outputDir), output=lambda text: None,
+                       resourceLog=False, runLog=False, indexResults=False, history=False,
+                       **options)
+
+
+def testScratchFolderIsRemovedWhenPredictionFails(tmp_path, scriptDir, monkeypatch):
+    scratch = tmp_path / "scratch"
+
+    def makeScratch(prefix):
+        scratch.mkdir()
+        return str(scratch)
+
+    monkeypatch.setattr(detector_runner, "scratchDir", makeScratch)
+
+    def brokenMerge(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(sharding, "mergeOutputs", brokenMerge)
+    run = makeRun(tmp_path, scriptDir, keepSpectrograms=False, streamBatchSize=1)
+    with pytest.raises(OSError):
+        run.run()
+    assert not scratch.exists()
+
+
+def testStagedShardsAreRemovedWhenStagingFails(tmp_path, scriptDir, monkeypatch):
+    stageFiles = sharding.stageFiles
+    staged = []
+
+    def failSecondShard(files, destDir):
+        if staged:
+            raise OSError("disk full")
+        staged.append(destDir)
+        stageFiles(files, destDir)
+
+    monkeypatch.setattr(sharding, "stageFiles", failSecondShard)
+    run = makeRun(tmp_path, scriptDir, shards=2)
+    with pytest.raises(OSError):
+        run.run()
+    assert staged and not os.path.exists(staged[0])
+    assert not [name for name in os.listdir(str(tmp_path / "out" / SHARD_DIR_NAME))
+                if name.endswith("_input")]
@@ -0,0 +1,96 @@
+import threading
+from collections import namedtuple
+
+import pytest
+
+import job_queue
+from job_queue import Job, JobScheduler, DONE, QUEUED, RUNNING
+
+Memory = namedtuple("Memory", "available")
+
+
+class FakeRun:
+    """Stands in for DetectorRun; runs until the test lets its folder finish."""
+
+    started = []
+    release = {}
+
+    def __init__(self, scriptDir, dataDir, spectDir, output=print, onProgress=None, **options):
+        self.dataDir = dataDir
+        self.cancelled = False
+
+    def run(self):
+        self.started.append(self.dataDir)
+        self.release[self.dataDir].wait(10)
+        return 0
+
+
+@pytest.fixture
+def fakeRuns(monkeypatch):
+    monkeypatch.setattr(job_queue, "DetectorRun", FakeRun)
+    monkeypatch.setattr(job_queue.psutil, "virtual_memory",
+                        lambda: Memory(64 * job_queue.MEMORY_PER_PROCESS))
+    FakeRun.started = []
+    FakeRun.release = {}
+    yield FakeRun
+    for event in FakeRun.release.values():
+        event.set()
+
+
+def addJob(scheduler, name, **options):
+    FakeRun.release[name] = threading.Event()
+    return scheduler.enqueue(Job("scripts", name, "out", **options))
+
+
+def waitFor(condition):
+    for _ in range(200):
+        if condition():
+            return
+        threading.Event().wait(0.02)
+    raise AssertionError("timed out")
+
+
+def testSlotsCountProcessesRunAtOnce():
+    assert Job("s", "d", "o").slots == 1
+    assert Job("s", "d", "o", shards=4, maxProcesses=2).slots == 2
+    assert Job("s", "d", "o", streaming=True, predictionWorkers=3, maxProcesses=8).slots == 3
+
+
+def testJobsStartInOrderWithinTheSlots(fakeRuns):
+    scheduler = JobScheduler(maxSlots=2, output=lambda text: None)
+    first = addJob(scheduler, "first")
+    second = addJob(scheduler, "second", shards=2, maxProcesses=2)
+    third = addJob(scheduler, "third")
+
+    waitFor(lambda: fakeRuns.started == ["first"])
+    # The second job does not fit beside the first, and the third may not
+    # start ahead of it even though it would fit
+    threading.Event().wait(0.2)
+    assert (second.status, third.status) == (QUEUED, QUEUED)
+
+    fakeRuns.release["first"].set()
+    waitFor(lambda: fakeRuns.started == ["first", "second"])
+    threading.Event().wait(0.2)
+    assert third.status == QUEUED
+
+    fakeRuns.release["second"].set()
+    fakeRuns.release["third"].set()
+    waitFor(lambda: third.status == DONE)
+    assert fakeRuns.started == ["first", "second", "third"]
+    assert first.status == second.status == DONE
+
+
+def testJobWaitsForMemoryUnlessNothingRuns(fakeRuns, monkeypatch):
+    monkeypatch.setattr(job_queue.psutil, "virtual_memory", lambda: Memory(0))
+    scheduler = JobScheduler(maxSlots=4, output=lambda text: None)
+    addJob(scheduler, "first")
+    second = addJob(scheduler, "second")
+
+    waitFor(lambda: fakeRuns.started == ["first"])
+    threading.Event().wait(0.2)
+    assert second.status == QUEUED
+
+    fakeRuns.release["first"].set()
+    waitFor(lambda: second.status == RUNNING)
+    fakeRuns.release["second"].set()
+    waitFor(lambda: second.status == DONE)
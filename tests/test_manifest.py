@@ -0,0 +1,25 @@
+import os
+
+from conftest import writeWav
+from manifest import Manifest
+
+
+def testFileRemovedMidScanIsSkipped(tmp_path):
+    soundDir = tmp_path / "sound"
+    soundDir.mkdir()
+    for name in ("a.wav", "b.wav", "c.wav"):
+        writeWav(soundDir / name)
+    files = sorted(str(p) for p in soundDir.iterdir())
+    model = tmp_path / "model.pt"
+    model.write_bytes(b"model")
+
+    manifest = Manifest.load(str(tmp_path), [str(model)])
+    # Removed after the folder was listed but before it was checked
+    os.remove(files[1])
+
+    assert manifest.pendingFiles(files) == [files[0], files[2]]
+    manifest.markDone(files)
+    manifest.save()
+
+    manifest = Manifest.load(str(tmp_path), [str(model)])
+    assert manifest.pendingFiles(files) == []
@@ -0,0 +1,90 @@
+import socket
+import threading
+
+import pytest
+
+import sharding
+from conftest import writeWav, readDetections
+from detector_runner import DetectorRun
+from remote_agent import AgentServer
+
+TOKEN = "secret"
+
+
+def freePort():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def startAgent(server):
+    threading.Thread(target=server.serve, daemon=True).start()
+    for _ in range(50):
+        try:
+            socket.create_connection((server.host, server.port), timeout=1).close()
+            return server.host, server.port
+        except OSError:
+            threading.Event().wait(0.1)
+    raise RuntimeError("the agent did not start")
+
+
+class DroppingAgent(AgentServer):
+    """Takes shards and closes the connection without running them."""
+
+    def _runJob(self, conn, stream, message):
+        pass
+
+
+def runInThread(run, timeout=60):
+    results = []
+    errors = []
+
+    def target():
+        try:
+            results.append(run.run())
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "the run did not finish"
+    return results, errors
+
+
+@pytest.fixture
+def soundDir(tmp_path):
+    folder = tmp_path / "sound"
+    folder.mkdir()
+    for index in range(6):
+        writeWav(folder / ("rec%03d.wav" % index))
+    return folder
+
+
+def makeRun(tmp_path, scriptDir, soundDir, agent):
+    outputDir = tmp_path / "out"
+    outputDir.mkdir()
+    return DetectorRun(str(scriptDir), str(soundDir), str(outputDir), output=lambda text: None,
+                       agents=[agent], agentToken=TOKEN, resourceLog=False, runLog=False,
+                       indexResults=False, history=False)
+
+
+def testShardsOfDroppedAgentRunLocally(tmp_path, scriptDir, soundDir):
+    agent = startAgent(DroppingAgent(str(scriptDir), TOKEN, host="127.0.0.1", port=freePort(),
+                                     workDir=str(tmp_path / "agent")))
+    run = makeRun(tmp_path, scriptDir, soundDir, agent)
+    results, errors = runInThread(run)
+    assert errors == [] and results == [0]
+    assert readDetections(tmp_path / "out") == sorted(p.name for p in soundDir.iterdir())
+
+
+def testFailingLocalSlotFailsTheRun(tmp_path, scriptDir, soundDir, monkeypatch):
+    def brokenStageFiles(files, destDir):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(sharding, "stageFiles", brokenStageFiles)
+    agent = startAgent(AgentServer(str(scriptDir), TOKEN, host="127.0.0.1", port=freePort(),
+                                   workDir=str(tmp_path / "agent")))
+    run = makeRun(tmp_path, scriptDir, soundDir, agent)
+    results, errors = runInThread(run)
+    assert results == [] and [str(e) for e in errors] == ["disk full"]
@@ -0,0 +1,71 @@
+import os
+
+from results_store import ResultsStore, recordingStartTime
+
+
+HEADER = "file,start,end,score\n"
+
+
+def writeTable(path, rows, mode="w"):
+    with open(str(path), mode, newline="") as f:
+        if mode == "w":
+            f.write(HEADER)
+        for row in rows:
+            f.write("%s,%s,%s,%s\n" % row)
+
+
+def storeOf(outputDir):
+    store = ResultsStore(str(outputDir))
+    try:
+        added = store.ingest()
+        rows = store.query(orderBy="start", descending=False)
+    finally:
+        store.close()
+    return added, [(name, start) for name, start, _, _, _ in rows]
+
+
+def testAppendedRowsAreReadFromWhereIngestLeftOff(tmp_path):
+    table = tmp_path / "predictions.csv"
+    writeTable(table, [("a.wav", 1.0, 2.0, 0.9), ("a.wav", 3.0, 4.0, 0.8)])
+    assert storeOf(tmp_path) == (2, [("a.wav", 1.0), ("a.wav", 3.0)])
+    assert storeOf(tmp_path)[0] == 0
+
+    writeTable(table, [("b.wav", 5.0, 6.0, 0.7)], mode="a")
+    assert storeOf(tmp_path) == (1, [("a.wav", 1.0), ("a.wav", 3.0), ("b.wav", 5.0)])
+
+
+def testRewrittenTableIsReadAgain(tmp_path):
+    table = tmp_path / "predictions.csv"
+    writeTable(table, [("a.wav", 1.0, 2.0, 0.9), ("a.wav", 3.0, 4.0, 0.8)])
+    storeOf(tmp_path)
+
+    # Longer than before but not an append: the old rows' tail has changed
+    with open(str(table), "r+", newline="") as f:
+        f.seek(len(HEADER))
+        f.write("c")
+    writeTable(table, [("b.wav", 5.0, 6.0, 0.7)], mode="a")
+    assert storeOf(tmp_path) == (3, [("c.wav", 1.0), ("a.wav", 3.0), ("b.wav", 5.0)])
+
+
+def testRemovedTableDropsItsDetections(tmp_path):
+    writeTable(tmp_path / "predictions.csv", [("a.wav", 1.0, 2.0, 0.9)])
+    writeTable(tmp_path / "other.csv", [("b.wav", 1.0, 2.0, 0.9)])
+    assert storeOf(tmp_path)[0] == 2
+    os.remove(str(tmp_path / "other.csv"))
+    assert storeOf(tmp_path) == (0, [("a.wav", 1.0)])
+
+
+def testClockTimeComesFromTheFileName(tmp_path):
+    writeTable(tmp_path / "predictions.csv",
+               [("nn01a_20180126_230000.wav", 3600.0 + 60, 3600.0 + 70, 0.9),
+                ("nn01a_20180126_120000.wav", 60.0, 70.0, 0.8)])
+    store = ResultsStore(str(tmp_path))
+    try:
+        store.ingest()
+        # 00:00 to 01:00 of the next day only holds the first recording's call
+        rows = store.query(timeFrom=0, timeTo=3600)
+        assert [row[0] for row in rows] == ["nn01a_20180126_230000.wav"]
+        assert store.count(timeFrom=22 * 3600, timeTo=2 * 3600) == 1
+    finally:
+        store.close()
+    assert recordingStartTime("plain.wav") is None
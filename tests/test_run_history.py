@@ -0,0 +1,31 @@
+from conftest import writeWav
+from detector_runner import DetectorRun
+from run_history import RunHistory, isSlow
+
+
+def testOnlyLongRunsCountAsSlow():
+    assert isSlow(600, 200)
+    assert not isSlow(300, 250)
+    assert not isSlow(5, 0.5)
+    assert not isSlow(90, 20)
+    assert not isSlow(600, None)
+
+
+def testShortRunIsNotReportedAsSlow(tmp_path, scriptDir):
+    soundDir = tmp_path / "sound"
+    soundDir.mkdir()
+    writeWav(soundDir / "rec.wav")
+    outputDir = tmp_path / "out"
+    outputDir.mkdir()
+    lines = []
+    run = DetectorRun(str(scriptDir), str(soundDir), str(outputDir), output=lines.append,
+                      resourceLog=False, runLog=False, indexResults=False)
+
+    # Earlier runs like it that took almost no time
+    history = RunHistory()
+    for _ in range(3):
+        history.record(run._historyOptions(), run._modelHashes(), 1, 1.0, 0.001, {}, 0)
+    history.close()
+
+    assert run.run() == 0
+    assert not any("slower" in line for line in lines)
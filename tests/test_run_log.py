@@ -0,0 +1,88 @@
+import pytest
+
+import run_log
+from run_log import LogFile, RunLog
+
+
+@pytest.fixture(autouse=True)
+def smallBlocks(monkeypatch):
+    # Small blocks and search windows, so a short log spans many of them
+    monkeypatch.setattr(run_log, "INDEX_BLOCK_BYTES", 64)
+    monkeypatch.setattr(run_log, "SEARCH_WINDOW_BYTES", 100)
+
+
+def writeLines(path, lines, mode="w"):
+    with open(str(path), mode) as f:
+        f.write("".join(line + "\n" for line in lines))
+
+
+def testLinesAreFoundThroughTheSparseIndex(tmp_path):
+    path = tmp_path / "run.log"
+    lines = ["line %d %s" % (index, "x" * (index % 7)) for index in range(500)]
+    writeLines(path, lines)
+    log = LogFile(str(path))
+    try:
+        assert log.lineCount == 500
+        for index in (0, 1, 63, 250, 499):
+            assert log.line(index) == lines[index]
+            assert log.lineAt(log.lineOffset(index)) == index
+        assert log.line(500) == ""
+    finally:
+        log.close()
+
+
+def testRefreshCompletesAPartialLastLine(tmp_path):
+    path = tmp_path / "run.log"
+    writeLines(path, ["first", "second"])
+    with open(str(path), "a") as f:
+        f.write("thi")
+    log = LogFile(str(path))
+    try:
+        assert log.lineCount == 3 and log.line(2) == "thi"
+        with open(str(path), "a") as f:
+            f.write("rd\nfourth\n")
+        assert log.refresh()
+        assert log.lineCount == 4
+        assert [log.line(index) for index in range(4)] == ["first", "second", "third", "fourth"]
+        assert not log.refresh()
+    finally:
+        log.close()
+
+
+def testFindWrapsAroundInBothDirections(tmp_path):
+    path = tmp_path / "run.log"
+    lines = ["processing window %d" % index for index in range(200)]
+    lines[30] = "Traceback (most recent call last):"
+    lines[150] = "Shard 2 FAILED"
+    writeLines(path, lines)
+    log = LogFile(str(path))
+    try:
+        words = ["traceback", "failed"]
+        assert log.find(words, 0) == 30
+        assert log.find(words, 30) == 150
+        assert log.find(words, 150) == 30
+        assert log.find(words, 100, backwards=True) == 30
+        assert log.find(words, 20, backwards=True) == 150
+        assert log.find(["failed"], 0, caseSensitive=True) is None
+        assert log.find(["no such text"], 0) is None
+    finally:
+        log.close()
+
+
+def testRefreshFollowsRotation(tmp_path):
+    runLog = RunLog(str(tmp_path / "run.log"), maxBytes=40, backups=2)
+    log = None
+    try:
+        runLog.write("a line of about twenty\n")
+        log = LogFile(runLog.path)
+        assert log.lineCount == 1
+        runLog.write("the next one rotates the log\n")
+        assert log.refresh()
+        assert log.lineCount == 1
+        assert log.line(0) == "the next one rotates the log"
+        with open(runLog.path + ".1") as f:
+            assert f.read() == "a line of about twenty\n"
+    finally:
+        runLog.close()
+        if log is not None:
+            log.close()
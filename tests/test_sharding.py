@@ -0,0 +1,77 @@
+import os
+
+from sharding import makeShards, makeContiguousShards, mergeOutputs, _dropRows
+
+
+def writeFile(path, text):
+    os.makedirs(os.path.dirname(str(path)), exist_ok=True)
+    with open(str(path), "w", newline="") as f:
+        f.write(text)
+
+
+def readFile(path):
+    with open(str(path), newline="") as f:
+        return f.read()
+
+
+def testShardsBalanceWeight():
+    weights = {"a": 3, "b": 1, "c": 2, "d": 3, "e": 1, "f": 2}
+    files = sorted(weights)
+    shards = makeShards(files, 2, weights=[weights[f] for f in files])
+    assert [sum(weights[f] for f in shard) for shard in shards] == [6, 6]
+    assert sorted(sum(shards, [])) == files
+    assert sorted(makeShards(files, 10, weights=[1] * len(files))) == [[f] for f in files]
+
+
+def testContiguousShardsKeepOrder():
+    files = ["a", "b", "c", "d"]
+    assert makeContiguousShards(files, 2, weights=[1, 1, 1, 1]) == [["a", "b"], ["c", "d"]]
+    assert makeContiguousShards(files, 9, weights=[1, 1, 1, 1]) == [[f] for f in files]
+
+
+def testMergeConcatenatesTablesWithOneHeader(tmp_path):
+    shardA = tmp_path / "shard_00"
+    shardB = tmp_path / "shard_01"
+    writeFile(shardA / "predictions.csv", "file,start\na.wav,1\n")
+    writeFile(shardB / "predictions.csv", "file,start\nb.wav,2\n")
+    writeFile(shardA / "spect" / "a_spect.npy", "A")
+    writeFile(shardB / "spect" / "b_spect.npy", "B")
+    writeFile(shardA / "model.log", "first")
+    writeFile(shardB / "model.log", "second")
+
+    outputDir = tmp_path / "out"
+    mergeOutputs([str(shardA), str(shardB)], str(outputDir))
+
+    assert readFile(outputDir / "predictions.csv") == "file,start\na.wav,1\nb.wav,2\n"
+    assert sorted(os.listdir(str(outputDir / "spect"))) == ["a_spect.npy", "b_spect.npy"]
+    # Clashing files that are not tables are both kept
+    assert readFile(outputDir / "model.log") == "first"
+    assert readFile(outputDir / "model_shard01.log") == "second"
+
+
+def testMergeReplacesRowsOfRecordingsRunAgain(tmp_path):
+    outputDir = tmp_path / "out"
+    writeFile(outputDir / "predictions.csv",
+              "file,start\na.wav,1\nb.wav,2\nc.wav,3\n")
+    writeFile(outputDir / "model.log", "old")
+    shard = tmp_path / "shard_00"
+    writeFile(shard / "predictions.csv", "file,start\nb.wav,20\n")
+    writeFile(shard / "model.log", "new")
+
+    mergeOutputs([str(shard)], str(outputDir), replacedFiles=["/sound/b.wav"])
+
+    assert readFile(outputDir / "predictions.csv") == \
+        "file,start\na.wav,1\nc.wav,3\nb.wav,20\n"
+    assert readFile(outputDir / "model.log") == "new"
+
+
+def testDropRowsMatchesNamesAndStemsInAnyField(tmp_path):
+    table = tmp_path / "detections.txt"
+    writeFile(table, "start\tend\tsource\n"
+                     "1\t2\t\"/data/rec1.wav\"\n"
+                     "3\t4\trec2\n"
+                     "5\t6\trec10.wav\n")
+
+    _dropRows(str(table), ["/other/rec1.wav", "/other/rec2.wav"])
+
+    assert readFile(table) == "start\tend\tsource\n5\t6\trec10.wav\n"
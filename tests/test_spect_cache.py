@@ -0,0 +1,49 @@
+import os
+
+from conftest import writeWav, readDetections
+from detector_runner import DetectorRun
+from spect_cache import SpectrogramCache, GB, pipelineParamsKey
+
+
+def testFetchRenamesToRequestingRecording(tmp_path):
+    recordingA = tmp_path / "recA.wav"
+    spect = tmp_path / "recA_spect.npy"
+    spect.write_bytes(b"spectrogram")
+    cache = SpectrogramCache(GB, root=str(tmp_path / "cache"))
+    cache.store("k" * 64, str(recordingA), [str(spect)])
+
+    destDir = tmp_path / "dest"
+    assert cache.fetch("k" * 64, str(destDir), str(tmp_path / "recB.wav"))
+    assert os.listdir(str(destDir)) == ["recB_spect.npy"]
+    assert (destDir / "recB_spect.npy").read_bytes() == b"spectrogram"
+
+
+def testIdenticalRecordingsKeepTheirOwnDetections(tmp_path, scriptDir):
+    soundDir = tmp_path / "sound"
+    soundDir.mkdir()
+    names = ["rec%03d.wav" % index for index in range(4)]
+    for name in names:
+        writeWav(soundDir / name)
+    outputDir = tmp_path / "out"
+    outputDir.mkdir()
+
+    run = DetectorRun(str(scriptDir), str(soundDir), str(outputDir), output=lambda text: None,
+                      streamBatchSize=1, cacheBudget=GB, resourceLog=False, runLog=False,
+                      indexResults=False, history=False)
+    assert run.run() == 0
+    assert run._cache.hits == 3
+    assert readDetections(outputDir) == names
+
+
+def testParamsKeyCoversEveryPipelineModule(tmp_path, scriptDir):
+    key = pipelineParamsKey(str(scriptDir), ["--process_data"])
+    assert pipelineParamsKey(str(scriptDir), ["--process_data"]) == key
+    assert pipelineParamsKey(str(scriptDir), ["--other"]) != key
+
+    helpers = scriptDir / "helpers"
+    helpers.mkdir()
+    (helpers / "spectrogram.py").write_text("WINDOW = 256\n")
+    withHelper = pipelineParamsKey(str(scriptDir), ["--process_data"])
+    assert withHelper != key
+    (helpers / "spectrogram.py").write_text("WINDOW = 512\n")
+    assert pipelineParamsKey(str(scriptDir), ["--process_data"]) != withHelper
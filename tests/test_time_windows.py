@@ -0,0 +1,85 @@
+import os
+import math
+import wave
+
+from conftest import writeWav
+from time_windows import WindowSet, windowSpans, splitRecording
+
+
+def readFile(path):
+    with open(str(path), newline="") as f:
+        return f.read()
+
+
+def testSpansOverlapAndShareTheOverlapAtItsMiddle():
+    assert windowSpans(250, 100, 20) == [(0, 120, 0.0, 110.0),
+                                         (100, 220, 110.0, 210.0),
+                                         (200, 250, 210.0, math.inf)]
+    assert len(windowSpans(110, 100, 20)) == 1
+
+
+def testSplitWritesEachWindowAsAWav(tmp_path):
+    recording = tmp_path / "rec.wav"
+    writeWav(recording, seconds=250, rate=100)
+    windowDir = tmp_path / "windows"
+    windowDir.mkdir()
+
+    windows = splitRecording(str(recording), str(windowDir), 100, 20)
+    assert [window.stem for window in windows] == ["rec__win000", "rec__win001", "rec__win002"]
+    lengths = []
+    for window in windows:
+        with wave.open(window.path) as f:
+            lengths.append(f.getnframes() / f.getframerate())
+    assert lengths == [120, 120, 50]
+    assert sum(window.seconds for window in windows) == 250
+
+    writeWav(tmp_path / "short.wav", seconds=50, rate=100)
+    assert splitRecording(str(tmp_path / "short.wav"), str(windowDir), 100, 20) == []
+
+
+def makeWindows(tmp_path):
+    recording = tmp_path / "rec.wav"
+    writeWav(recording, seconds=250, rate=100)
+    windowDir = tmp_path / "windows"
+    windowDir.mkdir()
+    windows = WindowSet()
+    windows.add(str(recording), splitRecording(str(recording), str(windowDir), 100, 20))
+    return windows
+
+
+def testCallsInTheOverlapAreKeptOnce(tmp_path):
+    windows = makeWindows(tmp_path)
+    outputDir = tmp_path / "out"
+    outputDir.mkdir()
+    with open(str(outputDir / "predictions.csv"), "w", newline="") as f:
+        f.write("file,start,end,score\n"
+                # Seen by both windows: before the overlap's middle, so the first keeps it
+                "rec__win000.wav,105.0,108.0,0.9\n"
+                "rec__win001.wav,5.0,8.0,0.9\n"
+                # After the middle, so the second window keeps it
+                "rec__win000.wav,115.0,118.0,0.8\n"
+                "rec__win001.wav,15.0,18.0,0.8\n"
+                "other.wav,3.0,4.0,0.5\n")
+
+    windows.translateOutput(str(outputDir))
+
+    assert readFile(outputDir / "predictions.csv") == (
+        "file,start,end,score\n"
+        "rec.wav,105.0,108.0,0.9\n"
+        "rec.wav,115.0,118.0,0.8\n"
+        "other.wav,3.0,4.0,0.5\n")
+
+
+def testTablesOfWindowsAreJoinedInWindowOrder(tmp_path):
+    windows = makeWindows(tmp_path)
+    outputDir = tmp_path / "out"
+    outputDir.mkdir()
+    for index, start in enumerate(("50", "50", "30")):
+        with open(str(outputDir / ("rec__win%03d.txt" % index)), "w", newline="") as f:
+            f.write("Begin Time (s)\tScore\n%s\t0.9\n" % start)
+
+    windows.translateOutput(str(outputDir))
+
+    assert os.listdir(str(outputDir)) == ["rec.txt"]
+    assert readFile(outputDir / "rec.txt") == \
+        "Begin Time (s)\tScore\n50\t0.9\n150\t0.9\n230\t0.9\n"
@@ -0,0 +1,38 @@
+import threading
+
+from conftest import writeWav
+from watch_folder import FolderWatcher, WatchSession
+
+
+def testFilesNotKnownAtStartAreReported(tmp_path):
+    writeWav(tmp_path / "old.wav")
+    writeWav(tmp_path / "new.wav")
+    reported = []
+    done = threading.Event()
+
+    def onFiles(files):
+        reported.extend(path for path, _ in files)
+        done.set()
+
+    watcher = FolderWatcher(str(tmp_path), onFiles, settleSeconds=0.1, pollInterval=0.1)
+    watcher.start(known=[str(tmp_path / "old.wav")])
+    try:
+        assert done.wait(5)
+    finally:
+        watcher.stop()
+    assert reported == [str(tmp_path / "new.wav")]
+
+
+def testFileRewrittenBeforeItsBatchIsQueuedOnce(tmp_path):
+    session = WatchSession("scripts", str(tmp_path), str(tmp_path / "out"),
+                           output=lambda text: None, keepWarm=False)
+    path = str(tmp_path / "rec.wav")
+    session._arrived([(path, 1.0)])
+    session._arrived([(path, 2.0)])
+    assert session.stats()["backlog"] == 1
+
+    session.batchDelay = 0
+    assert session._nextBatch() == [(path, 1.0)]
+    # Once its batch has taken it, a rewrite is processed again
+    session._arrived([(path, 3.0)])
+    assert session.stats()["backlog"] == 2
@@ -0,0 +1,275 @@
+"""Cutting long recordings into overlapping windows and merging their detections.
+
+A window of a recording is written as its own WAV file, named after the
+recording with WINDOW_TAG and the window's number, e.g. rec__win003.wav,
+so the pipeline treats it like any other recording. Each window overlaps
+the next by the overlap, and owns the detections that start between the
+middles of its overlaps with its neighbours. Detections a window finds in
+the part owned by a neighbour are dropped, so each call is reported once,
+by the window that saw it with at least half the overlap of context on
+either side. As long as calls and the context the models need fit in half
+the overlap, the merged results match those of the whole recording.
+"""
+
+import os
+import io
+import re
+import csv
+import math
+import wave
+import threading
+from collections import namedtuple, OrderedDict
+
+from sharding import TABLE_EXTENSIONS
+from results_store import FILE_COLUMNS, START_COLUMNS, END_COLUMNS
+
+
+WINDOW_TAG = "__win"
+DEFAULT_OVERLAP_SECONDS = 60
+COPY_FRAMES = 1024 * 1024
+
+_WINDOW_STEM = re.compile(r"[^/\\]*?" + WINDOW_TAG + r"\d{3,}")
+
+# offset is where the window starts in its recording; detections starting
+# in keepFrom..keepTo (recording time) belong to it; seconds is its share
+# of the recording, for progress
+Window = namedtuple("Window", "recording path stem offset keepFrom keepTo seconds")
+
+
+def windowSpans(duration, windowSeconds, overlapSeconds):
+    """(start, end, keepFrom, keepTo) of each window of a recording, in seconds."""
+    count = max(1, int(math.ceil((duration - overlapSeconds) / float(windowSeconds))))
+    spans = []
+    for index in range(count):
+        start = index * windowSeconds
+        last = index == count - 1
+        end = duration if last else start + windowSeconds + overlapSeconds
+        keepFrom = 0.0 if index == 0 else start + overlapSeconds / 2.0
+        keepTo = math.inf if last else start + windowSeconds + overlapSeconds / 2.0
+        spans.append((start, end, keepFrom, keepTo))
+    return spans
+
+
+def _copyFrames(src, destPath, startFrame, frameCount):
+    """Write frameCount frames of the open WAV src from startFrame as a new WAV."""
+    params = src.getparams()
+    frameBytes = params.sampwidth * params.nchannels
+    src.setpos(startFrame)
+    with wave.open(destPath, "wb") as dest:
+        dest.setparams(params)
+        while frameCount > 0:
+            frames = src.readframes(min(frameCount, COPY_FRAMES))
+            if not frames:
+                break
+            dest.writeframesraw(frames)
+            frameCount -= len(frames) // frameBytes
+
+
+def writeClip(path, destPath, start, seconds):
+    """Write seconds of a WAV recording from start as destPath.
+
+    Returns the clip's length in seconds, or None if path is not a WAV
+    file the wave module can read.
+    """
+    try:
+        with wave.open(path, "rb") as src:
+            rate = src.getframerate()
+            total = src.getnframes()
+            startFrame = min(int(round(start * rate)), total)
+            frameCount = min(total - startFrame, int(round(seconds * rate)))
+            _copyFrames(src, destPath, startFrame, frameCount)
+            return frameCount / float(rate)
+    except (wave.Error, EOFError, ZeroDivisionError):
+        return None
+
+
+def splitRecording(path, destDir, windowSeconds, overlapSeconds=DEFAULT_OVERLAP_SECONDS):
+    """Write the windows of a WAV recording into destDir.
+
+    Returns its Windows, or an empty list if the recording fits in one
+    window or is not a WAV file the wave module can read.
+    """
+    stem, ext = os.path.splitext(os.path.basename(path))
+    windows = []
+    try:
+        with wave.open(path, "rb") as src:
+            rate = src.getframerate()
+            total = src.getnframes()
+            duration = total / float(rate)
+            spans = windowSpans(duration, windowSeconds, overlapSeconds)
+            if len(spans) < 2:
+                return []
+            for index, (start, end, keepFrom, keepTo) in enumerate(spans):
+                windowStem = "%s%s%03d" % (stem, WINDOW_TAG, index)
+                windowPath = os.path.join(destDir, windowStem + ext)
+                startFrame = int(round(start * rate))
+                _copyFrames(src, windowPath, startFrame,
+                            min(total, int(round(end * rate))) - startFrame)
+                windows.append(Window(path, windowPath, windowStem, startFrame / float(rate),
+                                      keepFrom, keepTo, min(keepTo, duration) - keepFrom))
+    except (wave.Error, EOFError, ZeroDivisionError):
+        return []
+    return windows
+
+
+def _findColumn(header, names):
+    for index, column in enumerate(header):
+        if column in names:
+            return index
+    return None
+
+
+def _shiftTime(text, offset):
+    """text, a time in seconds, moved by offset and written as precisely as before."""
+    value = float(text) + offset
+    text = text.strip()
+    if "e" in text.lower():
+        return repr(value)
+    decimals = len(text.partition(".")[2])
+    if not decimals and offset != int(offset):
+        decimals = 3
+    return "%.*f" % (decimals, value)
+
+
+class WindowSet:
+    """The windows of a run's long recordings.
+
+    Recordings that were not split pass through every method unchanged.
+    """
+
+    def __init__(self):
+        self._byStem = {}
+        self._byRecording = OrderedDict()
+        self._done = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._byStem)
+
+    @property
+    def recordingCount(self):
+        """Number of recordings that were split."""
+        return len(self._byRecording)
+
+    def add(self, recording, windows):
+        if windows:
+            self._byRecording[recording] = windows
+            for window in windows:
+                self._byStem[window.stem] = window
+
+    def files(self, recordings):
+        """recordings with each split one replaced by its windows, in order."""
+        files = []
+        for path in recordings:
+            windows = self._byRecording.get(path)
+            files.extend([window.path for window in windows] if windows else [path])
+        return files
+
+    def window(self, text):
+        """Window named in text, a file name or path, or None."""
+        match = _WINDOW_STEM.match(os.path.basename(text.replace("\\", "/")))
+        return self._byStem.get(match.group(0)) if match else None
+
+    def recordings(self, files):
+        """The recordings files were cut from, each once, in order."""
+        recordings = OrderedDict()
+        for path in files:
+            window = self.window(path)
+            recordings[window.recording if window else path] = True
+        return list(recordings)
+
+    def markDone(self, files):
+        """Record finished files.
+
+        Returns (recording, seconds) parts finished and the recordings that
+        are now complete.
+        """
+        parts = []
+        complete = []
+        with self._lock:
+            for path in files:
+                window = self.window(path)
+                if window is None:
+                    complete.append(path)
+                    continue
+                self._done.add(window.stem)
+                parts.append((window.recording, window.seconds))
+                if all(other.stem in self._done
+                       for other in self._byRecording[window.recording]):
+                    complete.append(window.recording)
+        return parts, complete
+
+    def translateOutput(self, outputDir):
+        """Turn the result tables in outputDir into tables of whole recordings.
+
+        Times are moved from window to recording time, file names of
+        windows are replaced by their recording's, and detections outside
+        the window's own part are dropped. Tables named after a window are
+        renamed after its recording, with the tables of a recording's
+        windows joined in window order.
+        """
+        for root, _, names in os.walk(outputDir):
+            for name in sorted(names):
+                if name.lower().endswith(TABLE_EXTENSIONS):
+                    self._translateTable(os.path.join(root, name))
+
+    def _translateTable(self, path):
+        tableWindow = self.window(path)
+        destPath = path
+        if tableWindow is not None:
+            name = os.path.basename(path).replace(
+                tableWindow.stem, os.path.splitext(os.path.basename(tableWindow.recording))[0])
+            destPath = os.path.join(os.path.dirname(path), name)
+
+        with open(path, "r", newline="") as f:
+            headerLine = f.readline()
+            data = f.read()
+        delimiter = "\t" if "\t" in headerLine else ","
+        lineEnd = "\r\n" if headerLine.endswith("\r\n") else "\n"
+        header = [column.strip().strip('"').lower()
+                  for column in headerLine.rstrip("\r\n").split(delimiter)]
+        startColumn = _findColumn(header, START_COLUMNS)
+        endColumn = _findColumn(header, END_COLUMNS)
+        fileColumn = _findColumn(header, FILE_COLUMNS)
+
+        rows = io.StringIO()
+        writer = csv.writer(rows, delimiter=delimiter, lineterminator=lineEnd)
+        for row in csv.reader(io.StringIO(data), delimiter=delimiter):
+            window = tableWindow
+            if fileColumn is not None and fileColumn < len(row):
+                window = self.window(row[fileColumn]) or tableWindow
+            if window is None or startColumn is None or startColumn >= len(row):
+                writer.writerow(row)
+                continue
+            try:
+                start = float(row[startColumn]) + window.offset
+            except ValueError:
+                # A repeated header or a note rather than a detection
+                writer.writerow(row)
+                continue
+            if not window.keepFrom <= start < window.keepTo:
+                continue
+            row[startColumn] = _shiftTime(row[startColumn], window.offset)
+            if endColumn is not None and endColumn < len(row):
+                try:
+                    row[endColumn] = _shiftTime(row[endColumn], window.offset)
+                except ValueError:
+                    pass
+            if fileColumn is not None and fileColumn < len(row):
+                recordingStem = os.path.splitext(os.path.basename(window.recording))[0]
+                row[fileColumn] = row[fileColumn].replace(window.stem, recordingStem)
+            writer.writerow(row)
+
+        if destPath != path and os.path.exists(destPath):
+            # An earlier window of the same recording; its header is already there
+            with open(destPath, "a", newline="") as f:
+                f.write(rows.getvalue())
+            os.remove(path)
+            return
+        tmpPath = destPath + ".tmp"
+        with open(tmpPath, "w", newline="") as f:
+            f.write(headerLine)
+            f.write(rows.getvalue())
+        os.replace(tmpPath, destPath)
+        if destPath != path:
+            os.remove(path)
@@ -0,0 +1,494 @@
+"""Long-lived inference worker that keeps the detector models loaded.
+
+The worker is started with the detector's own Python installation (the one
+that has torch installed) from inside the script folder:
+
+    python -u warm_worker.py --script_dir <script folder>
+
+It imports torch and loads both stage models once, then accepts jobs from
+the GUI over a localhost socket. Each job runs Inference_pipeline.py in the
+worker process with the job's arguments, so only the per-file work is paid
+on every run. The worker exits on its own after --idle_timeout seconds
+without jobs.
+
+Only the standard library is imported at module level so the GUI can use
+the client half of this module without pulling in torch.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import secrets
+import argparse
+import threading
+import subprocess
+
+from app_dirs import userDataDir, pathKey
+from progress import PROGRESS_FD_ENV, readEvents
+
+
+PIPELINE_SCRIPT = "Inference_pipeline.py"
+MODEL_PATHS = ["2_Stage_Model/first_stage.pt", "2_Stage_Model/second_stage.pt"]
+DEFAULT_IDLE_TIMEOUT = 30 * 60
+# Seconds a cancelled job gets to stop before its worker should be killed
+CANCEL_GRACE_SECONDS = 5
+
+
+class JobCancelled(BaseException):
+    """Raised inside a cancelled job; not an Exception, so pipelines do not catch it."""
+
+
+def stateFilePath(scriptDir):
+    """Location of the file advertising the worker for scriptDir."""
+    return os.path.join(userDataDir("workers"), pathKey(scriptDir) + ".json")
+
+
+def _sendMessage(sock, message):
+    sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+
+def _readMessage(stream):
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line.decode("utf-8"))
+
+
+def _pidAlive(pid):
+    if sys.platform == "win32":
+        import ctypes
+        # PROCESS_QUERY_LIMITED_INFORMATION
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WarmWorkerClient:
+    """Client used by the GUI to talk to a running warm worker."""
+
+    def __init__(self, port, token, timeout=5.0, pid=None):
+        self.port = port
+        self.token = token
+        self.timeout = timeout
+        self.pid = pid
+        self.returncode = None
+        self._jobSocket = None
+        self._jobId = None
+
+    @classmethod
+    def connect(cls, scriptDir, timeout=2.0):
+        """Return a client for scriptDir's worker, or None if none is healthy."""
+        try:
+            with open(stateFilePath(scriptDir)) as stateFile:
+                state = json.load(stateFile)
+        except (OSError, ValueError):
+            return None
+
+        if not _pidAlive(state.get("pid", -1)):
+            return None
+
+        client = cls(state["port"], state["token"], timeout=timeout, pid=state["pid"])
+        if client.ping() is None:
+            return None
+        return client
+
+    def _request(self, message, timeout):
+        sock = socket.create_connection(("127.0.0.1", self.port), timeout=timeout)
+        message["token"] = self.token
+        _sendMessage(sock, message)
+        return sock
+
+    def ping(self):
+        """Health check. Returns the worker status dict, or None if unreachable."""
+        try:
+            sock = self._request({"cmd": "ping"}, self.timeout)
+            with sock, sock.makefile("rb") as stream:
+                reply = _readMessage(stream)
+        except (OSError, ValueError):
+            return None
+        if not reply or reply.get("type") != "pong":
+            return None
+        return reply
+
+    def runJob(self, args, mmapDir=None, onProgress=None, threads=None):
+        """Run the pipeline with args in the worker and yield its output text.
+
+        .npy files under mmapDir are memory-mapped instead of read when the
+        pipeline loads them. Events the pipeline writes to its progress
+        channel are passed to onProgress. threads sets torch's thread count
+        for this job. The pipeline's exit status is stored in
+        self.returncode once the generator is exhausted.
+        """
+        self.returncode = None
+        self._jobId = secrets.token_hex(8)
+        sock = self._request({"cmd": "run", "args": list(args), "mmapDir": mmapDir,
+                              "threads": threads, "job": self._jobId}, self.timeout)
+        self._jobSocket = sock
+        # Jobs may run for hours, so only the connect itself is time limited
+        sock.settimeout(None)
+        with sock, sock.makefile("rb") as stream:
+            while True:
+                message = _readMessage(stream)
+                if message is None:
+                    raise ConnectionError("Warm worker closed the connection")
+                if message["type"] == "output":
+                    yield message["data"]
+                elif message["type"] == "progress":
+                    if onProgress is not None:
+                        onProgress(message["event"])
+                elif message["type"] == "done":
+                    self.returncode = message["returncode"]
+                    return
+                elif message["type"] == "error":
+                    raise RuntimeError(message["message"])
+
+    def cancel(self):
+        """Stop the running job.
+
+        The worker is told to abort the job, which it does before the
+        pipeline's next Python statement, and runJob stops at once. Use
+        waitStopped to make sure the job is no longer running.
+        """
+        if self._jobId is not None:
+            try:
+                sock = self._request({"cmd": "cancel", "job": self._jobId}, self.timeout)
+                sock.close()
+            except OSError:
+                pass
+        sock = self._jobSocket
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def waitStopped(self, timeout=CANCEL_GRACE_SECONDS):
+        """Wait for a cancelled job to stop. Returns False if the worker is still busy.
+
+        A job inside one long call into native code, such as a large model
+        forward pass, only stops when the call returns; a worker that stays
+        busy should then be killed.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.ping()
+            if status is None or not status["busy"]:
+                return True
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.1)
+
+    def shutdown(self):
+        """Ask the worker to exit once its current job finishes."""
+        try:
+            sock = self._request({"cmd": "shutdown"}, self.timeout)
+            sock.close()
+        except OSError:
+            pass
+
+
+def startWarmWorker(scriptDir, idleTimeout=DEFAULT_IDLE_TIMEOUT):
+    """Launch a warm worker for scriptDir with the detector's Python."""
+    bundleDir = getattr(sys, '_MEIPASS', os.path.abspath(os.path.dirname(__file__)))
+    workerScript = os.path.join(bundleDir, "warm_worker.py")
+
+    creationFlags = 0
+    if sys.platform == "win32":
+        creationFlags = subprocess.CREATE_NO_WINDOW
+
+    return subprocess.Popen(
+        ["python", "-u", workerScript, "--script_dir", scriptDir,
+         "--idle_timeout", str(idleTimeout)],
+        cwd=scriptDir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        creationflags=creationFlags)
+
+
+class _SocketWriter:
+    """File-like object that forwards pipeline output to the job's client."""
+
+    def __init__(self, sock, lock):
+        self._sock = sock
+        self._lock = lock
+        self.encoding = "utf-8"
+
+    def write(self, text):
+        if text:
+            with self._lock:
+                _sendMessage(self._sock, {"type": "output", "data": text})
+        return len(text)
+
+    def sendProgress(self, event):
+        with self._lock:
+            _sendMessage(self._sock, {"type": "progress", "event": event})
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class WarmWorkerServer:
+    """Serves pipeline jobs with the models held in memory."""
+
+    def __init__(self, scriptDir, idleTimeout=DEFAULT_IDLE_TIMEOUT):
+        self.scriptDir = os.path.abspath(scriptDir)
+        self.idleTimeout = idleTimeout
+        self.token = secrets.token_hex(16)
+        self.startTime = time.time()
+        self.lastActive = time.time()
+        self.jobsRun = 0
+        self.busy = False
+        self._jobLock = threading.Lock()
+        self._stopping = threading.Event()
+        self._modelCache = {}
+        self._mmapDir = None
+        # Thread running the pipeline and its job id, while it is inside it
+        self._pipelineThread = None
+        self._jobId = None
+        self._cancelLock = threading.Lock()
+        self._defaultThreads = None
+
+    def loadModels(self):
+        """Import torch once and keep the stage models in memory.
+
+        torch.load is wrapped so that the pipeline's own calls for the stage
+        models, or their variants' builds, are served from the cache. This
+        process runs nothing but pipeline jobs, so the wrapper affects no
+        other code. Each call gets its own copy, so a job that changes its
+        model (moving it to a device, training it) leaves the next job's
+        untouched. A model file that changes on disk is reloaded on its
+        next use.
+        """
+        import copy
+        import torch
+
+        originalLoad = torch.load
+
+        def cachedLoad(f, *args, **kwargs):
+            if not isinstance(f, (str, os.PathLike)):
+                return originalLoad(f, *args, **kwargs)
+            path = os.path.abspath(os.fspath(f))
+            key = (path, os.stat(path).st_mtime_ns)
+            if key not in self._modelCache:
+                for stale in [k for k in self._modelCache if k[0] == path]:
+                    del self._modelCache[stale]
+                self._modelCache[key] = originalLoad(f, *args, **kwargs)
+            # Copying tensors in memory is still far cheaper than unpickling the file
+            model = copy.deepcopy(self._modelCache[key])
+            if isinstance(model, torch.nn.Module):
+                model.eval()
+            return model
+
+        torch.load = cachedLoad
+        self._defaultThreads = torch.get_num_threads()
+
+        for modelPath in MODEL_PATHS:
+            fullPath = os.path.join(self.scriptDir, modelPath)
+            if os.path.exists(fullPath):
+                cachedLoad(fullPath, map_location="cpu")
+
+    def installMmapLoad(self):
+        """Make numpy.load memory-map .npy files under the current job's mmapDir.
+
+        Copy-on-write mapping keeps reads zero-copy while still letting the
+        pipeline modify the arrays it gets back.
+        """
+        try:
+            import numpy
+        except ImportError:
+            return
+
+        originalLoad = numpy.load
+
+        def mmapLoad(file, mmap_mode=None, *args, **kwargs):
+            if mmap_mode is None and self._mmapDir and \
+                    isinstance(file, (str, os.PathLike)):
+                path = os.path.abspath(os.fspath(file))
+                if path.endswith(".npy") and \
+                        path.startswith(os.path.join(self._mmapDir, "")):
+                    mmap_mode = "c"
+            return originalLoad(file, mmap_mode, *args, **kwargs)
+
+        numpy.load = mmapLoad
+
+    def _setThreads(self, threads):
+        import torch
+        torch.set_num_threads(threads or self._defaultThreads)
+
+    def _runPipeline(self, args, writer, jobId=None):
+        import runpy
+
+        scriptPath = os.path.join(self.scriptDir, PIPELINE_SCRIPT)
+        savedArgv, savedStdout, savedStderr = sys.argv, sys.stdout, sys.stderr
+        sys.argv = [scriptPath] + list(args)
+        sys.stdout = sys.stderr = writer
+
+        # The pipeline's progress channel is forwarded to the client as it
+        # would be read from a child process's pipe
+        readFd, writeFd = os.pipe()
+        os.environ[PROGRESS_FD_ENV] = str(writeFd)
+        forwarder = threading.Thread(target=self._forwardProgress,
+                                     args=(readFd, writer), daemon=True)
+        forwarder.start()
+
+        returncode = 0
+        try:
+            try:
+                with self._cancelLock:
+                    self._pipelineThread = threading.get_ident()
+                    self._jobId = jobId
+                runpy.run_path(scriptPath, run_name="__main__")
+            finally:
+                with self._cancelLock:
+                    self._pipelineThread = None
+                    self._jobId = None
+        except JobCancelled:
+            writer.write("Job cancelled\n")
+            returncode = -1
+        except SystemExit as e:
+            if isinstance(e.code, int):
+                returncode = e.code
+            elif e.code is not None:
+                writer.write(str(e.code) + "\n")
+                returncode = 1
+        except Exception:
+            import traceback
+            writer.write(traceback.format_exc())
+            returncode = 1
+        finally:
+            sys.argv, sys.stdout, sys.stderr = savedArgv, savedStdout, savedStderr
+            del os.environ[PROGRESS_FD_ENV]
+            try:
+                os.close(writeFd)
+            except OSError:
+                # The pipeline closed its end itself
+                pass
+            forwarder.join(timeout=5)
+        return returncode
+
+    def _forwardProgress(self, readFd, writer):
+        with os.fdopen(readFd, "rb") as stream:
+            readEvents(stream, writer.sendProgress)
+
+    def _handleConnection(self, conn):
+        with conn, conn.makefile("rb") as stream:
+            try:
+                message = _readMessage(stream)
+            except ValueError:
+                return
+            if not message or message.get("token") != self.token:
+                return
+
+            cmd = message.get("cmd")
+            if cmd == "ping":
+                _sendMessage(conn, {
+                    "type": "pong", "pid": os.getpid(), "busy": self.busy,
+                    "jobsRun": self.jobsRun,
+                    "uptime": time.time() - self.startTime,
+                    "models": sorted(key[0] for key in self._modelCache)})
+            elif cmd == "shutdown":
+                self._stopping.set()
+            elif cmd == "cancel":
+                self._cancelJob(message.get("job"))
+            elif cmd == "run":
+                with self._jobLock:
+                    self.busy = True
+                    mmapDir = message.get("mmapDir")
+                    self._mmapDir = os.path.abspath(mmapDir) if mmapDir else None
+                    self._setThreads(message.get("threads"))
+                    writer = _SocketWriter(conn, threading.Lock())
+                    try:
+                        returncode = self._runPipeline(message["args"], writer,
+                                                       message.get("job"))
+                        _sendMessage(conn, {"type": "done", "returncode": returncode})
+                    except (OSError, JobCancelled):
+                        # Client went away mid-job, or a cancel arrived just as
+                        # the pipeline finished; nothing left to report to
+                        pass
+                    finally:
+                        self.jobsRun += 1
+                        self._mmapDir = None
+                        self.busy = False
+                        self.lastActive = time.time()
+
+    def _cancelJob(self, jobId):
+        """Raise JobCancelled in the thread running the pipeline for job jobId."""
+        import ctypes
+        with self._cancelLock:
+            if self._pipelineThread is not None and jobId == self._jobId:
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                    ctypes.c_ulong(self._pipelineThread), ctypes.py_object(JobCancelled))
+
+    def _writeState(self, port):
+        statePath = stateFilePath(self.scriptDir)
+        tmpPath = statePath + ".tmp"
+        with open(tmpPath, "w") as stateFile:
+            json.dump({"pid": os.getpid(), "port": port, "token": self.token,
+                       "scriptDir": self.scriptDir}, stateFile)
+        os.replace(tmpPath, statePath)
+
+    def _removeState(self):
+        try:
+            with open(stateFilePath(self.scriptDir)) as stateFile:
+                if json.load(stateFile).get("pid") != os.getpid():
+                    return
+            os.remove(stateFilePath(self.scriptDir))
+        except (OSError, ValueError):
+            pass
+
+    def serve(self):
+        os.chdir(self.scriptDir)
+        sys.path.insert(0, self.scriptDir)
+        self.loadModels()
+        self.installMmapLoad()
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        listener.settimeout(1.0)
+        self._writeState(listener.getsockname()[1])
+
+        try:
+            while not self._stopping.is_set():
+                if not self.busy and time.time() - self.lastActive > self.idleTimeout:
+                    break
+                try:
+                    conn, _ = listener.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                threading.Thread(target=self._handleConnection, args=(conn,),
+                                 daemon=True).start()
+            # Let a running job finish before exiting
+            with self._jobLock:
+                pass
+        finally:
+            self._removeState()
+            listener.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ELP detector warm inference worker")
+    parser.add_argument("--script_dir", required=True,
+                        help="folder containing Inference_pipeline.py")
+    parser.add_argument("--idle_timeout", type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help="seconds without jobs before the worker exits")
+    args = parser.parse_args()
+
+    WarmWorkerServer(args.script_dir, args.idle_timeout).serve()
+
+
+if __name__ == '__main__':
+    main()
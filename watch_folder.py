@@ -0,0 +1,372 @@
+"""Continuous processing of recordings as they arrive in the sound folder."""
+
+import os
+import sys
+import time
+import queue
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from collections import deque
+
+import sharding
+from detector_runner import DetectorRun, MODEL_0, MODEL_1, indexResults
+from manifest import Manifest
+from model_variants import builtModels
+from run_log import RunLog
+from warm_worker import WarmWorkerClient, startWarmWorker
+
+
+# A file counts as complete once its size and mtime have not changed for this long
+DEFAULT_SETTLE_SECONDS = 5.0
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_BATCH_SIZE = 4
+# How long the first file of a batch waits for others to join it
+DEFAULT_BATCH_DELAY = 2.0
+# Latencies averaged for the mean shown
+LATENCY_WINDOW = 100
+# Batches' detections are indexed at most this often, and when watching stops
+INDEX_INTERVAL = 60.0
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _isCandidate(name):
+    return not name.startswith(".")
+
+
+class _Inotify:
+    """Minimal inotify binding, reporting files closed after writing or moved in."""
+
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO
+        if libc.inotify_add_watch(self._fd, os.fsencode(folder), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, "inotify_add_watch failed")
+
+    def read(self, timeout):
+        """Names of files written or moved in, or None if events were lost."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self._fd, 64 * 1024)
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self._fd)
+
+
+class FolderWatcher:
+    """Reports files in folder once they are complete.
+
+    On Linux inotify says when a file was closed after writing or moved
+    into the folder, so only those files are looked at. Elsewhere, or if
+    inotify is unavailable, the folder is listed every pollInterval
+    seconds. Either way a file is only reported once its size and mtime
+    have stayed the same for settleSeconds, as sync tools may write a file
+    in several sessions. onFiles(files) is called from the watcher thread
+    with (path, time first seen) pairs, times from time.monotonic().
+    Files known when watching starts (by default, those in the folder)
+    are only reported if inotify sees them written again.
+    """
+
+    def __init__(self, folder, onFiles, settleSeconds=DEFAULT_SETTLE_SECONDS,
+                 pollInterval=DEFAULT_POLL_INTERVAL):
+        self.folder = folder
+        self.onFiles = onFiles
+        self.settleSeconds = settleSeconds
+        self.pollInterval = pollInterval
+        self.usingInotify = False
+        self._known = set()
+        self._settling = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._inotify = None
+
+    def start(self, known=None):
+        listing = self._listFolder()
+        self._known = set(listing if known is None else known)
+        # Files that appeared since known was listed are reported once settled
+        now = time.monotonic()
+        for path in listing:
+            if path not in self._known:
+                self._settling[path] = (now, None, now)
+        if sys.platform.startswith("linux"):
+            try:
+                self._inotify = _Inotify(self.folder)
+                self.usingInotify = True
+            except (OSError, AttributeError):
+                self._inotify = None
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _listFolder(self):
+        return [path for path in sharding.listSoundFiles(self.folder)
+                if _isCandidate(os.path.basename(path))]
+
+    def _watch(self):
+        while not self._stop.is_set():
+            if self._inotify is not None:
+                timeout = self.settleSeconds / 2 if self._settling else 0.5
+                names = self._inotify.read(timeout)
+                if names is None:
+                    # The event queue overflowed; fall back to a listing once
+                    candidates = self._listFolder()
+                else:
+                    candidates = [os.path.join(self.folder, name)
+                                  for name in names if _isCandidate(name)]
+                    # A rewritten file is reported again
+                    self._known.difference_update(candidates)
+            else:
+                self._stop.wait(self.pollInterval)
+                candidates = self._listFolder()
+
+            now = time.monotonic()
+            for path in candidates:
+                if path not in self._known and path not in self._settling:
+                    self._settling[path] = (now, None, now)
+            self._checkSettled()
+
+    def _checkSettled(self):
+        now = time.monotonic()
+        done = []
+        for path, (firstSeen, signature, since) in list(self._settling.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Renamed or deleted while settling
+                del self._settling[path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                self._settling[path] = (firstSeen, current, now)
+            elif now - since >= self.settleSeconds:
+                del self._settling[path]
+                self._known.add(path)
+                done.append((path, firstSeen))
+        if done:
+            self.onFiles(sorted(done))
+
+
+class WatchSession:
+    """Watches a sound folder and runs the detector on new recordings.
+
+    Recordings the output folder's manifest has no results for are
+    processed first, then new ones as they arrive, in batches of up to
+    batchSize that a warm worker (started if none is running) handles
+    without reloading the models. Results are merged into the output
+    folder and recorded in the manifest, so stopping and starting again
+    neither loses nor repeats work. With runLog set, the session's output
+    is saved to a RunLog in the output folder. With indexResults set, the detections
+    are indexed every INDEX_INTERVAL seconds and when watching stops,
+    rather than after every batch. onStats is called with the backlog and
+    latencies whenever they change; runOptions go to DetectorRun.
+    """
+
+    def __init__(self, scriptDir, dataDir, spectDir, output=print, onStats=None,
+                 batchSize=DEFAULT_BATCH_SIZE, batchDelay=DEFAULT_BATCH_DELAY,
+                 settleSeconds=DEFAULT_SETTLE_SECONDS, keepWarm=True, runLog=True,
+                 indexResults=True, **runOptions):
+        self.scriptDir = scriptDir
+        self.dataDir = dataDir
+        self.spectDir = spectDir
+        self.output = output
+        self.onStats = onStats
+        self.batchSize = batchSize
+        self.batchDelay = batchDelay
+        self.keepWarm = keepWarm
+        self.runLog = runLog
+        self.indexResults = indexResults
+        self.runOptions = runOptions
+        self.watcher = FolderWatcher(dataDir, self._arrived, settleSeconds)
+
+        self._pending = queue.Queue()
+        # Paths waiting in _pending, so a file rewritten before its batch is queued once
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._backlog = 0
+        self._processed = 0
+        self._failed = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._unindexed = False
+        self._lastIndexed = 0.0
+        self._stop = threading.Event()
+        self._detectorRun = None
+        self._thread = None
+        self._runLog = None
+
+    def _write(self, text):
+        self.output(text)
+        runLog = self._runLog
+        if runLog is not None:
+            runLog.write(text)
+
+    def start(self):
+        if self.runLog:
+            try:
+                self._runLog = RunLog.create(self.spectDir)
+            except OSError as e:
+                self.output("Could not save the output to a log file: %s\n" % e)
+        if self.keepWarm and WarmWorkerClient.connect(self.scriptDir) is None:
+            startWarmWorker(self.scriptDir)
+            self._write("Starting a warm worker for watch mode\n")
+
+        modelPaths = [os.path.join(self.scriptDir, MODEL_0),
+                      os.path.join(self.scriptDir, MODEL_1)]
+        if self.runOptions.get("modelVariant"):
+            # The runs record the variant's models in the manifest
+            modelPaths = builtModels(self.scriptDir, self.runOptions["modelVariant"],
+                                     [MODEL_0, MODEL_1])
+        # The backlog is listed before watching starts, so the watcher only
+        # reports files that arrive afterwards
+        files = sharding.listSoundFiles(self.dataDir)
+        unprocessed = Manifest.load(self.spectDir, modelPaths).pendingFiles(files)
+        self.watcher.start(known=files)
+        self._write("Watching %s (%s); %d recordings waiting\n" % (
+            self.dataDir, "inotify" if self.watcher.usingInotify else "polling",
+            len(unprocessed)))
+        now = time.monotonic()
+        self._arrived([(path, now) for path in unprocessed])
+
+        self._lastIndexed = now
+        self._thread = threading.Thread(target=self._process, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching, cancelling the batch in progress."""
+        self._stop.set()
+        self.watcher.stop()
+        with self._lock:
+            detectorRun = self._detectorRun
+        if detectorRun is not None:
+            detectorRun.cancel()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._unindexed:
+            self._indexResults()
+        if self._runLog is not None:
+            self._runLog.close()
+            self._runLog = None
+
+    def stats(self):
+        with self._lock:
+            latencies = self._latencies
+            return {"backlog": self._backlog, "processed": self._processed,
+                    "failed": self._failed,
+                    "lastLatency": latencies[-1] if latencies else None,
+                    "meanLatency": sum(latencies) / len(latencies) if latencies else None}
+
+    def _arrived(self, files):
+        """Queue (path, arrival time) pairs for processing."""
+        with self._lock:
+            files = [(path, arrived) for path, arrived in files if path not in self._queued]
+            self._queued.update(path for path, _ in files)
+            self._backlog += len(files)
+        for item in files:
+            self._pending.put(item)
+        self._notify()
+
+    def _nextBatch(self):
+        """Wait for a file, then gather up to batchSize files for at most batchDelay."""
+        batch = []
+        while not batch:
+            if self._stop.is_set():
+                return batch
+            try:
+                batch.append(self._pending.get(timeout=0.5))
+            except queue.Empty:
+                self._indexIfDue()
+                continue
+        deadline = time.monotonic() + self.batchDelay
+        while len(batch) < self.batchSize:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        with self._lock:
+            self._queued.difference_update(path for path, _ in batch)
+        return batch
+
+    def _process(self):
+        while not self._stop.is_set():
+            batch = self._nextBatch()
+            if not batch:
+                continue
+            files = [path for path, _ in batch]
+            # Batches are small, so they skip the checkpoint, resource log,
+            # history and indexing, and their output goes to the session's log
+            options = dict(self.runOptions, files=files, incremental=True,
+                           checkpoint=False, resourceLog=False, runLog=False,
+                           history=False, indexResults=False)
+            detectorRun = DetectorRun(self.scriptDir, self.dataDir, self.spectDir,
+                                      output=self._write, **options)
+            with self._lock:
+                self._detectorRun = detectorRun
+            try:
+                returncode = detectorRun.run()
+            except Exception as e:
+                self._write("Watch batch failed: %s\n" % e)
+                returncode = 1
+
+            finished = time.monotonic()
+            with self._lock:
+                self._detectorRun = None
+                self._backlog -= len(batch)
+                if returncode == 0:
+                    self._processed += len(batch)
+                    self._unindexed = self.indexResults
+                    self._latencies.extend(finished - arrived for _, arrived in batch)
+                elif not detectorRun.cancelled:
+                    self._failed += len(batch)
+            if returncode and not detectorRun.cancelled:
+                self._write("%d recordings failed; they are tried again when watching restarts\n"
+                            % len(batch))
+            self._notify()
+            self._indexIfDue()
+
+    def _indexIfDue(self):
+        if self._unindexed and time.monotonic() - self._lastIndexed >= INDEX_INTERVAL:
+            self._indexResults()
+
+    def _indexResults(self):
+        self._unindexed = False
+        self._lastIndexed = time.monotonic()
+        indexResults(self.spectDir, self._write)
+
+    def _notify(self):
+        if self.onStats is not None:
+            self.onStats(self.stats())